@@ -6,7 +6,7 @@ from scipy import *
 
 from _classes._mzML import mzML
 from _classes._Spectrum import Spectrum
-from tome_v02 import binnspectra,bincidspectra,version_input
+from tome_v02 import version_input
 
 """
 for use with EDESI pulling
@@ -78,7 +78,7 @@ def normalizeMSSpectrum(mzList, maxValue):
 # SummedSpectrum -> pass summed
 #   -> sumSpecX, sumSpecY = binned[ion]
 #
-# ContourPlot -> grouped[ion][0][0], voltage[ion], zvals[ion]
+# ContourPlot -> mzvals, voltage, zvals
 #   -> List of lists, ContourPlot[0]: mz, [1]: voltage, [2]: Intensity
 #
 # BreakdownCurve -> mzml.pullspeciesdata(sp), voltage[ion]
@@ -223,31 +223,21 @@ if len(msmsfns) > 1: # if there is more than one msms function, ask the user whi
 else:
     fn = msmsfns[0]
 
-# pull time list, each spectrum at those time points, the scan range, and the mz range
-msms = mzml.retrieve_scans(fn=fn) # retrieve scans
-celist = mzml.functions[fn]['ce'] # collision energy list for the scans that were pulled
-limits = mzml.functions[fn]['window'] # m/z window
-zvals = [] # intensity matrix
-
-binned = binnspectra(msms, len(msms), dec=decpl, startmz=limits[0], endmz=limits[1]) # bins all spectra together
-grouped,voltage = bincidspectra(msms, celist, decpl, limits[0], limits[1], minFilter, fillzeros) # bins spectra together by collision voltage
-for ind,scan in enumerate(grouped):
-    sys.stdout.write('\rExtracting z values #%d/%d (%.1f%%) ' %(ind+1,len(grouped),float(ind+1)/float(len(grouped))*100.))
-    zvals.append(scan[1]) # append only the intensities to list
-sys.stdout.write(' DONE\n')
+# sum the spectra of each collision energy in a single pass over the scans of the function (over the m/z window of the function)
+voltage,mzvals,matrix = mzml.sum_scans_by_ce(fn, dec=decpl)
+binned = [mzvals.tolist(), matrix.sum(axis=0).tolist()] # all spectra binned together
+matrix[matrix < minFilter] = 0. # intensities below the filter are dropped from the contour
+zvals = matrix.tolist() # intensity matrix (one row for each voltage)
 
 """
-each key in msms, binned, grouped, and voltage is a single ion that is being tracked
-subkeys in msms are timepoints, containing subkeys for collision energy, x, and y
-subkeys in binned is a [[m/z],[intensities]] structure which is all spectra binned
-subkeys in grouped are voltages, which each have a [[m/z],[intensities]] spectrum
-voltage[ion] is a list of voltages
+binned is a [[m/z],[intensities]] structure which is all spectra binned
+voltage is a sorted list of the collision energies
+zvals has a row of intensities (on the m/z values of mzvals) for each voltage
 
 axes for ED ESI plots
-for each ion:
-    xvalues = grouped[ion][0][0]
-    yvalues = voltage[ion]
-    z values = zvals[ion]
+    xvalues = mzvals
+    yvalues = voltage
+    z values = zvals
 
 !!!!! new 2016-07-25-----------------------------------------------------------------------------------------
 rewritten to work with the mzML v2.4 functions and output
@@ -257,11 +247,13 @@ the collision energy list can be pulled directly from the mzml object, as can th
 binnspectra and bincidspectra have been rewritten to accept list of lists
 this means that the dictionary format of the outputs is no longer required, and can be simple list of lists (all ion keys are *hopefully* removed)
 
+!!!!! the scans are no longer retrieved and regrouped (retrieve_scans/bincidspectra), mzml.sum_scans_by_ce sums them by collision energy while streaming
+
 """
 #ContourPlotLV = ""
 #for ion in msms:
 PlotEDESI(binned, 
-        [grouped[0][0], voltage, zvals], 
+        [mzvals, voltage, zvals], 
         )
     #print ion
     #levels = arange(minFilter, max(array(zvals[ion]).max(axis=1)), 6)
@@ -13,6 +13,17 @@ CHANGELOG:
 - several changes to accept a more general sp input from excel pulling
 - added kwargs calling (plot, verbose)
 - fixed pulling of existing data from excel file (I think)
+- writes the isotope pattern fit of every summed scan for species with formulas (sheets "n Fit (mode)")
+- chromatograms are decoded one at a time from the mzML chromatogram index as they are written
+- the extracted data of each species are kept in a results cache keyed on the contents of the mzML file and the definition
+  of the species (see PyRSIRCache), so a re-run only extracts species whose definition changed and only loads the mzML if needed
+- added pyrsirbatch to process a list (or glob) of runs with one parameter workbook in a pool of worker processes
+  (the species are prepared once, every run is written to its own workbook, and a combined summary workbook is written)
+- pyrsir accepts prepared species (species keyword argument) and returns the species, time, tic, and function dictionaries
+- the traces of all species are binned together for every n at once (binarray), optionally with a sliding window
+  (sliding keyword argument) and with an explicit policy for trailing scans which do not fill a bin (remainder keyword argument)
+- the output sheets can be streamed into the workbook row by row (writeonly keyword argument), which is much faster and
+  smaller in memory for long runs (the existing sheets are kept as values only)
 
 ---27.6 incompatible with mzML v2.4 or greater
 
@@ -32,6 +43,11 @@ doi: 10.1038/nbt.2377
 5) set the number of scans to sum (any positive integer or list of positive integers) in the n parameter below
    (if no summing is desired, set n = 1)
 
+To process several runs with the same parameters, call pyrsirbatch with a list of file names or a glob pattern
+(e.g. pyrsirbatch('*.mzML.gz','parameters.xlsx',[1,3],processes=4)). Each run is written to a copy of the parameter
+workbook named after the run, and the totals of every species in every run are written to a summary workbook.
+From the command line: python PyRSIR.py "<file name or glob>" <excel file> <n (comma separated)> [number of processes]
+
 The species names, start m/z, and end m/z values should be contained within a sheet named "parameters"
 The first row is ignored for labelling convenience of the user.
 
@@ -132,6 +148,7 @@ def pyrsir(filename,xlsx,n,**kwargs):
                 for num in n:
                     delete.append(str(num)+' Sum ('+sp[key]['affin']+')')
                     delete.append(str(num)+' Normalized ('+sp[key]['affin']+')')
+                    delete.append(str(num)+' Fit ('+sp[key]['affin']+')')
             delete.append('Isotope Patterns')
             xlfile.removesheets(delete) # remove those sheets
             if ks['verbose'] is True:
@@ -158,14 +175,29 @@ def pyrsir(filename,xlsx,n,**kwargs):
                         xlfile.writersim(sp,rtime[sumkey+mode],sumkey,sheetname,mode,tic[sumkey+mode]) # write summed data
                     sheetname = str(num)+' Normalized ('+mode+')'
                     xlfile.writersim(sp,rtime[sumkey+mode],normkey,sheetname,mode) # write normalized data
+                    if len([key for key in sp if sp[key].has_key(str(num)+'fit')]) > 0:
+                        sheetname = str(num)+' Fit ('+mode+')'
+                        xlfile.writersim(sp,rtime[sumkey+mode],str(num)+'fit',sheetname,mode) # write isotope pattern fit scores
         
         for key,val in sorted(sp.items()): # write isotope patterns
             if sp[key]['affin'] in mskeys:
                 xlfile.writemultispectrum(sp[key]['spectrum'][0],sp[key]['spectrum'][1],'m/z','intensity','Isotope Patterns',key)
         
-        if rd is None:
-            for key,val in sorted(chroms.items()): # write chromatograms
-                xlfile.writemultispectrum(chroms[key]['x'],chroms[key]['y'],chroms[key]['xunit'],chroms[key]['yunit'],'Function Chromatograms',key)
+        if rd is False: # chromatograms are only in the mzML file (or the results cache)
+            chroms = cache.get(cache.key('chromatograms')) if cache is not None else None
+            if chroms is None:
+                mzml = openmzml()
+                chroms = []
+                for key in sorted(mzml.chromindex): # write chromatograms (each is decoded only when it is written)
+                    chrom = mzml.chromatogram(key)
+                    xlfile.writemultispectrum(chrom['x'].tolist(),chrom['y'].tolist(),chrom['xunit'],chrom['yunit'],'Function Chromatograms',key)
+                    if cache is not None:
+                        chroms.append([key,chrom['x'].tolist(),chrom['y'].tolist(),chrom['xunit'],chrom['yunit']])
+                if cache is not None:
+                    cache.put(cache.key('chromatograms'),chroms)
+            else:
+                for key,x,y,xunit,yunit in chroms: # write cached chromatograms
+                    xlfile.writemultispectrum(x,y,xunit,yunit,'Function Chromatograms',key)
         
         uvstuff = False
         for key in sp: # check for UV-Vis spectra
@@ -179,34 +211,49 @@ def pyrsir(filename,xlsx,n,**kwargs):
         
         if sumspec is not None: # write all summed spectra
             for fn in sumspec:
-                specname = '%s %s' %(mzml.functions[fn]['mode'],mzml.functions[fn]['level'])
-                if mzml.functions[fn].has_key('target'):
-                    specname += ' %.3f' %mzml.functions[fn]['target']
-                specname += ' (%.3f-%.3f)' %(mzml.functions[fn]['window'][0],mzml.functions[fn]['window'][1])
+                specname = '%s %s' %(functions[fn]['mode'],functions[fn]['level'])
+                if functions[fn].has_key('target'):
+                    specname += ' %.3f' %functions[fn]['target']
+                specname += ' (%.3f-%.3f)' %(functions[fn]['window'][0],functions[fn]['window'][1])
                 xlfile.writemultispectrum(sumspec[fn][0],sumspec[fn][1],'m/z','counts','Summed Spectra',specname)
             
         if ks['verbose'] is True:
             sys.stdout.write(' DONE\n')        
            
+    def openmzml():
+        """loads the mzML file (once, and only when something has to be extracted from it)"""
+        if loaded.has_key('mzml') is False:
+            loaded['mzml'] = mzML(filename,verbose=ks['verbose'])
+        return loaded['mzml']
+    
     def prepformula(dct):
         """looks for formulas in a dictionary and prepares them for pullspeciesdata"""
         for species in dct:
             if dct[species].has_key('affin') is False: # set affinity if not specified
                 fn = dct[species]['function']
-                if mzml.functions[fn]['type'] == 'MS':
-                    dct[species]['affin'] = mzml.functions[fn]['mode']
-                if mzml.functions[fn]['type'] == 'UV':
+                if functions[fn]['type'] == 'MS':
+                    dct[species]['affin'] = functions[fn]['mode']
+                if functions[fn]['type'] == 'UV':
                     dct[species]['affin'] = 'UV'
-            if dct[species].has_key('formula') and dct[species]['formula'] is not None:
-                try:
-                    dct[species]['mol'].res = res # sets resolution in Molecule object
-                except NameError:
-                    res = int(mzml.auto_resolution())
-                    dct[species]['mol'].res = res
-                dct[species]['mol'].sigma = dct[species]['mol'].sigmafwhm()[1] # recalculates sigma with new resolution
-                dct[species]['bounds'] = dct[species]['mol'].bounds(0.95) # caclulates bounds
+        formulas = [species for species in dct if dct[species].has_key('formula') and dct[species]['formula'] is not None]
+        if len(formulas) > 0:
+            if fileinfo['resolution'] is None: # determined once for each file
+                fileinfo['resolution'] = int(openmzml().auto_resolution())
+                if cache is not None:
+                    cache.put(cache.key('file'),fileinfo)
+            res = fileinfo['resolution']
+            for species in formulas: # molecule at the resolution of the file (isotope patterns are not recalculated)
+                dct[species]['mol'] = dct[species]['mol'].atresolution(res)
+            bounds = Molecule.batchbounds([dct[species]['mol'] for species in formulas],0.95) # caclulates bounds
+            for species,bnds in zip(formulas,bounds):
+                dct[species]['bounds'] = bnds
         return dct
     
+    def trimspectrum(spectrum,bounds):
+        """trims a summed spectrum (paired x,y lists) to the supplied bounds"""
+        pairs = [(x,y) for x,y in zip(spectrum[0],spectrum[1]) if x >= bounds[0] and x <= bounds[1]]
+        return [[x for x,y in pairs],[y for x,y in pairs]]
+    
     # ----------------------------------------------------------
     # -------------------PROGRAM BEGINS-------------------------
     # ----------------------------------------------------------
@@ -214,6 +261,11 @@ def pyrsir(filename,xlsx,n,**kwargs):
     'plot': True, # plot the data for a quick look
     'verbose': True, # chatty
     'bounds confidence': 0.99, # confidence interval for automatically generated bounds
+    'cache': True, # keep the extracted data in a results cache next to the mzML file (see PyRSIRCache)
+    'species': None, # species which have already been prepared with prepspecies (the parameter sheet is not read)
+    'sliding': False, # sum a window of n scans starting at every scan rather than consecutive bins of n scans
+    'remainder': 'drop', # trailing scans which do not fill a bin: 'drop', 'partial' (summed as a smaller bin), or 'scale' (scaled up to n scans)
+    'writeonly': False, # stream the output sheets into the workbook (faster for long runs, but the formatting of existing sheets is not kept)
     }
     if set(kwargs.keys()) - set(ks.keys()): # check for invalid keyword arguments
         string = ''
@@ -222,13 +274,15 @@ def pyrsir(filename,xlsx,n,**kwargs):
         raise KeyError('Unsupported keyword argument(s): %s' %string)
     ks.update(kwargs) # update defaules with provided keyword arguments
     
-    global tome_v02,_ScriptTime,_mzML,_Spectrum,_Molecule,_XLSX
-    from tome_v02 import bindata
+    global tome_v02,_ScriptTime,_mzML,_Spectrum,_Molecule,_FrozenMolecule,_XLSX,_PyRSIRCache
+    from tome_v02 import binarray
     from _classes._ScriptTime import ScriptTime
     from _classes._mzML import mzML
     from _classes._Spectrum import Spectrum
     from _classes._Molecule import Molecule
+    from _classes._FrozenMolecule import FrozenMolecule
     from _classes._XLSX import XLSX
+    from _classes._PyRSIRCache import PyRSIRCache
     
     if ks['verbose'] is True:
         stime = ScriptTime()
@@ -236,19 +290,19 @@ def pyrsir(filename,xlsx,n,**kwargs):
     
     n = checkinteger(n,'number of scans to sum') # checks integer input and converts to list
     
-    if ks['verbose'] is True:
-        sys.stdout.write('Loading processing parameters from excel file')
-        sys.stdout.flush()
-    xlfile = XLSX(xlsx)
-    sp = xlfile.pullrsimparams()
+    xlfile = XLSX(xlsx,verbose=ks['verbose'],writeonly=ks['writeonly'])
+    if ks['species'] is None:
+        if ks['verbose'] is True:
+            sys.stdout.write('Loading processing parameters from excel file')
+            sys.stdout.flush()
+        sp = prepspecies(xlfile,ks['bounds confidence'])
+        if ks['verbose'] is True:
+            sys.stdout.write(' DONE\n')
+    else: # copied so that the prepared species can be reused
+        import copy
+        sp = copy.deepcopy(ks['species'])
     
     mskeys = ['+','-']
-    for key in sp:
-        if sp[key]['formula'] is not None: # if formula is specified
-            sp[key]['mol'] = Molecule(sp[key]['formula']) # create Molecule object
-            sp[key]['bounds'] = sp[key]['mol'].bounds(ks['bounds confidence']) # generate bounds from molecule object with this confidence interval
-    if ks['verbose'] is True:
-        sys.stdout.write(' DONE\n')
     
     
     rtime = {} # empty dictionaries for time and tic
@@ -273,6 +327,21 @@ def pyrsir(filename,xlsx,n,**kwargs):
         if ks['verbose'] is True:
             sys.stdout.write(' DONE\n')
     
+    loaded = {} # the mzML instance (only loaded if needed, see openmzml())
+    cache = None
+    if ks['cache'] is True:
+        path = PyRSIRCache.locate(filename)
+        if path is None: # the raw file has to be converted first
+            path = openmzml().filename
+        cache = PyRSIRCache(path,verbose=ks['verbose'])
+    fileinfo = cache.get(cache.key('file')) if cache is not None else None # functions and resolution of the file
+    if fileinfo is None:
+        mzml = openmzml() # load mzML class (required for affinities and resolution)
+        mzml.function_timetic()
+        fileinfo = {'functions': mzml.functions, 'resolution': None}
+        if cache is not None:
+            cache.put(cache.key('file'),fileinfo)
+    functions = fileinfo['functions']
     sp = prepformula(sp)
     newpeaks = False
     if rd is True:
@@ -288,56 +357,92 @@ def pyrsir(filename,xlsx,n,**kwargs):
             ips = xlfile.pullmultispectrum('Isotope Patterns') # pull predefined isotope patterns and add them to species
             for species in ips: # set spectrum list
                 sp[species]['spectrum'] = [ips[species]['x'],ips[species]['y']]
-            mzml = mzML(filename) # load mzML class
             #newsp = prepformula(newsp) # prep formula species for summing
             for species in newsp:
                 if newsp[species].has_key('spectrum') is False:
                     newsp[species]['spectrum'] = Spectrum(3,newsp[species]['bounds'][0],newsp[species]['bounds'][1])
-            newsp = mzml.pull_species_data(newsp) # pull data
+            newsp = openmzml().pull_species_data(newsp) # pull data
         else:
             if ks['verbose'] is True:
                 sys.stdout.write('No new peaks were specified. Proceeding directly to summing and normalization.\n')
     
     if rd is False: # if no raw data is present, process mzML file
-        mzml = mzML(filename,verbose=ks['verbose']) # load mzML class
         #sp = prepformula(sp)
-        sp,sumspec = mzml.pull_species_data(sp,True) # pull relevant data from mzML
-        chroms = mzml.pull_chromatograms() # pull chromatograms from mzML
+        import numpy as np
+        sumspec = cache.get(cache.key('sumspec')) if cache is not None else None
+        newsp = {} # species which are not in the results cache
+        for key in sp:
+            entry = cache.get(cache.specieskey(sp[key])) if cache is not None else None
+            if entry is None:
+                newsp[key] = sp[key]
+                continue
+            sp[key].update(entry) # raw data, function, and fit rows
+            if entry.has_key('fitrows') is True:
+                sp[key]['fitgrid'] = sp[key]['mol'].fitgrid()
+                sp[key]['fitrows'] = np.array(entry['fitrows'])
+        if len(newsp) > 0 or sumspec is None:
+            if cache is not None:
+                keys = dict([(key,cache.specieskey(newsp[key])) for key in newsp]) # keyed on the definitions before extraction
+                if ks['verbose'] is True and len(newsp) < len(sp):
+                    sys.stdout.write('%d of %d species were found in the results cache.\n' %(len(sp)-len(newsp),len(sp)))
+            newsp,sumspec = openmzml().pull_species_data(newsp,True,fits=True) # pull relevant data from mzML (and sample each scan for isotope pattern fits)
+            for fn in sumspec:
+                sumspec[fn] = sumspec[fn].trim() # convert Spectrum objects into x,y lists
+            if cache is not None:
+                for key in newsp:
+                    entry = {'raw': newsp[key]['raw'], 'function': newsp[key]['function']}
+                    if newsp[key].has_key('fitrows') is True:
+                        entry['fitrows'] = newsp[key]['fitrows'].tolist()
+                    cache.put(keys[key],entry)
+                cache.put(cache.key('sumspec'),sumspec)
+        elif ks['verbose'] is True:
+            sys.stdout.write('The data of every species were found in the results cache.\n')
         rtime = {}
         tic = {}
         for key in sp: # compare predicted isotope patterns to the real spectrum and save standard error of the regression
             func = sp[key]['function']
-            if mzml.functions[func]['type'] == 'MS': # determine mode key
-                sp[key]['spectrum'] = sumspec[sp[key]['function']].trim(xbounds=sp[key]['bounds']) # extract the spectrum object
-                mode = 'raw'+mzml.functions[func]['mode']
-            if mzml.functions[func]['type'] == 'UV':
+            if functions[func]['type'] == 'MS': # determine mode key
+                sp[key]['spectrum'] = trimspectrum(sumspec[sp[key]['function']],sp[key]['bounds']) # extract the spectrum
+                mode = 'raw'+functions[func]['mode']
+            if functions[func]['type'] == 'UV':
                 mode = 'rawUV'
             if mode not in rtime: # if rtime and tic have not been pulled from that function
-                rtime[mode] = mzml.functions[func]['timepoints']
-                tic[mode] = mzml.functions[func]['tic']
+                rtime[mode] = functions[func]['timepoints']
+                tic[mode] = functions[func]['tic']
             if sp[key]['formula'] is not None:
                 sp[key]['match'] = sp[key]['mol'].compare(sp[key]['spectrum'])
-        for fn in sumspec:
-            sumspec[fn] = sumspec[fn].trim() # convert Spectrum objects into x,y lists
     
+    binning = {'sliding': ks['sliding'], 'remainder': ks['remainder']}
     if max(n) > 1: # run combine functions if n > 1
-        for num in n: # for each n to sum
-            if ks['verbose'] is True:
-                sys.stdout.write('\r%d Summing species traces.' %num)
-            sumkey = str(num)+'sum'
-            for ind,key in enumerate(sp): # bin each species
-                if sp[key]['affin'] in mskeys or mzml.functions[sp[key]['function']]['type'] == 'MS': # if species is MS related
-                    sp[key][sumkey] = bindata(num,1,sp[key]['raw'])
-            for mode in mskeys: 
-                sumkey = str(num)+'sum'+mode
-                modekey = 'raw'+mode
-                if modekey in rtime.keys(): # if there is data for that mode
-                    rtime[sumkey] = bindata(num,num,rtime[modekey])
-                    tic[sumkey] = bindata(num,1,tic[modekey])
+        if ks['verbose'] is True:
+            sys.stdout.write('\rSumming species traces.')
+        traces = {} # MS species with traces of the same length are binned together
+        for key in sp:
+            if sp[key]['affin'] in mskeys or functions[sp[key]['function']]['type'] == 'MS': # if species is MS related
+                traces.setdefault(len(sp[key]['raw']),[]).append(key)
+        for keys in traces.values():
+            binned = binarray(n,[sp[key]['raw'] for key in keys],**binning) # every n for every species at once
+            for num in n:
+                for key,row in zip(keys,binned[num].tolist()):
+                    sp[key][str(num)+'sum'] = row
+        for mode in mskeys: 
+            modekey = 'raw'+mode
+            if modekey in rtime.keys(): # if there is data for that mode
+                times = binarray(n,rtime[modekey],True,**binning)
+                tics = binarray(n,tic[modekey],**binning)
+                for num in n:
+                    rtime[str(num)+'sum'+mode] = times[num].tolist()
+                    tic[str(num)+'sum'+mode] = tics[num].tolist()
         if ks['verbose'] is True:
             sys.stdout.write(' DONE\n')
             sys.stdout.flush()
     
+    for key in sp: # score the predicted isotope pattern against every (summed) scan
+        if sp[key].has_key('fitrows') is True:
+            binned = binarray(n,sp[key]['fitrows'].T,**binning) # the samples of each scan are the columns
+            for num in n:
+                sp[key][str(num)+'fit'] = sp[key]['mol'].fitscores(binned[num].T,1,sp[key]['fitgrid'])
+    
     for num in n: # normalize each peak's chromatogram
         if ks['verbose'] is True:
             sys.stdout.write('\r%d Normalizing species traces.' %num)
@@ -348,7 +453,7 @@ def pyrsir(filename,xlsx,n,**kwargs):
             modekey = 'raw'+mode
             if modekey in rtime.keys(): # if there is data for that mode
                 for key in sp: # for each species
-                    if sp[key]['affin'] in mskeys or mzml.functions[sp[key]['function']]['type'] == 'MS': # if species has affinity
+                    if sp[key]['affin'] in mskeys or functions[sp[key]['function']]['type'] == 'MS': # if species has affinity
                         sp[key][normkey] = []
                         for ind,val in enumerate(sp[key][sumkey]):
                             #sp[key][normkey].append(val/(mzml.function[func]['tic'][ind]+0.01)) #+0.01 to avoid div/0 errors
@@ -382,15 +487,192 @@ def pyrsir(filename,xlsx,n,**kwargs):
             sys.stdout.write(' DONE\n')
     if ks['verbose'] is True:
         stime.printelapsed()           
+    return sp,rtime,tic,functions
 
-import sys
-if len(sys.argv) > 1: # if script was initiated from the command line, pull parameters from there
+def batchrun(args):
+    """
+    processes one run of a batch (called in the worker processes of pyrsirbatch)
+    returns the run, the summary rows of its species, and the traceback if the run failed
+    """
+    run,outxlsx,n,sp,kwargs = args
+    try:
+        sp,rtime,tic,functions = pyrsir(run,outxlsx,n,species=sp,plot=False,verbose=False,**kwargs)
+    except Exception: # reported in the summary rather than stopping the other runs
+        import traceback
+        return run,[],traceback.format_exc()
+    rows = []
+    for key in sorted(sp):
+        raw = sp[key].get('raw',[])
+        modekey = 'raw'+str(sp[key].get('affin'))
+        row = [
+        run,
+        key,
+        sp[key].get('affin'),
+        sp[key].get('function'),
+        sp[key]['bounds'][0],
+        sp[key]['bounds'][1],
+        sum(raw) if len(raw) > 0 else None,
+        max(raw) if len(raw) > 0 else None,
+        None,
+        sp[key].get('match'),
+        ]
+        times = rtime.get(modekey,[]) # species without a function were read from an existing raw data sheet
+        if functions.has_key(sp[key].get('function')) is True: # the time points of the species' own function
+            times = functions[sp[key]['function']]['timepoints']
+        if len(raw) > 0 and len(times) == len(raw): # time of the maximum
+            row[8] = times[raw.index(row[7])]
+        rows.append(row)
+    return run,rows,None
+
+def prepspecies(xlfile,confidence=0.99):
+    """
+    reads the species from the parameter sheet of an XLSX instance and calculates the molecule and bounds of
+    every species with a formula (these are refined to the resolution of each file by pyrsir)
+    """
+    from _classes._FrozenMolecule import FrozenMolecule
+    sp = xlfile.pullrsimparams()
+    for key in sp:
+        if sp[key]['formula'] is not None: # if formula is specified
+            sp[key]['mol'] = FrozenMolecule(sp[key]['formula']) # create (or look up) Molecule object
+            sp[key]['bounds'] = sp[key]['mol'].bounds(confidence) # generate bounds from molecule object with this confidence interval
+    return sp
+
+def pyrsirbatch(runs,xlsx,n,**kwargs):
+    """
+    Processes several runs with the same parameter workbook
+    
+    runs: a list of file names, or a glob pattern (lists may also contain patterns)
+    xlsx: the excel file containing the parameters sheet
+    n: the number of scans to sum (integer or list of integers)
+    
+    The species are read and prepared once. Every run is processed by pyrsir in a pool of worker processes and
+    written to a copy of the parameter workbook named after the run (any existing workbook of that name is replaced).
+    The totals, maxima, and isotope pattern matches of every species in every run are written to a summary workbook.
+    Returns a dictionary of the runs which failed and their tracebacks.
+    """
+    import os,glob,shutil,multiprocessing
+    ks = { # default keyword arguments
+    'processes': None, # number of worker processes (None: the number of processors; 1 processes the runs in this process)
+    'outdir': None, # directory for the output workbooks (None: the directory of each run)
+    'summary': 'PyRSIR summary.xlsx', # the combined summary workbook
+    'verbose': True, # chatty
+    'bounds confidence': 0.99, # confidence interval for automatically generated bounds
+    'cache': True, # keep the extracted data in a results cache next to each mzML file (see PyRSIRCache)
+    'sliding': False, # sum a window of n scans starting at every scan rather than consecutive bins of n scans
+    'remainder': 'drop', # trailing scans which do not fill a bin: 'drop', 'partial', or 'scale' (see pyrsir)
+    'writeonly': False, # stream the output sheets of each run into its workbook (see pyrsir)
+    }
+    if set(kwargs.keys()) - set(ks.keys()): # check for invalid keyword arguments
+        string = ''
+        for i in set(kwargs.keys()) - set(ks.keys()):
+            string += ` i`
+        raise KeyError('Unsupported keyword argument(s): %s' %string)
+    ks.update(kwargs) # update defaules with provided keyword arguments
+    
+    from _classes._ScriptTime import ScriptTime
+    from _classes._XLSX import XLSX
+    if ks['verbose'] is True:
+        stime = ScriptTime()
+        stime.printstart()
+    
+    if type(n) != list and type(n) != tuple:
+        n = [n]
+    for num in n: # checked here rather than in each worker
+        if type(num) != int or num < 1:
+            raise ValueError('The number of scans to sum (%s) must be an integer greater than 0.' %str(num))
+    
+    if isinstance(runs,basestring):
+        runs = [runs]
+    files = []
+    for pattern in runs: # expand the glob patterns (names without matches are kept, pyrsir may convert them)
+        found = sorted(glob.glob(pattern))
+        if len(found) == 0:
+            found = [pattern]
+        for name in found:
+            if name not in files:
+                files.append(name)
+    if len(files) == 0:
+        raise ValueError('No runs were supplied to pyrsirbatch.')
+    
+    if ks['verbose'] is True:
+        sys.stdout.write('Loading processing parameters from excel file')
+        sys.stdout.flush()
+    xlfile = XLSX(xlsx,verbose=False)
+    sp = prepspecies(xlfile,ks['bounds confidence'])
+    if ks['verbose'] is True:
+        sys.stdout.write(' DONE\n')
+    
+    jobs = []
+    outputs = {}
+    for run in files:
+        base = os.path.basename(run.rstrip('/\\'))
+        for ext in ['.gz','.mzml','.raw']: # strip the extensions of the run
+            if base.lower().endswith(ext):
+                base = base[:-len(ext)]
+        outdir = ks['outdir'] if ks['outdir'] is not None else os.path.dirname(run.rstrip('/\\'))
+        outxlsx = os.path.join(outdir,base+'.xlsx')
+        if outputs.has_key(outxlsx) is True:
+            raise ValueError('The runs "%s" and "%s" would both be written to "%s".' %(outputs[outxlsx],run,outxlsx))
+        outputs[outxlsx] = run
+        if os.path.normcase(os.path.abspath(outxlsx)) != os.path.normcase(os.path.abspath(xlfile.bookname)):
+            shutil.copyfile(xlfile.bookname,outxlsx) # each run is written to a copy of the parameter workbook
+        jobs.append((run,outxlsx,n,sp,{'cache': ks['cache'], 'sliding': ks['sliding'], 'remainder': ks['remainder'], 'writeonly': ks['writeonly']}))
+    
+    processes = ks['processes'] if ks['processes'] is not None else multiprocessing.cpu_count()
+    processes = max(1,min(processes,len(jobs)))
+    if ks['verbose'] is True:
+        sys.stdout.write('Processing %d runs in %d process%s\n' %(len(jobs),processes,'es' if processes > 1 else ''))
+    results = {}
+    if processes == 1:
+        finished = (batchrun(job) for job in jobs)
+    else:
+        pool = multiprocessing.Pool(processes)
+        finished = pool.imap_unordered(batchrun,jobs)
     try:
-        pyrsir(sys.argv[1],sys.argv[2],sys.arg[3])
-    except IndexError:
-        raise IOError('The pyrsim function requires three inputs:\n- The raw filename\n- The excel parameters file\n- The number of scans to sum')
+        for run,rows,error in finished:
+            results[run] = rows,error
+            if ks['verbose'] is True:
+                sys.stdout.write('\r%d of %d runs processed' %(len(results),len(jobs)))
+                sys.stdout.flush()
+    finally:
+        if processes > 1:
+            pool.terminate() # all results have been collected (or processing was interrupted)
+            pool.join()
+    if ks['verbose'] is True:
+        sys.stdout.write(' DONE\n')
+    
+    failed = dict([(run,results[run][1]) for run in files if results[run][1] is not None])
+    summary = XLSX(ks['summary'],create=True,verbose=False)
+    summary.removesheets(['Summary','Failed runs'])
+    rows = []
+    for run in files:
+        rows.extend(results[run][0])
+    summary.writetable(rows,'Summary',['Run','Species','Affinity','Function','Start','End','Total','Maximum','Time of maximum','std err of reg'])
+    if len(failed) > 0:
+        summary.writetable([[run,failed[run].strip().split('\n')[-1]] for run in files if run in failed],'Failed runs',['Run','Error'])
+    if ks['verbose'] is True:
+        sys.stdout.write('Saving summary "%s"' %summary.bookname)
+        sys.stdout.flush()
+    summary.save()
+    if ks['verbose'] is True:
+        sys.stdout.write(' DONE\n')
+        for run in files:
+            if run in failed:
+                sys.stdout.write('\n"%s" failed:\n%s' %(run,failed[run]))
+        stime.printelapsed()
+    return failed
 
+import sys
 if __name__ == '__main__':    
+    if len(sys.argv) > 1: # if script was initiated from the command line, pull parameters from there
+        if len(sys.argv) < 4:
+            raise IOError('PyRSIR requires three inputs:\n- The raw filename (or a glob pattern of several runs)\n- The excel parameters file\n- The number of scans to sum (comma separated)\nand optionally the number of processes for several runs')
+        cli = [int(num) for num in sys.argv[3].split(',')]
+        if len(sys.argv) > 4 or any([char in sys.argv[1] for char in '*?[']): # several runs
+            pyrsirbatch(sys.argv[1],sys.argv[2],cli,processes=int(sys.argv[4]) if len(sys.argv) > 4 else None)
+        else:
+            pyrsir(sys.argv[1],sys.argv[2],cli)
+        sys.exit()
     pyrsir(filename,xlsx,n)
     sys.stdout.write('fin.')
     sys.stdout.flush()
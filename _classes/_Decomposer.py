@@ -0,0 +1,238 @@
+"""
+Decomposer class
+Finds the elemental compositions which match a supplied m/z value
+
+The allowed elements are split into a heavy and a light group and the masses of every combination within
+each group are precomputed when the instance is created. A query then only has to search the sorted light
+masses for the window remaining after each heavy combination (meet-in-the-middle), which keeps queries fast.
+Candidates can be ranked by comparing their predicted isotope patterns (Molecule class) to a real spectrum.
+
+The mass used for each element is that of its most abundant isotope (the 0 key of the mass dictionary), so the
+m/z being decomposed must be that of the isotopologue made of the most abundant isotope of every element. This is
+not the exact mass of the Molecule class (em), which is the mass of the most intense peak of the isotope pattern:
+for species containing e.g. Cl, Br, or Pd the two differ by several Da, and the tallest peak of a spectrum will not
+decompose to the right formula. (Masses of the most intense peak are not additive, so they cannot be enumerated.)
+
+new:
+    ---1.0
+"""
+
+class Decomposer(object):
+    def __init__(self,elements=None,**kwargs):
+        """
+        Enumerates elemental compositions within a mass tolerance
+
+        elements: (dict) the elements (or abbreviations defined in _formabbrvs.py) to consider
+            each key is the element and each value is either a maximum count or a [minimum,maximum] pair
+            default {'C':60,'H':120,'N':6,'O':12}
+        ppm: (float) tolerance for matching in parts per million
+        charge: (int) charge of the species being decomposed
+        """
+        self.ks = { # default keyword arguments
+        'verbose': False, # toggle verbose
+        'ppm': 5., # tolerance in parts per million
+        'charge': 1, # charge of the species
+        'res': 5000, # resolution of the instrument (used for ranking by isotope pattern)
+        'masstable': 'nist', # mass table to use ('nist' or 'crc')
+        }
+        if set(kwargs.keys()) - set(self.ks.keys()): # check for invalid keyword arguments
+            string = ''
+            for i in set(kwargs.keys()) - set(self.ks.keys()):
+                string += ` i`
+            raise KeyError('Unsupported keyword argument(s): %s' %string)
+        self.ks.update(kwargs) # update defaults with provided keyword arguments
+
+        if elements is None:
+            elements = {'C':60,'H':120,'N':6,'O':12}
+        from _MassTable import MassTable # compiled mass tables
+        from _formabbrvs import abbrvs # common abbreviations
+        self.md = MassTable(self.ks['masstable'])
+        self.abbrvs = abbrvs
+        self.sys = __import__('sys')
+        self.np = __import__('numpy')
+        self.elements = self.interpretconstraints(elements)
+        self.prepare()
+
+    def __str__(self):
+        return 'Decomposer over %s' %', '.join(['%s %d-%d' %(ele,lo,hi) for ele,mass,lo,hi in self.table])
+
+    def __repr__(self):
+        return '%s(%s)' %(self.__class__.__name__,str(self.elements))
+
+    def blockmass(self,key):
+        """determines the mass of an element or abbreviation"""
+        if key in self.abbrvs: # abbreviation block
+            out = 0.
+            for ele in self.abbrvs[key]:
+                out += self.md.mass(ele)*self.abbrvs[key][ele]
+            return out
+        if self.md.has_key(key) is True: # element
+            return self.md.mass(key)
+        raise ValueError('The element "%s" is not defined in the predefined common abbreviations nor in the NIST element database, please check your input.' %key)
+
+    def decompose(self,mz,ppm=None,charge=None):
+        """
+        finds all compositions whose m/z falls within the tolerance of the supplied m/z
+
+        mz: (float) the m/z value to decompose
+            this must be the m/z of the most abundant isotope of every element, not the tallest peak of the isotope
+            pattern (these differ for elements such as Cl, Br, or Pd where the heavier isotopes are also abundant)
+        ppm: (float) tolerance in parts per million (defaults to the ppm keyword of the instance)
+        charge: (int) the charge of the species (defaults to the charge keyword of the instance)
+
+        returns a list of candidate dictionaries sorted by absolute error
+        each candidate has the keys 'formula', 'comp', 'charge', 'mz', and 'error' (in ppm)
+        """
+        if ppm is None:
+            ppm = self.ks['ppm']
+        if charge is None:
+            charge = self.ks['charge']
+        target = mz*abs(charge) # neutral mass being searched for
+        lo = target - target*ppm/1000000.
+        hi = target + target*ppm/1000000.
+        if self.ks['verbose'] is True:
+            self.sys.stdout.write('Decomposing m/z %.5f (%.1f ppm)' %(mz,ppm))
+
+        candidates = []
+        if len(self.table) > 0:
+            left = self.np.searchsorted(self.lightmass,lo-self.heavymass,'left') # first light combination in the window of each heavy combination
+            right = self.np.searchsorted(self.lightmass,hi-self.heavymass,'right')
+            for hind in self.np.nonzero(right > left)[0]:
+                for lind in range(left[hind],right[hind]):
+                    cnts = list(self.heavycounts[hind])+list(self.lightcounts[lind])
+                    comp = {}
+                    for ind,c in enumerate(cnts):
+                        if c > 0:
+                            comp[self.table[ind][0]] = int(c)
+                    if len(comp) == 0:
+                        continue
+                    mass = self.heavymass[hind]+self.lightmass[lind]
+                    candidates.append({
+                    'formula': self.formula(comp),
+                    'comp': comp,
+                    'charge': charge,
+                    'mz': mass/abs(charge),
+                    'error': (mass-target)/target*1000000.,
+                    })
+        unique = {} # the same elemental composition may be reached with and without abbreviation blocks
+        for cand in candidates:
+            key = tuple(sorted(self.expand(cand['comp']).items()))
+            blocks = sum([cand['comp'][ele] for ele in cand['comp'] if ele in self.abbrvs])
+            if key not in unique or blocks > unique[key][0]: # keep the representation using the most blocks
+                unique[key] = (blocks,cand)
+        candidates = sorted([cand for blocks,cand in unique.values()],key=lambda x: abs(x['error']))
+        if self.ks['verbose'] is True:
+            self.sys.stdout.write(': %d candidates DONE\n' %len(candidates))
+        return candidates
+
+    def expand(self,comp):
+        """expands any abbreviations in the composition into their elements"""
+        out = {}
+        for key in comp:
+            if key in self.abbrvs:
+                for ele in self.abbrvs[key]:
+                    out[ele] = out.get(ele,0)+self.abbrvs[key][ele]*comp[key]
+            else:
+                out[key] = out.get(key,0)+comp[key]
+        return out
+
+    def formula(self,comp):
+        """generates a formula string (abbreviations first, then the hill formula) which can be interpreted by the Molecule class"""
+        out = ''
+        def append(key):
+            if comp[key] > 1:
+                return key+str(comp[key])
+            return key
+        for key in sorted(comp): # abbreviations first
+            if key in self.abbrvs:
+                out += append(key)
+        for key in ['C','H']: # carbon and hydrogen first according to hill formula
+            if key in comp:
+                out += append(key)
+        for key in sorted(comp): # alphabetically otherwise
+            if key not in self.abbrvs and key not in ['C','H']:
+                out += append(key)
+        return out
+
+    def interpretconstraints(self,elements):
+        """converts the supplied constraints to [minimum,maximum] pairs"""
+        out = {}
+        for key in elements:
+            if type(elements[key]) is int:
+                out[key] = [0,elements[key]]
+            elif len(elements[key]) == 2:
+                out[key] = [int(elements[key][0]),int(elements[key][1])]
+            else:
+                raise ValueError('The constraint for "%s" must be a maximum count or a [minimum,maximum] pair (supplied: %s)' %(key,str(elements[key])))
+            if out[key][0] < 0 or out[key][0] > out[key][1]:
+                raise ValueError('The constraint for "%s" is invalid (%d-%d)' %(key,out[key][0],out[key][1]))
+        return out
+
+    def prepare(self):
+        """
+        sorts the elements by mass and splits them into a light and a heavy group with a similar
+        number of combinations, then precomputes the mass of every combination within each group
+        (the light group is sorted by mass so that it can be searched for each heavy combination)
+        """
+        np = self.np
+        def combinations(group):
+            """returns a count array and the corresponding masses for every combination of the group"""
+            if len(group) == 0:
+                return np.zeros((1,0),dtype=int),np.zeros(1)
+            grids = np.meshgrid(*[np.arange(cmin,cmax+1) for ele,m,cmin,cmax in group],indexing='ij')
+            counts = np.array([grid.ravel() for grid in grids]).T
+            masses = np.dot(counts,np.array([m for ele,m,cmin,cmax in group]))
+            return counts,masses
+        
+        self.table = []
+        for key in self.elements:
+            self.table.append((key,self.blockmass(key),self.elements[key][0],self.elements[key][1]))
+        self.table = sorted(self.table,key=lambda x: x[1],reverse=True) # heaviest first
+        split = len(self.table)
+        lightsize = 1
+        heavysize = 1
+        for ele,m,cmin,cmax in self.table:
+            heavysize *= cmax-cmin+1
+        while split > 0: # move elements into the light group until it is at least as large as the heavy group
+            size = self.table[split-1][3]-self.table[split-1][2]+1
+            if lightsize >= heavysize/size:
+                break
+            split -= 1
+            lightsize *= size
+            heavysize //= size
+        self.heavycounts,self.heavymass = combinations(self.table[:split])
+        self.lightcounts,self.lightmass = combinations(self.table[split:])
+        order = np.argsort(self.lightmass)
+        self.lightcounts = self.lightcounts[order]
+        self.lightmass = self.lightmass[order]
+
+    def rank(self,candidates,spectrum,res=None):
+        """
+        ranks candidates by the agreement of their predicted isotope pattern with a real spectrum
+
+        candidates: list of candidates as returned by decompose()
+        spectrum: paired list of lists of mz and intensity values
+        res: resolution of the instrument (defaults to the res keyword of the instance)
+
+        adds a 'match' key to each candidate (standard error of the regression; lower is better)
+        and returns the candidates sorted by that value
+        """
+        from _Molecule import Molecule
+        if res is None:
+            res = self.ks['res']
+        for ind,cand in enumerate(candidates):
+            if self.ks['verbose'] is True:
+                self.sys.stdout.write('\rComparing isotope patterns %d/%d' %(ind+1,len(candidates)))
+            mol = Molecule(cand['formula'],charge=cand['charge'],res=res)
+            match = mol.compare(spectrum)
+            if type(match) is str: # could not calculate
+                match = float('inf')
+            cand['match'] = match
+        if self.ks['verbose'] is True:
+            self.sys.stdout.write(' DONE\n')
+        return sorted(candidates,key=lambda x: x['match'])
+
+if __name__ == '__main__':
+    dec = Decomposer({'C':60,'H':120,'P':4,'Pd':2,'Cl':4,'L':3},ppm=3.)
+    for cand in dec.decompose(700.0235):
+        print '%s %.5f %.2f ppm' %(cand['formula'],cand['mz'],cand['error'])
@@ -0,0 +1,223 @@
+"""
+FrozenMolecule class
+An immutable version of the Molecule class which can be shared and used as a dictionary key
+
+Molecule objects modify themselves in their arithmetic operators and keep a copy of their attributes for reset().
+A FrozenMolecule stores only the calculated values (in __slots__, with the isotope patterns as tuples) and cannot
+be modified after creation. Instances are interned by their canonical hill formula, charge, and settings, so
+calling FrozenMolecule with a formula that has already been calculated returns the existing object. This makes
+it safe to memoise molecules across scripts (e.g. PyRSIR, plotms, and the msms interpreter assistant).
+
+Arithmetic returns a new (interned) FrozenMolecule rather than modifying the instance.
+
+new:
+    ---1.0
+"""
+from _Molecule import Molecule
+
+class FrozenMolecule(object):
+    __slots__ = ['key','settings','formula','sf','comp','charge','sign','mw','pcomp','em','fwhm','sigma','rawip','barip','gausip','nsp']
+    interned = {} # calculated molecules keyed by their canonical formula and charge, then by their settings
+    mutable = ['gausip','nsp'] # derived values which are filled in when requested
+
+    def __new__(cls,string,**kwargs):
+        """
+        Determines the properties of a given molecule (or returns an existing instance of the same molecule)
+
+        string: (string) the molecule to interpret
+        accepts the same keyword arguments as the Molecule class (verbose and calculate are not part of the key)
+        """
+        kwargs.pop('calculate',None) # the molecule is always calculated
+        mol = Molecule(string,calculate=False,**kwargs) # interpret the formula only
+        settings = tuple(sorted([(key,val) for key,val in mol.ks.items() if key not in ['verbose','calculate','charge','sign']]))
+        key = (cls.hill(mol.comp),mol.ks['charge'],mol.ks['sign'])
+        same = cls.interned.setdefault(key,{}) # instances of this molecule
+        try:
+            return same[settings]
+        except KeyError:
+            pass
+        for isettings,other in same.items(): # the same molecule at another resolution only needs a new sigma
+            if dict(isettings,res=mol.ks['res']) == dict(settings):
+                return other.atresolution(mol.ks['res'])
+        mol.calculate()
+        self = object.__new__(cls)
+        values = {
+        'key': key,
+        'settings': settings,
+        'formula': key[0],
+        'sf': mol.sf,
+        'comp': tuple(sorted(mol.comp.items())),
+        'charge': mol.ks['charge'],
+        'sign': mol.ks['sign'],
+        'mw': mol.mw,
+        'pcomp': tuple(sorted(mol.pcomp.items())),
+        'em': mol.em,
+        'fwhm': mol.fwhm,
+        'sigma': mol.sigma,
+        'rawip': cls.freeze(mol.rawip),
+        'barip': cls.freeze(mol.barip),
+        }
+        for attr in values:
+            object.__setattr__(self,attr,values[attr])
+        same[settings] = self
+        return self
+
+    def __str__(self):
+        return "FrozenMolecule {}".format(self.formula)
+
+    def __repr__(self):
+        return "{}('{}')".format(self.__class__.__name__,self.formula)
+
+    def __eq__(self,other):
+        if isinstance(other,self.__class__) is False:
+            return NotImplemented
+        return self.key == other.key and self.settings == other.settings
+
+    def __ne__(self,other):
+        out = self.__eq__(other)
+        if out is NotImplemented:
+            return out
+        return not out
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __setattr__(self,name,value):
+        if name in self.mutable: # derived values are filled in on request
+            if name == 'gausip':
+                value = self.freeze(value)
+            object.__setattr__(self,name,value)
+        else:
+            raise AttributeError('FrozenMolecule objects cannot be modified (attempted to set "%s")' %name)
+
+    def __delattr__(self,name):
+        raise AttributeError('FrozenMolecule objects cannot be modified (attempted to delete "%s")' %name)
+
+    def __reduce__(self): # pickles as the arguments required to recreate (or look up) the instance
+        return (rebuild,(self.formula,self.charge,self.sign,self.settings))
+
+    def __add__(self,x):
+        return self.combine(x,1)
+
+    def __sub__(self,x):
+        return self.combine(x,-1)
+
+    def __mul__(self,x):
+        if type(x) != int or x < 1:
+            raise ValueError('Non-integer multiplication of a FrozenMolecule object is unsupported')
+        return self.derive(dict([(key,val*x) for key,val in self.comp]))
+
+    # methods which only read the calculated values are shared with the Molecule class
+    bounds = Molecule.__dict__['bounds']
+    zscore = Molecule.__dict__['zscore']
+    compare = Molecule.__dict__['compare']
+    fitgrid = Molecule.__dict__['fitgrid']
+    fitscores = Molecule.__dict__['fitscores']
+    plotbar = Molecule.__dict__['plotbar']
+    plotgaus = Molecule.__dict__['plotgaus']
+    plotraw = Molecule.__dict__['plotraw']
+
+    def atresolution(self,res):
+        """returns the molecule at another resolution (the isotope patterns are shared rather than recalculated)"""
+        settings = tuple(sorted(dict(self.settings,res=res).items()))
+        same = self.interned.setdefault(self.key,{})
+        try:
+            return same[settings]
+        except KeyError:
+            pass
+        out = object.__new__(self.__class__)
+        for attr in self.__slots__:
+            if attr not in self.mutable:
+                object.__setattr__(out,attr,getattr(self,attr))
+        object.__setattr__(out,'settings',settings)
+        fwhm,sigma = Molecule.__dict__['sigmafwhm'](out)
+        object.__setattr__(out,'fwhm',fwhm)
+        object.__setattr__(out,'sigma',sigma)
+        same[settings] = out
+        return out
+
+    @classmethod
+    def clear(cls):
+        """empties the intern table"""
+        cls.interned.clear()
+
+    def combine(self,x,sign):
+        """adds (sign 1) or subtracts (sign -1) a formula string or molecule and returns the resulting FrozenMolecule"""
+        if type(x) is str:
+            change = Molecule(x,calculate=False).comp
+        elif isinstance(x,(self.__class__,Molecule)) is True:
+            change = dict(x.comp)
+        else:
+            raise ValueError('Combination of {} with FrozenMolecule object {} is invalid'.format(x,self.formula))
+        comp = dict(self.comp)
+        for key in change:
+            comp[key] = comp.get(key,0)+sign*change[key]
+            if comp[key] < 0:
+                raise ValueError('Subtracting %d number of element %s from %s would yield a negative amount.' %(change[key],key,self.sf))
+            if comp[key] == 0:
+                del comp[key]
+        return self.derive(comp)
+
+    def composition(self):
+        """returns the composition as a (modifiable) dictionary"""
+        return dict(self.comp)
+
+    def derive(self,comp):
+        """returns the FrozenMolecule of the composition with the charge and settings of this instance"""
+        return rebuild(self.hill(comp),self.charge,self.sign,self.settings)
+
+    @staticmethod
+    def freeze(spectrum):
+        """converts a paired list of lists to a tuple of tuples"""
+        return tuple([tuple(lst) for lst in spectrum])
+
+    def gaussianisotopepattern(self):
+        """returns the simulated gaussian isotope pattern (generated on the first call)"""
+        if hasattr(self,'gausip') is False:
+            Molecule.__dict__['gaussianisotopepattern'](self)
+        return self.gausip
+
+    @staticmethod
+    def hill(comp):
+        """
+        generates a canonical hill formula which can be interpreted by the Molecule class
+        (specific isotopes are bracketed so that the formula can be interpreted unambiguously)
+        """
+        def append(key,num):
+            if key[0].isdigit() is True:
+                key = '(%s)' %key
+            if num > 1:
+                return key+str(num)
+            return key
+        out = ''
+        for key in ['C','H']:
+            if key in comp:
+                out += append(key,comp[key])
+        for key in sorted(comp):
+            if key not in ['C','H']:
+                out += append(key,comp[key])
+        return out
+
+    @property
+    def ks(self):
+        """a copy of the keyword arguments (for the methods shared with the Molecule class)"""
+        out = dict(self.settings)
+        out.update({'verbose': False, 'charge': self.charge, 'sign': self.sign})
+        return out
+
+    def molecule(self,**kwargs):
+        """returns a modifiable Molecule object of the same formula and settings"""
+        ks = dict(self.settings)
+        ks['charge'] = '%d%s' %(self.charge,self.sign)
+        ks.update(kwargs)
+        return Molecule(self.formula,**ks)
+
+def rebuild(formula,charge,sign,settings):
+    """recreates (or looks up) a FrozenMolecule (used for pickling)"""
+    ks = dict(settings)
+    ks['charge'] = '%d%s' %(charge,sign)
+    return FrozenMolecule(formula,**ks)
+
+if __name__ == '__main__':
+    mol = FrozenMolecule('L2PdCl2')
+    print mol, mol.em, mol is FrozenMolecule('C36H30Cl2P2Pd'), mol+'H'
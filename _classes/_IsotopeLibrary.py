@@ -0,0 +1,192 @@
+"""
+IsotopeLibrary class
+A precompiled library of the isotope patterns of the common abbreviations (_formabbrvs.py) and common losses (common_losses.py)
+
+For every entry the library stores the exact mass (most abundant isotopes), the aggregated (nominal mass)
+isotope pattern, and the fine structure isotope pattern. The patterns are calculated the first time the
+library is used (or whenever one of the source modules is newer than the library) and stored as a binary
+array next to this module which is memory-mapped on subsequent loads, so that the blocks do not have to be
+derived again in every session.
+
+The Molecule class combines these blocks rather than single atoms when a formula contains abbreviations
+(for the 'aggregate' and 'isospec' isotope pattern methods).
+
+Common losses are stored under the first word of their label when that word can be interpreted as a
+formula whose mass matches the stored mass (e.g. 'MeOH', 'Cp', 'PPh3'); the others are skipped.
+
+new:
+    ---1.0
+"""
+
+class IsotopeLibrary(object):
+    loaded = {} # libraries which have already been loaded in this session (shared between instances)
+    version = 1 # format version of the library files (increment when the layout changes)
+    tail = 0.0001 # threshold (percent of the maximum) of the stored aggregated patterns (tails are kept for convolution)
+    def __init__(self,masstable='nist',coverage=0.9999):
+        """
+        Lazily loaded library of isotope patterns
+
+        masstable: (string) the mass table the patterns are calculated with ('nist' or 'crc')
+        coverage: (float) the total probability covered by the fine structure patterns
+        """
+        self.masstable = masstable
+        self.coverage = coverage
+        self.os = __import__('os')
+        self.directory = self.os.path.dirname(self.os.path.abspath(__file__))
+        name = '_isotopelibrary_%s_%s' %(masstable,repr(coverage).replace('.','p'))
+        self.datapath = self.os.path.join(self.directory,name+'.npy')
+        self.indexpath = self.os.path.join(self.directory,name+'.idx')
+
+    def __str__(self):
+        return 'Isotope pattern library (%s mass table, %s coverage)' %(self.masstable,repr(self.coverage))
+
+    def __repr__(self):
+        return "%s('%s',%s)" %(self.__class__.__name__,self.masstable,repr(self.coverage))
+
+    def __contains__(self,key):
+        return key in self.table['index']
+
+    def __len__(self):
+        return len(self.table['index'])
+
+    def aggregated(self,key):
+        """returns the aggregated (nominal mass) isotope pattern of an entry (uncharged, normalized to 100)"""
+        return self.pattern(key,0)
+
+    def build(self):
+        """calculates every entry and attempts to store the library"""
+        import numpy as np
+        marshal = __import__('marshal')
+        from _Molecule import Molecule
+        index = {}
+        rows = []
+        count = 0
+        for key,formula in sorted(self.entries().items()):
+            mol = Molecule(formula,calculate=False,masstable=self.masstable,coverage=self.coverage)
+            patterns = [mol.aggregatedisotopepattern(mol.comp,self.tail),mol.finestructure(mol.comp,self.coverage)]
+            offsets = []
+            for pattern in patterns:
+                offsets.append((count,count+len(pattern[0])))
+                rows.extend(zip(pattern[0],pattern[1]))
+                count += len(pattern[0])
+            index[key] = {
+            'formula': formula,
+            'comp': mol.comp,
+            'em': sum([mol.md.mass(*self.element(mol,ele))*num for ele,num in mol.comp.items()]),
+            'offsets': offsets,
+            }
+        data = np.array(rows,dtype=np.float64).reshape(-1,2)
+        header = {
+        'version': self.version,
+        'sources': self.sourcetimes(),
+        'index': index,
+        }
+        try: # each file is written to a temporary file and renamed so that other processes never read a partial library
+            temp = '%s.%d.tmp' %(self.datapath,self.os.getpid())
+            handle = open(temp,'wb')
+            try:
+                np.save(handle,data)
+            finally:
+                handle.close()
+            self.replace(temp,self.datapath)
+            temp = '%s.%d.tmp' %(self.indexpath,self.os.getpid())
+            handle = open(temp,'wb')
+            try:
+                marshal.dump(header,handle)
+            finally:
+                handle.close()
+            self.replace(temp,self.indexpath) # the index is written last (it marks the data as up to date)
+            data = np.load(self.datapath,mmap_mode='r')
+        except (IOError,OSError): # the directory is not writable, the library is kept in memory
+            pass
+        return {'index': index, 'data': data}
+
+    def composition(self,key):
+        """returns the elemental composition of an entry"""
+        return dict(self.table['index'][key]['comp'])
+
+    def element(self,mol,key):
+        """returns the element and isotope (0 for natural abundance) of a composition key"""
+        if mol.md.has_key(key) is True:
+            return key,0
+        return mol.isotope(key)
+
+    def entries(self):
+        """returns a dictionary of the name and formula of every entry in the library"""
+        from _formabbrvs import abbrvs
+        from common_losses import losses
+        from _Molecule import Molecule
+        import re
+        out = {}
+        for key in abbrvs:
+            out[key] = key
+        for mass,label in losses.items():
+            key = label.split(' ')[0]
+            if key in out or re.match(r'^[A-Z][A-Za-z0-9]*$',key) is None: # only plain formulae and abbreviations
+                continue
+            try: # check that the label is a formula of the stored mass
+                mol = Molecule(key,calculate=False,masstable=self.masstable)
+            except (ValueError,KeyError,IndexError,TypeError):
+                continue
+            if abs(mol.roughexactmass()*mol.ks['charge']-mass) < 0.001:
+                out[key] = key
+        return out
+
+    def exactmass(self,key):
+        """returns the exact mass of an entry (most abundant isotope of each element)"""
+        return self.table['index'][key]['em']
+
+    def finestructure(self,key):
+        """returns the fine structure isotope pattern of an entry (uncharged, normalized to 100)"""
+        return self.pattern(key,1)
+
+    def load(self):
+        """loads (memory-maps) the library, building it if it is missing or out of date"""
+        import numpy as np
+        marshal = __import__('marshal')
+        try:
+            handle = open(self.indexpath,'rb')
+            try:
+                header = marshal.load(handle)
+            finally:
+                handle.close()
+            if header.get('version') == self.version and header.get('sources') == self.sourcetimes():
+                return {'index': header['index'], 'data': np.load(self.datapath,mmap_mode='r')}
+        except (IOError,OSError,EOFError,ValueError,TypeError,AttributeError): # missing or unreadable
+            pass
+        return self.build()
+
+    def pattern(self,key,which):
+        """returns the stored pattern (0: aggregated, 1: fine structure) of an entry as a paired list"""
+        start,end = self.table['index'][key]['offsets'][which]
+        values = self.table['data'][start:end]
+        return [values[:,0].tolist(),values[:,1].tolist()]
+
+    def replace(self,temp,path):
+        """moves a temporary file over a library file"""
+        if self.os.path.isfile(path) is True and self.os.name == 'nt': # rename does not replace files in windows
+            self.os.remove(path)
+        self.os.rename(temp,path)
+
+    def sourcetimes(self):
+        """returns the modification times of the modules the library is calculated from"""
+        out = []
+        for module in ['_formabbrvs','common_losses','_Molecule','_nist_mass' if self.masstable == 'nist' else '_crc_mass']:
+            try:
+                out.append(self.os.path.getmtime(self.os.path.join(self.directory,module+'.py')))
+            except OSError:
+                out.append(None)
+        return out
+
+    @property
+    def table(self):
+        """the loaded library (loaded on first access and shared between instances)"""
+        try:
+            return self.loaded[(self.masstable,self.coverage)]
+        except KeyError:
+            self.loaded[(self.masstable,self.coverage)] = self.load()
+            return self.loaded[(self.masstable,self.coverage)]
+
+if __name__ == '__main__':
+    lib = IsotopeLibrary()
+    print lib, len(lib), lib.exactmass('L'), lib.aggregated('L')
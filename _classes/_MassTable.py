@@ -0,0 +1,239 @@
+"""
+MassTable class
+A compact, lazily loaded version of the mass dictionaries (_nist_mass.py and _crc_mass.py)
+
+The dictionary modules are large literals which python has to execute on every import. This class
+flattens a dictionary into a few arrays (isotope masses, abundances, and mass numbers with the offset of
+each element into those arrays) and stores them in a compiled binary file next to the dictionary module.
+The binary file is generated the first time a table is used (or whenever the dictionary module is newer
+than the compiled file), and subsequent loads simply read the arrays back in.
+Nothing is loaded until the table is first accessed.
+
+The table can be indexed like the original dictionary (e.g. table['C'][13][0]) for backwards compatibility,
+but the isotopes(), natural(), and mass() methods avoid the nested lookups, and arrays() provides numpy
+arrays for vectorised code.
+
+new:
+    ---1.0
+"""
+
+class MassTable(object):
+    loaded = {} # tables which have already been loaded in this session (shared between instances)
+    version = 1 # format version of the compiled file (increment when the layout changes)
+    sources = { # supported sources and the module and dictionary name for each
+    'nist': ('_nist_mass','nist_mass'),
+    'crc': ('_crc_mass','crc_mass'),
+    }
+    def __init__(self,source='nist'):
+        """
+        Lazily loaded mass and abundance table
+
+        source: (string) the mass dictionary to use
+            'nist' for the NIST database (_nist_mass.py)
+            'crc' for the CRC Handbook of Chemistry and Physics (_crc_mass.py)
+        """
+        if source not in self.sources:
+            raise KeyError('The mass table source "%s" is not supported. Choose from: %s' %(source,', '.join(sorted(self.sources))))
+        self.source = source
+        self.os = __import__('os')
+        self.directory = self.os.path.dirname(self.os.path.abspath(__file__))
+        self.cache = self.os.path.join(self.directory,'%s.tbl' %self.sources[source][0])
+        self.dicts = {} # dictionary versions of each element which have been requested
+
+    def __str__(self):
+        return 'Mass table from the %s dictionary' %self.source
+
+    def __repr__(self):
+        return "%s('%s')" %(self.__class__.__name__,self.source)
+
+    def __contains__(self,key):
+        return key in self.table['index']
+
+    def __getitem__(self,key):
+        """returns the isotopes of an element in the format of the original dictionary"""
+        try:
+            return self.dicts[key]
+        except KeyError:
+            if key not in self.table['index']:
+                raise KeyError(key)
+            out = {0:(self.mass(key),self.table['zero'][self.table['index'][key]])}
+            for num,mass,abund in self.isotopes(key):
+                out[num] = (mass,abund)
+            self.dicts[key] = out
+            return out
+
+    def __iter__(self):
+        return iter(self.table['symbols'])
+
+    def __len__(self):
+        return len(self.table['symbols'])
+
+    def arrays(self):
+        """
+        returns the table as numpy arrays (for vectorised code)
+
+        the isotopes of the element with index i (see 'index') are
+        masses[offsets[i]:offsets[i+1]] (likewise for abundances and numbers)
+        the mass of the most abundant isotope of each element is in 'mostabundant'
+        """
+        try:
+            return self.table['numpy']
+        except KeyError:
+            import numpy as np
+            out = {
+            'symbols': list(self.table['symbols']),
+            'index': dict(self.table['index']),
+            'offsets': np.frombuffer(self.table['offsets'],dtype=np.int32).copy(),
+            'numbers': np.frombuffer(self.table['numbers'],dtype=np.int32).copy(),
+            'masses': np.frombuffer(self.table['masses'],dtype=np.float64).copy(),
+            'abundances': np.frombuffer(self.table['abundances'],dtype=np.float64).copy(),
+            'mostabundant': np.frombuffer(self.table['mostabundant'],dtype=np.float64).copy(),
+            }
+            self.table['numpy'] = out
+            return out
+
+    def averagemass(self,key):
+        """returns the abundance-weighted mass of an element"""
+        return self.table['average'][self.table['index'][key]]
+
+    def compile(self):
+        """flattens the source dictionary into arrays and attempts to store them in the compiled file"""
+        from array import array
+        import importlib
+        marshal = __import__('marshal')
+        module,name = self.sources[self.source]
+        package = __name__.rpartition('.')[0] # the dictionary modules are next to this module
+        try:
+            md = getattr(importlib.import_module(package+'.'+module if package else module),name)
+        except ImportError: # loaded outside of the package
+            md = getattr(importlib.import_module(module),name)
+        symbols = sorted(md.keys())
+        offsets = array('i',[0])
+        numbers = array('i')
+        masses = array('d')
+        abundances = array('d')
+        mostabundant = array('d')
+        zero = array('d')
+        for ele in symbols:
+            for num in sorted(md[ele]):
+                if num == 0:
+                    continue
+                numbers.append(num)
+                masses.append(md[ele][num][0])
+                abundances.append(md[ele][num][1])
+            offsets.append(len(numbers))
+            if md[ele][0][0] is None: # no stable isotope (CRC dictionary)
+                mostabundant.append(float('nan'))
+            else:
+                mostabundant.append(md[ele][0][0])
+            zero.append(md[ele][0][1])
+        data = {
+        'version': self.version,
+        'mtime': self.sourcetime(),
+        'symbols': symbols,
+        'offsets': offsets.tostring(),
+        'numbers': numbers.tostring(),
+        'masses': masses.tostring(),
+        'abundances': abundances.tostring(),
+        'mostabundant': mostabundant.tostring(),
+        'zero': zero.tostring(),
+        }
+        try: # written to a temporary file first so that other processes never read a partial table
+            temp = '%s.%d.tmp' %(self.cache,self.os.getpid())
+            handle = open(temp,'wb')
+            try:
+                marshal.dump(data,handle)
+            finally:
+                handle.close()
+            if self.os.path.isfile(self.cache) is True: # rename does not replace files in windows
+                self.os.remove(self.cache)
+            self.os.rename(temp,self.cache)
+        except (IOError,OSError): # the directory is not writable, the table will be compiled every session
+            pass
+        return data
+
+    def isotopes(self,key):
+        """returns a list of (mass number, exact mass, natural abundance) for every isotope of an element"""
+        i = self.table['index'][key]
+        start,end = self.table['offsets'][i],self.table['offsets'][i+1]
+        return zip(self.table['numbers'][start:end],self.table['masses'][start:end],self.table['abundances'][start:end])
+
+    def has_key(self,key):
+        return key in self.table['index']
+
+    def keys(self):
+        return list(self.table['symbols'])
+
+    def load(self):
+        """loads the compiled file (recompiling it if it is missing or out of date)"""
+        from array import array
+        marshal = __import__('marshal')
+        data = None
+        try:
+            handle = open(self.cache,'rb')
+            try:
+                data = marshal.load(handle)
+            finally:
+                handle.close()
+            if data.get('version') != self.version or data.get('mtime') != self.sourcetime():
+                data = None
+        except (IOError,OSError,EOFError,ValueError,TypeError,AttributeError): # missing or unreadable
+            data = None
+        if data is None:
+            data = self.compile()
+        table = {'symbols': data['symbols']}
+        table['index'] = dict([(ele,i) for i,ele in enumerate(data['symbols'])])
+        for key,code in [('offsets','i'),('numbers','i'),('masses','d'),('abundances','d'),('mostabundant','d'),('zero','d')]:
+            table[key] = array(code)
+            table[key].fromstring(data[key])
+        table['average'] = []
+        table['natural'] = []
+        for i in range(len(table['symbols'])): # precalculate the values used most often
+            start,end = table['offsets'][i],table['offsets'][i+1]
+            masses = []
+            abunds = []
+            for j in range(start,end):
+                if table['abundances'][j] != 0.:
+                    masses.append(table['masses'][j])
+                    abunds.append(table['abundances'][j])
+            table['natural'].append((masses,abunds))
+            table['average'].append(sum([m*a for m,a in zip(masses,abunds)]))
+        return table
+
+    def mass(self,key,iso=0):
+        """returns the exact mass of the specified isotope of an element (the most abundant isotope if iso is 0)"""
+        i = self.table['index'][key]
+        if iso == 0:
+            return self.table['mostabundant'][i]
+        start,end = self.table['offsets'][i],self.table['offsets'][i+1]
+        for j in range(start,end):
+            if self.table['numbers'][j] == iso:
+                return self.table['masses'][j]
+        raise KeyError('The element "%s" does not have a defined isotope "%d" in the %s mass table' %(key,iso,self.source))
+
+    def natural(self,key):
+        """returns the masses and abundances of the naturally occurring isotopes of an element (sorted by mass number)"""
+        return self.table['natural'][self.table['index'][key]]
+
+    def sourcetime(self):
+        """returns the modification time of the source dictionary module (None if it cannot be found)"""
+        try:
+            return self.os.path.getmtime(self.os.path.join(self.directory,'%s.py' %self.sources[self.source][0]))
+        except OSError:
+            return None
+
+    @property
+    def table(self):
+        """the loaded arrays (loaded on first access and shared between instances)"""
+        try:
+            return self.loaded[self.source]
+        except KeyError:
+            self.loaded[self.source] = self.load()
+            return self.loaded[self.source]
+
+if __name__ == '__main__':
+    import time
+    start = time.time()
+    md = MassTable('nist')
+    print md.mass('C'), md['Cl'][37], md.natural('Pd')
+    print 'loaded in %.2f ms' %((time.time()-start)*1000.)
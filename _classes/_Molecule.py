@@ -16,9 +16,20 @@ now calculates the exact mass from the generated bar isotope pattern (this shoul
 now rounds the masses to the decimal place being tracked (no longer adds false precision)
 converted to the use of unfilled spectrum objects to save processing time and memory with large molecules and high decimal places
 ---2.7
+added finestructure() which enumerates the most probable isotopologues until a target probability is covered (ipmethod='isospec')
+added aggregatedisotopepattern() which calculates the nominal mass distribution and center masses directly (ipmethod='aggregate')
+mass lookups now use the compiled and lazily loaded MassTable rather than importing the mass dictionary (masstable kwarg selects the source)
+addition and multiplication now convolve the existing raw isotope pattern with that of the change rather than recalculating (subtraction and division still recalculate)
+added calculate kwarg to interpret the formula without calculating anything (used by FrozenMolecule)
+added adducts() which derives the patterns and bounds of several adducts or charge states from the pattern of the neutral molecule
+bounds() now uses a cached z-score rather than scipy.stats (added batchbounds() to calculate the bounds of several molecules at once)
+added fitgrid() and fitscores() which score the predicted pattern against every scan (or bin of scans) at once
+abbreviations are now combined as precompiled blocks from IsotopeLibrary rather than as single atoms ('aggregate' and 'isospec' only, library kwarg)
 """
 
 class Molecule(object):
+    fragments = {} # raw isotope patterns of added fragments (shared between instances)
+    zscores = {} # z-scores of confidence intervals which have already been calculated
     def __init__(self,string,**kwargs):
         """
         Determines many properties of a given molecule
@@ -39,6 +50,11 @@ class Molecule(object):
         'res': 5000, # resolution of the instrument being matched
         'charge': 1, # charge of the molecule (this can also be specified in the formula)
         'emptyspec': True, # use an empty spectrum object (disable this for massive molecules)
+        'ipmethod': 'multiplicative', # raw isotope pattern generator ('multiplicative', 'isospec', or 'aggregate')
+        'coverage': 0.9999, # total probability to account for when ipmethod is 'isospec'
+        'masstable': 'nist', # mass table to use ('nist' or 'crc')
+        'calculate': True, # calculate masses and isotope patterns on creation (disable to only interpret the formula)
+        'library': True, # combine the precompiled patterns of any abbreviations (IsotopeLibrary) rather than calculating them
         }
         if set(kwargs.keys()) - set(self.ks.keys()): # check for invalid keyword arguments
             string = ''
@@ -51,16 +67,19 @@ class Molecule(object):
             self.sys = __import__('sys')
             self.sys.stdout.write('Generating molecule object from input "%s"\n' %string)
         
-        from _nist_mass import nist_mass as mass # masses from the NIST database
-        #from _crc_mass import crc_mass as mass # masses from the CRC Handbook of Chemistry and Physics
-        self.md = mass # mass dictionary that the script will use
+        from _MassTable import MassTable # compiled mass tables (loaded on first use)
+        self.md = MassTable(self.ks['masstable']) # mass table that the script will use
         self.formula = string # input formula
         self.ks['charge'],self.ks['sign'] = self.interpretcharge(self.ks['charge']) # charge
-        self.comp = self.composition(self.formula) # determine composition from formula
+        self.blocks = {} # number of each abbreviation in the formula
+        self.comp = self.composition(self.formula,self.blocks) # determine composition from formula
         self.checkinnist(self.comp) # checks that all the composition keys are valid
-        self.calculate()
+        if self.ks['calculate'] is True:
+            self.calculate()
+        else:
+            self.sf = self.molecularformula()
         self.default()
-        if self.ks['verbose'] is True:
+        if self.ks['verbose'] is True and self.ks['calculate'] is True:
             self.printdetails()
     
     def __str__(self):
@@ -77,12 +96,17 @@ class Molecule(object):
                 addition = x.comp
             else:
                 raise ValueError('Addition of {} to Molecule object {} is invalid'.format(x,self.formula))
+        same = isinstance(x,self.__class__) is True and all([x.ks[key] == self.ks[key] for key in ['ipmethod','masstable','decpl','coverage']])
+        if same is True and x.__dict__.has_key('rawip') is True:
+            delta = x.rawip # reuse the pattern of the other molecule (calculated with the same settings)
+        else:
+            delta = self.fragmentpattern(addition)
         for key in addition:
             try:
                 self.comp[key] += addition[key]
             except KeyError:
                 self.comp[key] = addition[key]
-        self.calculate() # recalculates mass and isotope patterns
+        self.calculate(self.combinepatterns(self.rawip,delta)) # convolves only the addition into the existing pattern
         self.formula = self.sf
         return self.sf
     
@@ -111,9 +135,11 @@ class Molecule(object):
     def __mul__(self,x):
         if type(x) != int:
             raise ValueError('Non-integer multiplication of a Molecule object is unsupported')
+        if x < 1:
+            raise ValueError('Multiplication of a Molecule object by %d is unsupported' %x)
         for key in self.comp:
             self.comp[key] = self.comp[key]*x
-        self.calculate() # recalculates mass and isotope patterns
+        self.calculate(self.powerpattern(self.rawip,x)) # raise the existing pattern to the power x
         self.formula = self.sf
         return self.sf
     
@@ -130,6 +156,132 @@ class Molecule(object):
         self.formula = self.sf
         return self.sf
     
+    def adducts(self,rules,conf=0.95,perpeak=False,threshold=0.01):
+        """
+        calculates the isotope patterns and bounds of several adducts or charge states of the molecule
+        the molecule is treated as the neutral species M and its raw isotope pattern is reused for every rule
+        additions are convolved into that pattern, losses with a single significant isotope are applied
+        as a mass shift, and any other losses require a recalculation of the isotope pattern
+        
+        rules: list of adduct strings of the form [nM+X-Y]z+ where X and Y are formulas or abbreviations
+            defined in _formabbrvs.py (e.g. '[M+H]+', '[2M+Na]+', '[M-H]-', '[M+2H]2+', '[M+H-H2O]+')
+        conf, perpeak, threshold: as for bounds()
+        
+        returns a dictionary keyed by rule, each containing the keys
+        'formula', 'comp', 'charge', 'sign', 'barip', 'em', 'fwhm', 'sigma', and 'bounds'
+        """
+        import re
+        out = {}
+        for rule in rules:
+            match = re.match(r'^\[(\d*)M((?:[+-][^\]+-]+)*)\](\d*)([+-])$',rule.replace(' ',''))
+            if match is None:
+                raise ValueError('The adduct "%s" could not be interpreted. Adducts must be of the form [nM+X-Y]z+ (e.g. [M+H]+, [2M+Na]+, [M-H]-, [M+2H]2+)' %rule)
+            n = int(match.group(1)) if match.group(1) else 1
+            charge = int(match.group(3)) if match.group(3) else 1
+            if self.ks['verbose'] is True:
+                self.sys.stdout.write('Calculating adduct %s\n' %rule)
+            comp = dict([(key,val*n) for key,val in self.comp.items()])
+            rawip = self.powerpattern(self.rawip,n) # pattern of the neutral species
+            losses = []
+            for sign,num,formula in re.findall(r'([+-])(\d*)([^+-]+)',match.group(2)):
+                change = self.composition('(%s)%s' %(formula,num)) # interprets abbreviations and multiples
+                for key in change:
+                    comp[key] = comp.get(key,0) + (change[key] if sign == '+' else -change[key])
+                    if comp[key] < 0:
+                        raise ValueError('The adduct "%s" would yield a negative amount of element %s from %s.' %(rule,key,self.sf))
+                    if comp[key] == 0:
+                        del comp[key]
+                if sign == '+':
+                    rawip = self.combinepatterns(rawip,self.fragmentpattern(change))
+                else:
+                    losses.append(change)
+            for change in losses:
+                delta = self.fragmentpattern(change)
+                if rawip is not None and len(delta[0]) == 1: # effectively a single isotope, shift by its mass
+                    rawip = [[mz-delta[0][0] for mz in rawip[0]],rawip[1]]
+                else:
+                    rawip = None
+            if rawip is None: # losses which cannot be removed from the pattern
+                rawip = self.isotopepattern(comp)
+            barip = self.barisotopepattern(rawip,charge)
+            em = barip[0][barip[1].index(100.)]
+            fwhm,sigma = self.sigmafwhm(em)
+            out[rule] = {
+            'formula': self.molecularformula(comp),
+            'comp': comp,
+            'charge': charge,
+            'sign': match.group(4),
+            'barip': barip,
+            'em': em,
+            'fwhm': fwhm,
+            'sigma': sigma,
+            'bounds': self.bounds(conf,perpeak,threshold,barip=barip,sigma=sigma),
+            }
+        return out
+    
+    def aggregatedisotopepattern(self,comp,thresh=0.01,prune=1e-12):
+        """
+        generates an isotope pattern aggregated to nominal masses directly from the composition
+        (this skips the fine structure and is suitable for large molecules, similar to BRAIN:
+        Claesen et al. J. Am. Soc. Mass Spectrom. 2012, 23, 753-763)
+        
+        each element is represented by a polynomial over nominal mass holding the probabilities and the
+        probability-weighted masses of its isotopes, these are raised to the number of atoms by squaring
+        and multiplied together, keeping track of the center mass of every nominal mass
+        
+        thresh: intensity threshold (where the max peak height is 100) for the returned peaks
+        prune: relative probability below which the tails are trimmed while multiplying
+        
+        returns an uncharged isotope pattern (z will be 1) of center masses, normalized to 100
+        """
+        import numpy as np
+        
+        def multiply(a,b):
+            """multiplies two (nominal offset, probabilities, weighted masses) polynomials"""
+            if a is None:
+                return b
+            p = np.convolve(a[1],b[1])
+            w = np.convolve(a[2],b[1]) + np.convolve(a[1],b[2])
+            keep = np.nonzero(p >= p.max()*prune)[0] # trim the tails
+            return a[0]+b[0]+keep[0],p[keep[0]:keep[-1]+1],w[keep[0]:keep[-1]+1]
+        
+        def power(poly,n):
+            """raises the polynomial to the power n by squaring"""
+            out = None
+            while n > 0:
+                if n & 1:
+                    out = multiply(out,poly)
+                n >>= 1
+                if n > 0:
+                    poly = multiply(poly,poly)
+            return out
+        
+        if self.ks['verbose'] is True:
+            self.sys.stdout.write('Generating aggregated isotope pattern')
+        shift = 0. # mass of specified isotopes
+        out = (0,np.ones(1),np.zeros(1))
+        for key in comp: # for each element
+            if self.md.has_key(key) is True: # if natural abundance
+                isos = [(num,m,a) for num,m,a in self.md.isotopes(key) if a != 0]
+                p = np.zeros(isos[-1][0]-isos[0][0]+1)
+                w = np.zeros(isos[-1][0]-isos[0][0]+1)
+                for num,m,a in isos:
+                    p[num-isos[0][0]] = a
+                    w[num-isos[0][0]] = a*m
+                w /= p.sum() # normalize abundances
+                p /= p.sum()
+                out = multiply(out,power((isos[0][0],p,w),comp[key]))
+            else: # if specific isotope
+                ele,iso = self.isotope(key)
+                shift += self.md.mass(ele,iso)*comp[key]
+        nom,p,w = out
+        keep = p >= p.max()*thresh/100.
+        mz = w[keep]/p[keep] + shift # center mass of each nominal mass
+        p = p[keep]/p.max()*100.
+        if self.ks['verbose'] is True:
+            self.sys.stdout.write(' DONE\n')
+        return [mz.tolist(),p.tolist()]
+    
     def barisotopepattern(self,rawip,charge,dec=3):
         """
         generates an isotope pattern for use in bar plots
@@ -179,7 +331,65 @@ class Molecule(object):
             self.sys.stdout.write(' DONE\n')
         return out
     
-    def bounds(self,conf=0.95,perpeak=False,threshold=0.01):
+    @staticmethod
+    def batchbounds(molecules,conf=0.95,threshold=0.01,res=None):
+        """
+        calculates the bounds of several molecules at once
+        molecules: list of Molecule (or FrozenMolecule) objects
+        res: resolution to calculate the bounds at (if different from the resolution the molecules were created with)
+            the molecules are not modified or recalculated
+        
+        returns a list of [start,end] bounds in the order of the supplied molecules
+        """
+        import numpy as np
+        first = []
+        last = []
+        for mol in molecules: # the first and last peak above threshold for each molecule
+            barip = mol.barip
+            cutoff = threshold * max(barip[1])
+            keep = [mz for mz,inten in zip(barip[0],barip[1]) if inten >= cutoff]
+            first.append(keep[0])
+            last.append(keep[-1])
+        if res is None:
+            sigma = np.array([mol.sigma for mol in molecules])
+        else:
+            sigma = np.array([mol.em for mol in molecules])/float(res)/(2*np.sqrt(2*np.log(2))) # see sigmafwhm()
+        width = Molecule.zscore(conf)*sigma
+        return np.array([np.array(first)-width,np.array(last)+width]).T.tolist()
+    
+    def blockpattern(self,comp,blocks):
+        """
+        generates the raw isotope pattern of a composition by combining the precompiled patterns of its
+        abbreviations (IsotopeLibrary) with the pattern of the remaining atoms
+        (falls back to calculating the whole composition if the blocks are not contained in it)
+        """
+        from _IsotopeLibrary import IsotopeLibrary
+        lib = IsotopeLibrary(self.ks['masstable'],self.ks['coverage'])
+        remainder = dict(comp)
+        for key in blocks:
+            for ele,num in lib.composition(key).items():
+                remainder[ele] = remainder.get(ele,0) - num*blocks[key]
+        if min(remainder.values()+[0]) < 0: # the composition has been modified since the blocks were found
+            return self.isotopepattern(comp)
+        remainder = dict([(ele,num) for ele,num in remainder.items() if num > 0])
+        if self.ks['ipmethod'] == 'aggregate':
+            rawip = self.aggregatedisotopepattern(remainder,lib.tail) if len(remainder) > 0 else [[0.],[100.]]
+        else:
+            rawip = self.finestructure(remainder,self.ks['coverage']) if len(remainder) > 0 else [[0.],[100.]]
+        for ind,key in enumerate(sorted(blocks)):
+            fkey = ('block',self.ks['ipmethod'],self.ks['masstable'],self.ks['decpl'],self.ks['coverage'],key,blocks[key])
+            try:
+                pattern = self.fragments[fkey]
+            except KeyError:
+                pattern = self.powerpattern(lib.pattern(key,0 if self.ks['ipmethod'] == 'aggregate' else 1),blocks[key],lib.tail)
+                self.fragments[fkey] = pattern
+            if ind == len(blocks)-1: # the final pattern is trimmed to the usual threshold
+                rawip = self.combinepatterns(rawip,pattern)
+            else:
+                rawip = self.combinepatterns(rawip,pattern,lib.tail)
+        return rawip
+    
+    def bounds(self,conf=0.95,perpeak=False,threshold=0.01,barip=None,sigma=None):
         """
         calculates bounds of the isotope pattern based on a confidence interval and the bar isotope pattern
 
@@ -187,23 +397,32 @@ class Molecule(object):
         perpeak: (bool) toggle for whether the function should return a dictionary of 
         boundaries for each peak, or a single pair of bounds that covers the entire isotope pattern
         threshold: (int/float) minimum threshold as a percentage of the maximmum for peaks to be included in bounds
+        barip, sigma: the bar isotope pattern and sigma to use (defaults to those of the molecule)
         """
         if self.ks['verbose'] is True:
             self.sys.stdout.write('Calculating bounds from simulated gaussian isotope pattern')
-        threshold = threshold * max(self.barip[1])
-        from scipy import stats
+        if barip is None:
+            barip = self.barip
+        if sigma is None:
+            sigma = self.sigma
+        width = self.zscore(conf)*sigma # half width of the confidence interval
+        threshold = threshold * max(barip[1])
         tempip = [[],[]]
-        for ind,inten in enumerate(self.barip[1]): # checks for intensities above threshold
+        for ind,inten in enumerate(barip[1]): # checks for intensities above threshold
             if inten >= threshold:
-                tempip[0].append(self.barip[0][ind])
-                tempip[1].append(self.barip[1][ind])
+                tempip[0].append(barip[0][ind])
+                tempip[1].append(barip[1][ind])
         if perpeak is True: # if per-peak bounds are called for
+            import numpy as np
+            mzs = np.asarray(tempip[0])
+            lower = (mzs-width).tolist()
+            upper = (mzs+width).tolist()
             out = {}
-            for mz in tempip[0]:
+            for ind,mz in enumerate(tempip[0]):
                 out[str(mz)] = {}
-                out[str(mz)]['bounds'] = stats.norm.interval(conf,mz,scale=self.sigma)
+                out[str(mz)]['bounds'] = (lower[ind],upper[ind])
         else: # a general range that covers the entire isotope pattern
-            out = [stats.norm.interval(conf,tempip[0][0],scale=self.sigma)[0],stats.norm.interval(conf,tempip[0][-1],scale=self.sigma)[1]]
+            out = [tempip[0][0]-width,tempip[0][-1]+width]
         if self.ks['verbose'] is True:
             if perpeak is False:
                 self.sys.stdout.write(': %.3f-%.3f' %(out[0],out[1]))
@@ -211,13 +430,18 @@ class Molecule(object):
         return out
         
     
-    def calculate(self):
-        """calls the calculation functions"""
+    def calculate(self,rawip=None):
+        """
+        calls the calculation functions
+        rawip: a precalculated raw isotope pattern for the current composition (e.g. from combinepatterns())
+        """
         self.sf = self.molecularformula() # generates a string version of the molecular formula
         #self.em = self.roughexactmass(self.comp,charge=self.ks['charge']) # monoisotopic mass (will not work for large number of carbons)
         #self.fwhm,self.sigma = self.sigmafwhm()
         self.mw,self.pcomp = self.molecularweight() # molecular weight and elemental percent composition
-        self.rawip = self.rawisotopepattern(self.comp,dec=self.ks['decpl']) # generates a raw isotope pattern (charge of 1)
+        if rawip is None:
+            rawip = self.isotopepattern(self.comp,self.blocks) # generates a raw isotope pattern (charge of 1)
+        self.rawip = rawip
         self.barip = self.barisotopepattern(self.rawip,self.ks['charge']) # bar isotope pattern based on the generated raw pattern
         self.em = self.preciseexactmass()
         self.fwhm,self.sigma = self.sigmafwhm()
@@ -229,9 +453,41 @@ class Molecule(object):
         for key in comp:
             if self.md.has_key(key) is False:
                 ele,iso = self.isotope(key)
-                if self.md[ele].has_key(iso) is False:
+                if iso not in [num for num,m,a in self.md.isotopes(ele)]:
                     raise ValueError('The element "%s" does not have a defined isotope "%d" in the NIST element database, please check your input' %(ele,iso))
                     
+    def combinepatterns(self,a,b,thresh=0.01):
+        """
+        convolves two uncharged raw isotope patterns (e.g. the pattern of a molecule and that of a fragment being added)
+        masses are combined in the same manner as the isotope pattern method of the instance
+        (rounded to decpl for 'multiplicative', truncated to coverage for 'isospec', and per nominal mass for 'aggregate')
+        
+        returns the combined pattern normalized to 100
+        """
+        import numpy as np
+        mz = np.add.outer(np.asarray(a[0],dtype=float),np.asarray(b[0],dtype=float)).ravel()
+        inten = np.multiply.outer(np.asarray(a[1],dtype=float),np.asarray(b[1],dtype=float)).ravel()
+        if self.ks['ipmethod'] == 'aggregate': # group by nominal mass offset and take the center mass
+            nom = np.add.outer(np.round(np.asarray(a[0])-a[0][0]),np.round(np.asarray(b[0])-b[0][0])).ravel().astype(int)
+            p = np.bincount(nom,weights=inten)
+            w = np.bincount(nom,weights=inten*mz)
+            keep = p >= p.max()*thresh/100.
+            mz = w[keep]/p[keep]
+            inten = p[keep]
+        else:
+            keys,inverse = np.unique(np.round(mz,self.ks['decpl']),return_inverse=True) # group coincident masses
+            inten = np.bincount(inverse,weights=inten)
+            mz = keys
+            if self.ks['ipmethod'] == 'isospec': # keep the most probable peaks until the coverage is reached
+                order = np.argsort(inten)[::-1]
+                covered = np.cumsum(inten[order])
+                keep = np.sort(order[:np.searchsorted(covered,covered[-1]*self.ks['coverage'])+1])
+            else:
+                keep = inten >= inten.max()*thresh/100.
+            mz = mz[keep]
+            inten = inten[keep]
+        return [mz.tolist(),(inten/inten.max()*100.).tolist()]
+    
     def compare(self,exp):
         """
         compares a provided real spectrum to the simulated gaussian isotope pattern
@@ -247,7 +503,7 @@ class Molecule(object):
                 ss += val**2
             return ss
         
-        if self.__dict__.has_key('gausip') is not True: # generate gaussian isotope pattern if not already generated
+        if hasattr(self,'gausip') is not True: # generate gaussian isotope pattern if not already generated
             self.gaussianisotopepattern()
         yvals = []
         res = []
@@ -267,9 +523,10 @@ class Molecule(object):
         from math import sqrt
         return sqrt(sumsquare(res)/len(res))
     
-    def composition(self,formula):
+    def composition(self,formula,blocks=None):
         """
         works through a formula string to determine the elemental composition
+        blocks: (dict) if supplied, the number of each abbreviation found in the formula is added to it
         """
         sbrack = ['(','{','['] # start brackets
         ebrack = [')','}',']'] # closing brackets
@@ -376,6 +633,8 @@ class Molecule(object):
             comptemp = {}
             for key in dic:
                 if key in abbrvs: # if a common abbreviation is found in formula
+                    if blocks is not None:
+                        blocks[key] = blocks.get(key,0) + dic[key]
                     for subkey in abbrvs[key]:
                         try:
                             comptemp[subkey] += abbrvs[key][subkey]*dic[key]
@@ -423,6 +682,188 @@ class Molecule(object):
         """saves the original values when the class was called"""
         self.original = dict(self.__dict__)
     
+    def finestructure(self,comp,coverage=0.9999):
+        """
+        generates a fine structure isotope pattern by enumerating the most probable isotopologues
+        until their summed probability reaches the specified coverage (based on the IsoSpec algorithm,
+        Lacki et al. Anal. Chem. 2017, 89, 3272-3277)
+        
+        comp: (dict) composition to generate the pattern for
+        coverage: (float) total probability to account for (0 < coverage < 1)
+        
+        the configurations of each element are generated in order of decreasing probability from the mode
+        of the multinomial distribution, then combined across elements in order of decreasing probability
+        memory use is proportional to the number of isotopologues returned
+        
+        returns an uncharged isotope pattern (z will be 1) with all mass defects preserved, normalized to 100
+        """
+        import heapq
+        from math import exp,lgamma,log
+        
+        class Marginal(object):
+            """generates the isotope configurations of n atoms of an element in order of decreasing probability"""
+            def __init__(self,masses,abunds,n):
+                self.masses = masses
+                self.logp = [log(p) for p in abunds]
+                self.n = n
+                self.lfact = lgamma(n+1)
+                self.confs = [] # generated configurations (ordered)
+                self.lps = [] # log probability of each configuration
+                self.ms = [] # mass of each configuration
+                mode = self.mode(abunds)
+                self.heap = [(-self.lprob(mode),mode)]
+                self.seen = set([mode])
+            
+            def __len__(self):
+                return len(self.confs)
+            
+            def lprob(self,conf):
+                """log probability of a configuration (multinomial)"""
+                out = self.lfact
+                for ind,k in enumerate(conf):
+                    out += k*self.logp[ind]-lgamma(k+1)
+                return out
+            
+            def mode(self,abunds):
+                """locates the most probable configuration"""
+                conf = [int(self.n*p) for p in abunds]
+                rem = sorted(range(len(abunds)),key=lambda i: self.n*abunds[i]-conf[i],reverse=True)
+                for i in rem[:self.n-sum(conf)]: # distribute the remaining atoms by fractional part
+                    conf[i] += 1
+                conf = tuple(conf)
+                improved = True
+                while improved is True: # hill climb to the mode
+                    improved = False
+                    for nb in self.neighbours(conf):
+                        if self.lprob(nb) > self.lprob(conf):
+                            conf = nb
+                            improved = True
+                return conf
+            
+            def neighbours(self,conf):
+                """configurations one atom away from the supplied configuration"""
+                for i in range(len(conf)):
+                    if conf[i] == 0:
+                        continue
+                    for j in range(len(conf)):
+                        if i != j:
+                            nb = list(conf)
+                            nb[i] -= 1
+                            nb[j] += 1
+                            yield tuple(nb)
+            
+            def extend(self,upto):
+                """generates configurations until index upto is available, returns False if exhausted"""
+                while len(self.confs) <= upto:
+                    if len(self.heap) == 0:
+                        return False
+                    lp,conf = heapq.heappop(self.heap)
+                    self.confs.append(conf)
+                    self.lps.append(-lp)
+                    self.ms.append(sum([k*self.masses[ind] for ind,k in enumerate(conf)]))
+                    for nb in self.neighbours(conf):
+                        if nb not in self.seen:
+                            self.seen.add(nb)
+                            heapq.heappush(self.heap,(-self.lprob(nb),nb))
+                return True
+        
+        if coverage <= 0. or coverage >= 1.:
+            raise ValueError('The coverage must be between 0 and 1 (supplied: %s)' %str(coverage))
+        if self.ks['verbose'] is True:
+            self.sys.stdout.write('Generating fine structure isotope pattern (%s coverage)' %str(coverage))
+        shift = 0. # mass of specified isotopes
+        marginals = []
+        for key in comp: # for each element
+            if self.md.has_key(key) is True: # if natural abundance
+                masses,abunds = self.md.natural(key) # isotopes with nonzero abundance
+                total = sum(abunds)
+                marginals.append(Marginal(masses,[p/total for p in abunds],comp[key]))
+            else: # if specific isotope
+                ele,iso = self.isotope(key)
+                shift += self.md.mass(ele,iso)*comp[key]
+        for marg in marginals:
+            marg.extend(0)
+        
+        out = [[],[]]
+        start = tuple([0]*len(marginals))
+        heap = [(-sum([marg.lps[0] for marg in marginals]),start)]
+        covered = 0.
+        while covered < coverage and len(heap) > 0:
+            lp,inds = heapq.heappop(heap)
+            prob = exp(-lp)
+            covered += prob
+            out[0].append(shift+sum([marginals[dim].ms[i] for dim,i in enumerate(inds)]))
+            out[1].append(prob)
+            for dim in range(len(inds)): # each isotopologue is pushed once by only incrementing up to the first nonzero index
+                if marginals[dim].extend(inds[dim]+1) is True:
+                    nxt = list(inds)
+                    nxt[dim] += 1
+                    heapq.heappush(heap,(lp+marginals[dim].lps[inds[dim]]-marginals[dim].lps[inds[dim]+1],tuple(nxt)))
+                if inds[dim] != 0:
+                    break
+        if len(marginals) == 0: # only specific isotopes were specified
+            out = [[shift],[1.]]
+        
+        order = sorted(range(len(out[0])),key=lambda i: out[0][i]) # sort by mass
+        maxint = max(out[1])
+        out = [[out[0][i] for i in order],[out[1][i]/maxint*100. for i in order]]
+        if self.ks['verbose'] is True:
+            self.sys.stdout.write(': %d isotopologues DONE\n' %len(out[0]))
+        return out
+    
+    def fitgrid(self,points=10):
+        """
+        returns an evenly spaced m/z grid covering the simulated gaussian isotope pattern (points per fwhm)
+        and the predicted intensities on that grid (normalized to 100) for use with fitscores()
+        """
+        import numpy as np
+        if hasattr(self,'gausip') is not True: # generate gaussian isotope pattern if not already generated
+            self.gaussianisotopepattern()
+        grid = np.arange(self.gausip[0][0],self.gausip[0][-1],self.fwhm/points)
+        pred = np.interp(grid,self.gausip[0],self.gausip[1])
+        return [grid,pred/pred.max()*100.]
+    
+    def fitscores(self,rows,n=1,grid=None):
+        """
+        scores the simulated gaussian isotope pattern against many spectra at once (e.g. every scan of a function)
+        
+        rows: 2D array of intensities sampled on the m/z grid of fitgrid() (one row per spectrum, in time order)
+        n: number of consecutive spectra to sum before scoring (spectra which do not fill a bin are dropped as in bindata)
+        grid: the output of fitgrid() (calculated if not supplied)
+        
+        returns a list of the standard error of the regression of each (summed) spectrum as in compare()
+        (lower is better; None where there is no signal)
+        """
+        import numpy as np
+        if grid is None:
+            grid = self.fitgrid()
+        rows = np.asarray(rows,dtype=float)
+        if rows.ndim != 2 or rows.shape[1] != len(grid[0]):
+            raise ValueError('The rows supplied to fitscores must be sampled on the fitgrid() of the molecule (%d m/z values)' %len(grid[0]))
+        nbins = rows.shape[0]//n
+        rows = rows[:nbins*n].reshape(nbins,n,rows.shape[1]).sum(axis=1) # sum every n spectra
+        maxes = rows.max(axis=1)
+        signal = maxes > 0.
+        out = [None]*nbins
+        if signal.any() == True:
+            norm = rows[signal]/maxes[signal][:,np.newaxis]*100. # normalize each spectrum
+            scores = np.sqrt(((norm-grid[1])**2).mean(axis=1))
+            for ind,score in zip(np.nonzero(signal)[0],scores.tolist()):
+                out[ind] = score
+        return out
+    
+    def fragmentpattern(self,comp):
+        """
+        returns the raw isotope pattern of a composition being added to the molecule
+        patterns are cached on the class so that repeated additions of the same fragment are not recalculated
+        """
+        key = (self.ks['ipmethod'],self.ks['masstable'],self.ks['decpl'],self.ks['coverage'],tuple(sorted(comp.items())))
+        try:
+            return self.fragments[key]
+        except KeyError:
+            self.fragments[key] = self.isotopepattern(comp)
+            return self.fragments[key]
+    
     def gaussianisotopepattern(self):
         """
         simulates the isotope pattern obtained in a mass spectrometer by applying a gaussian distribution to a bar isotope pattern with a given resolution
@@ -491,24 +932,41 @@ class Molecule(object):
         except ValueError:
             raise ValueError('The element "%s" could not be found in either the predefined common abbreviations, in the NIST element database, nor interpreted as an isotope, please check your input.' %(string))
 
-    def molecularformula(self):
-        """generates the molecular formula as the string"""
+    def isotopepattern(self,comp,blocks=None):
+        """
+        generates the raw isotope pattern of a composition using the isotope pattern method of the instance
+        blocks: (dict) the number of each abbreviation contained in the composition (their precompiled patterns are combined)
+        """
+        if blocks and self.ks['library'] is True and self.ks['ipmethod'] in ['isospec','aggregate']:
+            return self.blockpattern(comp,blocks)
+        if self.ks['ipmethod'] == 'multiplicative':
+            return self.rawisotopepattern(comp,dec=self.ks['decpl'])
+        elif self.ks['ipmethod'] == 'isospec':
+            return self.finestructure(comp,self.ks['coverage']) # fine structure pattern covering the specified probability
+        elif self.ks['ipmethod'] == 'aggregate':
+            return self.aggregatedisotopepattern(comp) # nominal mass pattern (mass defects are consolidated)
+        raise ValueError('The isotope pattern method "%s" is not supported (use "multiplicative", "isospec", or "aggregate")' %self.ks['ipmethod'])
+    
+    def molecularformula(self,comp=None):
+        """generates the molecular formula as the string (of the molecule unless another composition is supplied)"""
         if self.ks['verbose'] is True:
             self.sys.stdout.write('Molecular formula: ')
+        if comp is None:
+            comp = self.comp
         out = ''
-        if self.comp.has_key('C'): # carbon and hydrogen first according to hill formula
+        if comp.has_key('C'): # carbon and hydrogen first according to hill formula
             out += 'C'
-            if self.comp['C'] > 1:
-                out += str(self.comp['C'])
-        if self.comp.has_key('H'):
+            if comp['C'] > 1:
+                out += str(comp['C'])
+        if comp.has_key('H'):
             out += 'H'
-            if self.comp['H'] > 1:
-                out += str(self.comp['H'])
-        for key,val in sorted(self.comp.items()): # alphabetically otherwise
+            if comp['H'] > 1:
+                out += str(comp['H'])
+        for key,val in sorted(comp.items()): # alphabetically otherwise
             if key != 'C' and key != 'H':
                 out += key
-                if self.comp[key] > 1:
-                    out += str(self.comp[key])
+                if comp[key] > 1:
+                    out += str(comp[key])
         if self.ks['verbose'] is True:
             self.sys.stdout.write('%s DONE\n' %out)
         return out
@@ -520,19 +978,14 @@ class Molecule(object):
         mwout = 0
         pcompout = {}
         for element in self.comp:
-            try:
-                for isotope in self.md[element]:
-                    if isotope == 0:
-                        continue
-                    mwout += self.md[element][isotope][0]*self.md[element][isotope][1]*self.comp[element] # add every isotope times its natural abundance times the number of that element
-                    try:
-                        pcompout[element] += self.md[element][isotope][0]*self.md[element][isotope][1]*self.comp[element]
-                    except KeyError:
-                        pcompout[element] = self.md[element][isotope][0]*self.md[element][isotope][1]*self.comp[element]
-            except KeyError: # if isotope
+            if self.md.has_key(element) is True:
+                mass = self.md.averagemass(element)*self.comp[element] # every isotope times its natural abundance times the number of that element
+                mwout += mass
+                pcompout[element] = pcompout.get(element,0.)+mass
+            else: # if isotope
                 ele,iso = self.isotope(element)
-                mwout += self.md[ele][iso][0]*self.comp[element] # assumes 100% abundance if specified
-                pcompout[ele] = self.md[ele][iso][0]*self.comp[element]
+                mwout += self.md.mass(ele,iso)*self.comp[element] # assumes 100% abundance if specified
+                pcompout[ele] = pcompout.get(ele,0.)+self.md.mass(ele,iso)*self.comp[element]
         for element in pcompout: # determines the percent composition of each element
             pcompout[element] = pcompout[element]/mwout
         if self.ks['verbose'] is True:
@@ -599,6 +1052,17 @@ class Molecule(object):
         pl.ticklabel_format(useOffset=False)
         pl.show()
     
+    def powerpattern(self,rawip,n,thresh=0.01):
+        """raises a raw isotope pattern to the power n (by repeated squaring), i.e. the pattern of n of that species"""
+        out = None
+        while n > 0:
+            if n & 1:
+                out = rawip if out is None else self.combinepatterns(out,rawip,thresh)
+            n >>= 1
+            if n > 0:
+                rawip = self.combinepatterns(rawip,rawip,thresh)
+        return out
+    
     def preciseexactmass(self):
         """determines the precise exact mass from the bar isotope pattern"""
         ind = self.barip[1].index(100.)
@@ -625,28 +1089,27 @@ class Molecule(object):
         out = [[0.],[100.]]
         for key in comp: # for each element
             if self.md.has_key(key) is True: # if natural abundance
-                bnds = []
-                for mass in self.md[key]:
-                    bnds.append(self.md[key][mass][0]) # pull all the masses (used for Spectrum object generation)
+                bnds = [self.md.mass(key)] # pull all the masses (used for Spectrum object generation)
+                bnds.extend([m for num,m,a in self.md.isotopes(key)])
+                masses,abunds = self.md.natural(key) # isotopes with nonzero abundance
                 for n in range(comp[key]): # for n number of atoms of each element
                     if self.ks['verbose'] is True:
                         self.sys.stdout.write('\rProcessing element %s %d/%d' %(key,n+1,comp[key]))
                     start = min(out[0])+round(min(bnds),dec)-10**-dec
                     end = max(out[0])+round(max(bnds),dec)+10**-dec
                     spec = Spectrum(dec,start,end,empty=self.ks['emptyspec']) # generate spectrum object
-                    for mass in self.md[key]:# for each mass of that element 
-                        if mass != 0:
-                            if self.md[key][mass][1] != 0: # if intensity is nonzero
-                                for ind,val in enumerate(out[0]): # for every current mass in the building isotope pattern
-                                    spec.addvalue(out[0][ind]+round(self.md[key][mass][0],dec),out[1][ind]*self.md[key][mass][1]) # add intensity at the appropriate mass
+                    for mass,abund in zip(masses,abunds): # for each mass of that element with nonzero intensity
+                        for ind,val in enumerate(out[0]): # for every current mass in the building isotope pattern
+                            spec.addvalue(out[0][ind]+round(mass,dec),out[1][ind]*abund) # add intensity at the appropriate mass
                     spec.normalize(top=100.) # normalize spectrum
                     spec.threshold(thresh) # drop values below threshold
                     out = spec.trim()
             else: # if specific isotope
                 temp = []
                 ele,iso = self.isotope(key)
+                isomass = self.md.mass(ele,iso)
                 for ind,val in enumerate(out[0]):
-                    temp.append(out[0][ind]+self.md[ele][iso][0])
+                    temp.append(out[0][ind]+isomass)
                 out = [list(temp),out[1]]
             if self.ks['verbose'] is True:
                 self.sys.stdout.write('\n')
@@ -667,11 +1130,11 @@ class Molecule(object):
             self.sys.stdout.write('Estimating exact mass: ')
         em = 0.
         for key in self.comp:
-            try:
-                em += self.md[key][0][0]*self.comp[key]
-            except KeyError:
+            if self.md.has_key(key) is True:
+                em += self.md.mass(key)*self.comp[key]
+            else:
                 ele,iso = self.isotope(key)
-                em += self.md[ele][iso][0]*self.comp[key]
+                em += self.md.mass(ele,iso)*self.comp[key]
         ## accounts for the mass of an electron (if you have access to an orbitrap this might affect you)
         #if self.ks['sign'] == '+': 
         #    em -= (9.10938356*10**-28)*charge
@@ -681,13 +1144,38 @@ class Molecule(object):
             self.sys.stdout.write('%.5f DONE\n' %(em/self.ks['charge']))
         return em/self.ks['charge']
     
-    def sigmafwhm(self):
-        """determines the full width at half max and sigma for a normal distribution"""
+    def sigmafwhm(self,em=None):
+        """determines the full width at half max and sigma for a normal distribution (at the exact mass of the molecule unless supplied)"""
         import math
-        fwhm = self.em/self.ks['res']
+        if em is None:
+            em = self.em
+        fwhm = em/self.ks['res']
         sigma = fwhm/(2*math.sqrt(2*math.log(2))) # based on the equation FWHM = 2*sqrt(2ln2)*sigma
         return fwhm,sigma
     
+    @staticmethod
+    def zscore(conf):
+        """
+        returns the z-score of the two-sided confidence interval of a normal distribution
+        (the inverse of erf is found by bisection and cached for each confidence level)
+        """
+        try:
+            return Molecule.zscores[conf]
+        except KeyError:
+            pass
+        if conf <= 0. or conf >= 1.:
+            raise ValueError('The confidence interval must be between 0 and 1 (supplied: %s)' %str(conf))
+        import math
+        lower,upper = 0.,40.
+        for i in range(100):
+            mid = (lower+upper)/2.
+            if math.erf(mid/math.sqrt(2.)) < conf:
+                lower = mid
+            else:
+                upper = mid
+        Molecule.zscores[conf] = (lower+upper)/2.
+        return Molecule.zscores[conf]
+    
     
 if __name__ == '__main__': # for testing and troubleshooting
     mol = Molecule(
@@ -0,0 +1,155 @@
+"""
+Peptide class
+A Molecule built from an amino acid sequence (one-letter codes)
+
+The composition is built from the residue table in _formabbrvs.py rather than by interpreting a formula.
+Two isotope envelopes are available:
+    'exact': the isotope pattern of each residue is calculated once (and cached for every Peptide) and the
+        peptide pattern is built by convolving the residue patterns
+    'averagine': an approximate envelope for screening, calculated from the averagine model
+        (Senko et al. J. Am. Soc. Mass Spectrom. 1995, 6, 229-233) scaled to the molecular weight of the
+        peptide and shifted to its monoisotopic mass (also cached)
+The exact envelope of a peptide created with the averagine envelope can be calculated on demand with exact().
+
+The isotope pattern method of the Molecule class is still used for the residue patterns, but Peptide
+defaults to ipmethod='aggregate' as the fine structure is rarely of interest for peptides.
+
+new:
+    ---1.0
+"""
+from _Molecule import Molecule
+
+class Peptide(Molecule):
+    averagine = {'C':4.9384,'H':7.7583,'N':1.3577,'O':1.4773,'S':0.0417} # average amino acid residue
+    averagines = {} # averagine patterns which have already been calculated (shared between instances)
+    residuepowers = {} # patterns of n of a given residue which have already been calculated (shared between instances)
+    tail = 0.0001 # threshold (percent of the maximum) used while convolving residues so that the tails are not lost
+    def __init__(self,sequence,**kwargs):
+        """
+        Determines the properties of a peptide from its amino acid sequence
+
+        sequence: (string) one-letter amino acid codes (e.g. 'PEPTIDE')
+        envelope: (string) 'exact' or 'averagine' (see above)
+        nterm: (string) the formula of the N-terminal group
+        cterm: (string) the formula of the C-terminal group
+        accepts the keyword arguments of the Molecule class
+        """
+        self.pks = { # peptide keyword arguments
+        'envelope': 'exact', # isotope envelope to calculate ('exact' or 'averagine')
+        'nterm': 'H', # N-terminal group
+        'cterm': 'OH', # C-terminal group
+        }
+        for key in self.pks:
+            if key in kwargs:
+                self.pks[key] = kwargs[key]
+                del kwargs[key]
+        if self.pks['envelope'] not in ['exact','averagine']:
+            raise ValueError('The envelope "%s" is not supported (use "exact" or "averagine")' %self.pks['envelope'])
+        if kwargs.has_key('ipmethod') is False:
+            kwargs['ipmethod'] = 'aggregate'
+        self.sequence = sequence.replace(' ','').upper()
+        self.residues = self.interpretsequence(self.sequence)
+        calc = kwargs.get('calculate',True)
+        kwargs['calculate'] = False
+        Molecule.__init__(self,self.residueformula(),**kwargs) # interprets the composition only
+        self.ks['calculate'] = calc
+        if calc is True:
+            self.calculate()
+            self.default()
+            if self.ks['verbose'] is True:
+                self.printdetails()
+
+    def __str__(self):
+        return "Peptide {}".format(self.sequence)
+
+    def __repr__(self):
+        return "{}('{}')".format(self.__class__.__name__,self.sequence)
+
+    def averaginepattern(self):
+        """
+        generates an approximate isotope pattern from the averagine model
+        the number of averagine units is matched to the molecular weight of the peptide and the pattern
+        is shifted so that the first peak lies at the monoisotopic mass of the peptide
+        """
+        units = self.mw/sum([self.md.averagemass(ele)*num for ele,num in self.averagine.items()])
+        comp = dict([(ele,int(round(num*units))) for ele,num in self.averagine.items()])
+        comp = dict([(ele,num) for ele,num in comp.items() if num > 0])
+        key = (self.ks['masstable'],tuple(sorted(comp.items())))
+        try:
+            rawip = self.averagines[key]
+        except KeyError:
+            rawip = self.aggregatedisotopepattern(comp)
+            self.averagines[key] = rawip
+        shift = self.monoisotopicmass(self.comp) - self.monoisotopicmass(comp)
+        return [[mz+shift for mz in rawip[0]],list(rawip[1])]
+
+    def calculate(self,rawip=None):
+        """
+        calculates the properties of the peptide using the envelope specified (unless a raw isotope pattern is supplied)
+        if the composition no longer matches the residues (e.g. after a subtraction), it is calculated as a Molecule
+        """
+        if rawip is None and self.comp != self.composition(self.residueformula()):
+            Molecule.calculate(self)
+            return
+        if rawip is None:
+            self.mw,self.pcomp = self.molecularweight()
+            if self.pks['envelope'] == 'averagine':
+                rawip = self.averaginepattern()
+            else:
+                rawip = self.residuepattern()
+        Molecule.calculate(self,rawip)
+
+    def exact(self):
+        """recalculates the peptide with the exact (residue based) isotope envelope and returns the bar isotope pattern"""
+        self.pks['envelope'] = 'exact'
+        self.calculate()
+        return self.barip
+
+    def interpretsequence(self,sequence):
+        """converts a sequence of one-letter codes to a dictionary of the number of each residue"""
+        from _formabbrvs import aminoacids
+        out = {}
+        for ind,code in enumerate(sequence):
+            if aminoacids.has_key(code) is False:
+                raise ValueError('The amino acid code "%s" (position %d in "%s") is not defined in _formabbrvs.py' %(code,ind+1,sequence))
+            out[aminoacids[code]] = out.get(aminoacids[code],0) + 1
+        return out
+
+    def monoisotopicmass(self,comp):
+        """determines the mass of a composition from the most abundant isotope of each element"""
+        out = 0.
+        for key in comp:
+            if self.md.has_key(key) is True:
+                out += self.md.mass(key)*comp[key]
+            else:
+                ele,iso = self.isotope(key)
+                out += self.md.mass(ele,iso)*comp[key]
+        return out
+
+    def residueformula(self):
+        """generates a formula string (interpretable by the Molecule class) from the residues and terminal groups"""
+        out = self.pks['nterm']
+        for res in sorted(self.residues):
+            out += '(%s)%d' %(res,self.residues[res])
+        return out + self.pks['cterm']
+
+    def residuepattern(self):
+        """builds the isotope pattern of the peptide by convolving the (cached) patterns of its residues and terminal groups"""
+        from _formabbrvs import abbrvs
+        rawip = self.fragmentpattern(self.composition(self.pks['nterm']+self.pks['cterm']))
+        for ind,res in enumerate(sorted(self.residues)):
+            key = (self.ks['ipmethod'],self.ks['masstable'],self.ks['decpl'],self.ks['coverage'],res,self.residues[res])
+            try:
+                pattern = self.residuepowers[key]
+            except KeyError:
+                pattern = self.powerpattern(self.fragmentpattern(abbrvs[res]),self.residues[res],self.tail)
+                self.residuepowers[key] = pattern
+            if ind == len(self.residues)-1: # the final pattern is trimmed to the usual threshold
+                rawip = self.combinepatterns(rawip,pattern)
+            else:
+                rawip = self.combinepatterns(rawip,pattern,self.tail)
+        return rawip
+
+if __name__ == '__main__':
+    pep = Peptide('PEPTIDE',charge=2)
+    print pep, pep.sf, pep.em, pep.barip
@@ -0,0 +1,147 @@
+"""
+PyRSIRCache class
+A content-addressed cache of the data which PyRSIR extracts from an mzML file
+
+Every entry is keyed on the SHA-1 digest of the contents of the mzML file and on the definition of what was
+extracted (for a species: its affinity, level, and function, the bounds which were resolved for it, and the
+molecule which its isotope pattern fit grid is calculated from). A re-run with edited parameters therefore only
+has to extract the species whose definition changed, and entries of a file which has since changed are never used.
+
+The digest of the file is remembered along with its size and modification time so that an unchanged file is
+not read again to fingerprint it.
+The entries are marshalled into a directory next to the mzML file (the file name with a .pyrsir extension).
+
+new:
+    ---1.0
+"""
+
+class PyRSIRCache(object):
+    version = 1 # format version of the entries (increment when their contents change)
+    def __init__(self,filename,path=None,verbose=False):
+        """
+        Results cache of a mzML file
+
+        filename: (string) the mzML file
+        path: (string) the directory of the cache (defaults to the file name with a .pyrsir extension)
+        verbose: (bool) chatty
+        """
+        self.os = __import__('os')
+        self.sys = __import__('sys')
+        self.filename = filename
+        self.verbose = verbose
+        if path is None:
+            base = filename[:-3] if filename.lower().endswith('.gz') else filename
+            path = self.os.path.splitext(base)[0]+'.pyrsir'
+        self.path = path
+        self.digest = self.fingerprint()
+
+    def __str__(self):
+        return 'PyRSIR results cache of %s (%s)' %(self.filename,self.digest)
+
+    def __repr__(self):
+        return "%s('%s')" %(self.__class__.__name__,self.filename)
+
+    def fingerprint(self):
+        """returns the SHA-1 digest of the contents of the file (remembered while the size and modification time are unchanged)"""
+        import hashlib
+        marshal = __import__('marshal')
+        stat = self.os.stat(self.filename)
+        memo = self.os.path.join(self.path,'fingerprint')
+        try:
+            handle = open(memo,'rb')
+            try:
+                known = marshal.load(handle)
+            finally:
+                handle.close()
+            if (known['size'],known['mtime']) == (stat.st_size,stat.st_mtime):
+                return known['digest']
+        except (IOError,OSError,EOFError,ValueError,TypeError,KeyError): # missing or unreadable
+            pass
+        if self.verbose is True:
+            self.sys.stdout.write('Fingerprinting %s' %self.filename)
+            self.sys.stdout.flush()
+        sha = hashlib.sha1()
+        handle = open(self.filename,'rb')
+        try:
+            while True:
+                chunk = handle.read(1048576)
+                if len(chunk) == 0:
+                    break
+                sha.update(chunk)
+        finally:
+            handle.close()
+        digest = sha.hexdigest()
+        self.write(memo,{'size': stat.st_size, 'mtime': stat.st_mtime, 'digest': digest})
+        if self.verbose is True:
+            self.sys.stdout.write(' DONE\n')
+        return digest
+
+    def get(self,key):
+        """returns the entry of a key (None if it is not in the cache)"""
+        marshal = __import__('marshal')
+        try:
+            handle = open(self.os.path.join(self.path,key),'rb')
+            try:
+                return marshal.load(handle)
+            finally:
+                handle.close()
+        except (IOError,OSError,EOFError,ValueError,TypeError): # missing or unreadable
+            return None
+
+    def key(self,*parts):
+        """returns the key of an entry from its description (combined with the digest of the file)"""
+        import hashlib
+        return hashlib.sha1(repr((self.version,self.digest)+parts)).hexdigest()
+
+    @staticmethod
+    def locate(filename):
+        """
+        returns the mzML file which the mzML class would load for the supplied name
+        (None if there is no mzML file yet, e.g. when it has to be converted from a raw file)
+        """
+        import os
+        base = filename[:-4] if filename.lower().endswith('.raw') else filename
+        for name in [base,base+'.mzML.gz',base+'.mzml.gz',base+'.mzML',base+'.mzml']:
+            if os.path.isfile(name) is True and (name.lower().endswith('.mzml') or name.lower().endswith('.mzml.gz')):
+                return name
+        return None
+
+    def put(self,key,value):
+        """stores an entry (values must be marshallable: numbers, strings, None, and lists, tuples or dictionaries of them)"""
+        self.write(self.os.path.join(self.path,key),value)
+
+    def specieskey(self,dct):
+        """
+        returns the key of the extracted data of a species
+        dct: the dictionary of the species (after its bounds have been resolved)
+        """
+        mol = dct.get('mol')
+        return self.key(
+        'species',
+        dct.get('affin'),
+        dct.get('level'),
+        dct.get('function'),
+        list(dct['bounds']),
+        (mol.key,mol.settings) if mol is not None else None, # the fit grid is calculated from the molecule
+        )
+
+    def write(self,filepath,value):
+        """marshals a value into a file (written to a temporary file first so that an interrupted write leaves no entry)"""
+        marshal = __import__('marshal')
+        try:
+            if self.os.path.isdir(self.path) is False:
+                self.os.makedirs(self.path)
+            handle = open(filepath+'.tmp','wb')
+            try:
+                marshal.dump(value,handle)
+            finally:
+                handle.close()
+            if self.os.path.isfile(filepath) is True: # rename does not replace files in windows
+                self.os.remove(filepath)
+            self.os.rename(filepath+'.tmp',filepath)
+        except (IOError,OSError): # the directory is not writable, nothing is cached
+            pass
+
+if __name__ == '__main__':
+    cache = PyRSIRCache(PyRSIRCache.locate('MultiTest'),verbose=True)
+    print cache, cache.get(cache.key('file')) is not None
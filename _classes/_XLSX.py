@@ -2,6 +2,10 @@
 Class for opening and handling excel files with commonly used data formats
 v 1
 CHANGELOG:
+- added a write-only mode (writeonly keyword argument) which streams new sheets into the file row by row
+  (the existing sheets are copied into the output on save)
+- writersim and writespectrum append whole rows rather than writing each cell
+- added writetable
 
 ---1.4
 """
@@ -11,6 +15,7 @@ class XLSX(object):
         self.ks = { # default keyword arguments
         'verbose': True, # toggle verbose
         'create': False, # create new workbook if supplied name is not found in directory
+        'writeonly': False, # stream new sheets into a write-only workbook (the existing sheets are copied as values on save)
         }
         if set(kwargs.keys()) - set(self.ks.keys()): # check for invalid keyword arguments
             string = ''
@@ -23,6 +28,13 @@ class XLSX(object):
             self.sys = __import__('sys')
         self.loadop() # check that lxml is present and load openpyxl
         self.wb,self.bookname = self.loadwb(bookname)
+        if self.ks['writeonly'] is True:
+            # Cells of write-only sheets are streamed to temporary files as each row is appended and
+            # cannot be revisited, so the loaded workbook is kept for reading and for any changes to existing sheets.
+            # Multispectrum sheets are collected and streamed when the workbook is saved (their columns are written in several calls).
+            self.out = self.op.Workbook(write_only=True)
+            self.pending = {} # spectra of the multispectrum sheets of the write-only workbook
+            self.saved = False # write-only workbooks are consumed when they are saved
 
     def __str__(self):
         return 'Loaded excel file "%s"' %self.bookname
@@ -33,10 +45,15 @@ class XLSX(object):
     def checkduplicatesheet(self,sheet):
         """checks for duplicate sheets in the workbook and creates a unique name"""
         i = 1
-        while sheet+' ('+`i`+')' in self.wb.get_sheet_names():
+        while sheet+' ('+`i`+')' in self.sheetnames():
             i += 1
         return sheet+' ('+`i`+')'
     
+    def checkwritable(self):
+        """raises an error if a write-only workbook has already been saved (its sheets have been consumed)"""
+        if self.ks['writeonly'] is True and self.saved is True:
+            raise ValueError('Write-only workbooks can only be saved once ("%s" has already been saved). Load the workbook again to make further changes.' %self.bookname)
+    
     def correctextension(self,bookname):
         """attempts to correct the extension of the supplied filename"""
         oops = {'.xls':'x','.xl':'sx','.x':'lsx','.':'xlsx','.xlsx':''} # incomplete extensions
@@ -85,7 +102,7 @@ class XLSX(object):
                     """
                     if self.ks['verbose'] is True:
                         self.sys.stdout.write('Creating workbook "%s" and loading it into memory' % bookname)
-                    wb = self.op.Workbook(bookname,write_only=False) # create workbook
+                    wb = self.op.Workbook(write_only=False) # create workbook
                     wb.save(bookname) # save it
                     wb = self.op.load_workbook(bookname) # load it
                     wb.remove_sheet(wb.worksheets[0]) # remove the old "Sheet"
@@ -95,6 +112,15 @@ class XLSX(object):
             self.sys.stdout.write(' DONE\n')
         return wb,bookname
     
+    def newsheet(self,sheetname):
+        """creates a new sheet (in the write-only workbook if in write-only mode)"""
+        self.checkwritable()
+        if self.ks['writeonly'] is True:
+            return self.out.create_sheet(title=sheetname)
+        cs = self.wb.create_sheet()
+        cs.title = sheetname
+        return cs
+    
     def pullmultispectrum(self,sheetname):
         """reads multispectrum output back into dictionary format"""
         cs = self.wb.get_sheet_by_name(sheetname)
@@ -299,10 +325,17 @@ at least one of name, formula, start, or end must be specified for each species
         removes sheets from the excel file
         delete is a set of strings to be removed
         """
+        self.checkwritable()
         for sheet in self.wb.get_sheet_names(): # clears sheets that will contain new peak information
             if sheet in delete:
                 dels = self.wb.get_sheet_by_name(sheet)
                 self.wb.remove_sheet(dels)
+        if self.ks['writeonly'] is True: # new sheets which have not been saved
+            for sheet in self.out.sheetnames:
+                if sheet in delete:
+                    self.out.remove_sheet(self.out[sheet])
+                    if self.pending.has_key(sheet) is True:
+                        del self.pending[sheet]
 
     def rowandcolumn(self,row,col):
         """takes an index location of row and column and returns the cell location used by excel"""
@@ -347,14 +380,52 @@ at least one of name, formula, start, or end must be specified for each species
         if outname is None:
             outname = self.bookname
         
+        self.checkwritable()
+        wb = self.wb
+        if self.ks['writeonly'] is True:
+            self.streamsheets()
+            wb = self.out
         try:
-            self.wb.save(outname)
+            wb.save(outname)
         except IOError:
             version_input('\nThe excel file could not be written. Please close "%s" and press any key to retry save.' %outname)
             try:
-                self.wb.save(outname)
+                wb.save(outname)
             except IOError:
                 raise IOError('\nThe excel file "%s" could not be written.' %outname)
+        if self.ks['writeonly'] is True:
+            self.saved = True
+    
+    def sheetnames(self):
+        """returns the names of the sheets in the workbook (including new write-only sheets)"""
+        if self.ks['writeonly'] is True:
+            return self.wb.get_sheet_names()+self.out.sheetnames
+        return self.wb.get_sheet_names()
+    
+    def streamsheets(self):
+        """
+        streams the collected multispectrum sheets into the write-only workbook and copies the existing sheets
+        (values only) in front of the new sheets (called once when a write-only workbook is saved)
+        """
+        if self.pending is None: # already streamed
+            return
+        from itertools import izip_longest
+        for sheetname,spectra in self.pending.items():
+            cs = self.out[sheetname]
+            header = []
+            columns = []
+            for specname,xunit,yunit,xlist,ylist in spectra:
+                header.extend([specname,xunit,yunit,None])
+                columns.extend([[],xlist,ylist,[]])
+            cs.append(header[:-1])
+            for row in izip_longest(*columns[:-1]):
+                cs.append(row)
+        self.pending = None
+        for ind,sheetname in enumerate(self.wb.get_sheet_names()):
+            cs = self.out.create_sheet(title=sheetname)
+            for row in self.wb.get_sheet_by_name(sheetname).iter_rows(values_only=True):
+                cs.append(row)
+            self.out.move_sheet(sheetname,ind-len(self.out.sheetnames)+1)
     
     def updatersimparams(self,sp,sheet='parameters'):
         """
@@ -394,7 +465,15 @@ at least one of name, formula, start, or end must be specified for each species
         blank   |xvalues |yvalues | blank |...repeated
         ...     |...     |...     | blank |...repeated
         
+        in write-only mode, the spectra of a new sheet are collected and streamed into it on save
         """
+        self.checkwritable()
+        if self.ks['writeonly'] is True and sheetname not in self.wb.get_sheet_names(): # existing sheets are written in place
+            if self.pending.has_key(sheetname) is False:
+                self.out.create_sheet(title=sheetname) # created now to keep the order of the sheets
+                self.pending[sheetname] = []
+            self.pending[sheetname].append((specname,xunit,yunit,xlist,ylist))
+            return
         if self.__dict__.has_key('wms') is False: # check for dictionary in self
             self.wms = {sheetname:1}
         if self.wms.has_key(sheetname) is False: # check for preexisting key
@@ -426,40 +505,47 @@ at least one of name, formula, start, or end must be specified for each species
         sheetname is what the sheet will be named in the excel file
         mode is the current mode being output (usually either +,-,or UV)
         """
-        if sheetname not in self.wb.get_sheet_names():
-            cs = self.wb.create_sheet() #create new sheet
-            cs.title = sheetname # rename sheet
-            cs['A1'] = 'Time'
-            offset = 0
-            if tic is not None:
-                offset += 1 # skip TIC column
-                cs['B1'] = 'TIC'
-            for ind,val in enumerate(time): #write time information
-                cs.cell(row = (ind+2),column = 1).value = time[ind] #write time list
-                if tic is not None:
-                    cs.cell(row = (ind+2),column = 2).value = tic[ind] #write TIC list
-            col = 1 + offset
+        if sheetname not in self.sheetnames():
+            from itertools import izip_longest
+            cs = self.newsheet(sheetname) #create new sheet
+            header = ['Time']
+            columns = [time]
+            if tic is not None: # TIC column
+                header.append('TIC')
+                columns.append(tic)
             for species,dct in sorted(sp.items()):
-                if sp[species]['affin'] is mode: # if the species' affinity is the mode
-                    col+=1 # +1 from 0 to 1, +1 each to skip Time and TIC columns
-                    cs.cell(row = 1,column = col).value = str(species) #write species names
-                    for ind,val in enumerate(sp[species][key]):
-                        cs.cell(row = (ind+2),column = col).value = sp[species][key][ind]
+                if sp[species]['affin'] is mode and sp[species].has_key(key): # if the species' affinity is the mode (and the values were generated)
+                    header.append(str(species)) #write species names
+                    columns.append(sp[species][key])
+            cs.append(header)
+            for row in izip_longest(*columns): # written row by row
+                cs.append(row)
             
     def writespectrum(self,x,y,sheet='spectrum',xunit='m/z',yunit='counts'):
         """
         writes a provided spectrum to the specified sheet in the workbook
         x and y should be paired lists of values
         """
-        if sheet in self.wb.get_sheet_names():
+        if sheet in self.sheetnames():
             sheet = self.checkduplicatesheet(sheet)
-        ws = self.wb.create_sheet()
-        ws.title = sheet
-        ws['A1'] = xunit
-        ws['B1'] = yunit
+        ws = self.newsheet(sheet)
+        ws.append([xunit,yunit])
         for ind,val in enumerate(x):
-            ws.cell(row = ind+2,column = 1).value = x[ind]
-            ws.cell(row = ind+2,column = 2).value = y[ind]
+            ws.append([x[ind],y[ind]])
+    
+    def writetable(self,rows,sheetname,header=None):
+        """
+        writes a table to the specified sheet in the workbook
+        rows is a list of lists of values (one list for each row)
+        header (if specified) is a list of column headings written in the first row
+        """
+        if sheetname in self.sheetnames():
+            sheetname = self.checkduplicatesheet(sheetname)
+        ws = self.newsheet(sheetname)
+        if header is not None:
+            ws.append(header)
+        for row in rows:
+            ws.append(row)
         
 if __name__ == '__main__':
     name = 'useless delete this'
@@ -6,12 +6,26 @@ CHANGELOG:
     moved self.ftt calls into self.ks (allows for calling of that function on initialization)
     changed several function names to contain underscores (to make reading the function names easier)
     ---2.5 building
+    pull_species_data can sample every scan onto the fit grid of each species for time-resolved isotope pattern scoring
+    added a columnar store (tostore() and the store kwarg) which holds the decoded scans as flat binary arrays for repeated analysis
+    the XML tree is now parsed on first access, and scan retrieval goes through iterscans() (which reads either the tree or the store)
+    uncompressed mzML files are memory-mapped and scans are decoded directly from the mapped file (mmap kwarg)
+    decoded scans are kept in a least recently used cache with a memory budget (cachesize kwarg, see ScanCache)
+    mzml_contents and function_timetic read only the headers of each spectrum (iterheaders()), the binary data is skipped
+    the precursor of every MS/MS scan is recorded (precursors) and can be searched by m/z and time with precursor_scans()
+    added ce_index() and sum_scans_by_ce() which sum the scans of each collision energy in one pass (energy-dependent MS/MS)
+    chromatograms are indexed by id (chromindex) and can be decoded individually as arrays with chromatogram()
+    selected reaction monitoring species ('transition' key) are read from the chromatograms of the file rather than the spectra
+    function_timetic fills missing total ion currents from the TIC chromatogram of the file (and can validate them against it)
+    added pull_traces() which calculates the TIC, base peak chromatogram, and extracted ion chromatograms of each function in one pass
+    files which are still being written can be followed (follow kwarg), update() reads only the spectra appended since the last call
 
 to add:
     try to extract timepoints and tic from chromatogramList (x values are sorted, so this probably won't work)
 """
 
 class mzML(object):
+    storeversion = 4 # format version of the columnar store (increment when the layout changes)
     def __init__(self,filename,**kwargs):
         """interprets and extracts information from a mzML (mass spectrum) file"""
         # check and set kewyord arguments
@@ -22,6 +36,10 @@ class mzML(object):
         'gzip': True, # toggle gzip compression of mzml file (reduces file sizes even further
         'obo': None, # specific path to an *.obo file or the directory containing one
         'ftt': False, # run function time tic on initialization
+        'store': False, # read the decoded scans from a columnar store next to the file (created if missing or out of date, see tostore())
+        'mmap': True, # memory-map uncompressed mzML files and decode scans directly from the mapped file (see mapindex())
+        'cachesize': 67108864, # memory budget (in bytes) of the cache of decoded scans (0 disables the cache)
+        'follow': False, # the file is still being written, spectra appended to it are read with update() (uncompressed mzML only)
         }
         if set(kwargs.keys()) - set(self.ks.keys()): # check for invalid keyword arguments
             string = ''
@@ -42,22 +60,36 @@ class mzML(object):
         self.sys.path.append(self.os.path.dirname(self.os.path.realpath(__file__))) # required so that this class can access other classes in the same directory
         
         # load file and determine key properties
-        if self.ks['verbose'] is True:
-            self.sys.stdout.write('Loading %s into memory' %self.filename)
-            self.sys.stdout.flush()
-        if self.filename.lower().endswith('.mzml.gz'): # if mzml is gzipped
-            import gzip
-            handle = gzip.open(self.filename) # unzip the file
-        else:
-            handle = self.filename
-        import xml.dom.minidom
-        try:
-            self.tree = xml.dom.minidom.parse(handle) # full mzML file
-        except:
-            raise IOError('The mzML file "%s" could not be loaded. The file is either unsupported, corrupt, or incomplete.' %self.filename)
+        self.dom = None # the XML tree (parsed on first access of tree)
+        self.store = None # the columnar store (if used)
+        self.mm = None # the memory-mapped file (if used)
+        self.index = None # byte offsets of the spectra and chromatograms in the memory-mapped file
+        self.scantable = None # the function, start time, total ion current, and collision energy of every scan
+        self.precursors = None # the scan index, target, lower and upper offsets, collision energy, time, and polarity of every precursor
+        self.pindex = None # sorted precursor isolation windows (see precursor_scans())
+        self.chromindex = None # the position of each chromatogram in the file keyed by its id
+        self.chromcache = {} # chromatograms which have already been decoded (see chromatogram())
+        self.ticchrom = None # the id of the total ion current chromatogram of the file (if any)
+        self.transitions = None # the function, precursor and product m/z, and collision energy of each selected reaction monitoring chromatogram
+        self.scancache = self.ScanCache(self.ks['cachesize']) # recently decoded scans
+        self.mapped = 0 # byte offset of the end of the last complete element in the memory-mapped file
+        if self.ks['follow'] is True and (self.filename.lower().endswith('.mzml') is False or self.ks['store'] is True):
+            raise ValueError('Only uncompressed mzML files can be followed, and the columnar store cannot be used while following a file ("%s")' %self.filename)
+        if (self.ks['mmap'] is True or self.ks['follow'] is True) and self.filename.lower().endswith('.mzml') is True:
+            import mmap
+            handle = open(self.filename,'rb')
+            try:
+                self.mm = mmap.mmap(handle.fileno(),0,access=mmap.ACCESS_READ) # the mapping remains valid after the file is closed
+            finally:
+                handle.close()
+        if self.ks['store'] is True:
+            self.store = self.openstore()
+            if self.store is None: # missing or out of date
+                self.mzml_contents()
+                self.tostore()
+                self.store = self.openstore()
+                self.dom = None # the scans are now read from the store
         self.mzml_contents() # extract the contents of the mzML
-        if self.ks['verbose'] is True:
-            self.sys.stdout.write(' DONE\n')
         if self.ks['ftt'] is True:
             self.function_timetic()
         
@@ -90,20 +122,14 @@ class mzML(object):
             """will return the spectrum of the scan index provided"""
             if ind < 0 or ind > self.nscans:
                 raise IndexError("The scan index number #%d is outside of the mzML's scan index range (0-%d)" %(ind,self.nscans-1))
-            for spectrum in self.tree.getElementsByTagName('spectrum'):
-                attr = self.attributes(spectrum)
-                if attr['index'] == ind:
-                    return self.extract_spectrum(spectrum)
+            return self.scan(ind)
         
         elif type(ind) is float: # timepoint in function 1
             """float will assume the intended function was 1"""
             if ind < 0 or ind > self.duration:
                 raise ValueError("The supplied time %.3f is outside of this file's time range (0 - %.3f)" %(ind,self.duration))
             ind = self.scan_index(ind)
-            for spectrum in self.tree.getElementsByTagName('spectrum'):
-                attr = self.attributes(spectrum)
-                if attr['index'] == ind:
-                    return self.extract_spectrum(spectrum)
+            return self.scan(ind)
     
     def __add__(self,x):
         return 'Addition to the mzML class is unsupported'
@@ -134,6 +160,62 @@ class mzML(object):
             else:
                 self.warned[name] += 1
 
+    class ScanCache(object):
+        """
+        A least recently used cache of decoded scans which is bounded by an (estimated) memory budget
+        the cache is emptied whenever the signature (size and modification time) of the file changes
+        """
+        def __init__(self,budget):
+            from collections import OrderedDict
+            self.budget = budget # maximum size in bytes
+            self.scans = OrderedDict() # cached scans keyed by scan index (in order of use)
+            self.sizes = {} # estimated size of each cached scan
+            self.size = 0 # estimated size of the cache
+            self.signature = None
+            self.hits = 0
+            self.misses = 0
+        def __contains__(self,index):
+            return index in self.scans
+        def __len__(self):
+            return len(self.scans)
+        def __str__(self):
+            return 'Scan cache: %d scans (%.1f of %.1f MB), %d hits, %d misses' %(len(self.scans),self.size/1048576.,self.budget/1048576.,self.hits,self.misses)
+        def check(self,signature):
+            """empties the cache if the supplied file signature differs from that of the cached scans"""
+            if signature != self.signature:
+                self.clear()
+                self.signature = signature
+        def clear(self):
+            """empties the cache (the hit and miss counters are kept)"""
+            self.scans.clear()
+            self.sizes = {}
+            self.size = 0
+        def get(self,index):
+            """returns the cached (function,x,y) of a scan index (None if it is not cached)"""
+            try:
+                out = self.scans.pop(index)
+            except KeyError:
+                self.misses += 1
+                return None
+            self.scans[index] = out # move to the most recently used end
+            self.hits += 1
+            return out
+        def put(self,index,func,x,y):
+            """adds a decoded scan to the cache (evicting the least recently used scans to stay within the budget)"""
+            import sys
+            size = sys.getsizeof(x)+sys.getsizeof(y)+24*(len(x)+len(y)) # the lists and their float objects
+            if size > self.budget:
+                return
+            if index in self.scans:
+                self.size -= self.sizes[index]
+                del self.scans[index]
+            while self.size + size > self.budget:
+                old,scan = self.scans.popitem(last=False)
+                self.size -= self.sizes.pop(old)
+            self.scans[index] = (func,x,y)
+            self.sizes[index] = size
+            self.size += size
+    
     class cvparam(object):
         """interprets all cvparameter tags within the provided branch and can provide details as required with flexible input"""
         def __init__(self,branch):
@@ -172,6 +254,7 @@ class mzML(object):
         def interpret(self,branch):
             """
             retrieves all the cvParam tags for a given branch
+            (the branch may also be a string of raw XML, e.g. from a memory-mapped file)
             returns a dictionary with keys corresponding to accession number
             each key is a subdictionary with the attributes of the cvParam
             """
@@ -185,11 +268,19 @@ class mzML(object):
                     except ValueError:
                         value = string # otherwise keep as unicode
                 return value
+            if isinstance(branch,basestring): # raw XML
+                import re
+                from xml.sax.saxutils import unescape
+                params = []
+                for tag in re.findall(r'<cvParam\s([^>]*)>',branch):
+                    params.append([(attribute,unicode(unescape(value,{'&quot;':'"','&apos;':"'"}))) for attribute,value in re.findall(r'([\w:]+)="([^"]*)"',tag)])
+            else:
+                params = [cvParam.attributes.items() for cvParam in branch.getElementsByTagName('cvParam')]
             out = {}
-            for cvParam in branch.getElementsByTagName('cvParam'):
-                acc = cvParam.getAttribute('accession') # accession key
+            for attributes in params:
+                acc = dict(attributes)['accession'] # accession key
                 out[acc] = {}
-                for attribute,value in cvParam.attributes.items(): # pull all the attributes
+                for attribute,value in attributes: # pull all the attributes
                     if attribute != 'accession':
                         out[acc][attribute] = stringtodigit(value) # attempt to convert to integer or float, keep as string otherwise
             return out
@@ -483,7 +574,7 @@ class mzML(object):
             raise ValueError('The specified affinity "%s" is not supported.' %affin)
                                                                                                                                                 
     def attributes(self,branch):
-        """pulls all attributes of a supplied branch and creates a dictionary of them"""
+        """pulls all attributes of a supplied branch (or the raw XML of its start tag) and creates a dictionary of them"""
         def stringtodigit(string):
             """attempts to convert a unicode string to float or integer"""
             try:
@@ -494,8 +585,15 @@ class mzML(object):
                 except ValueError:
                     value = string # otherwise keep as unicode
             return value
+        if isinstance(branch,basestring): # raw XML
+            import re
+            from xml.sax.saxutils import unescape
+            tag = branch[:branch.find('>')]
+            pairs = [(attribute,unicode(unescape(value,{'&quot;':'"','&apos;':"'"}))) for attribute,value in re.findall(r'([\w:]+)="([^"]*)"',tag)]
+        else:
+            pairs = branch.attributes.items()
         out = {}
-        for pair in branch.attributes.items():
+        for pair in pairs:
             out[pair[0]] = stringtodigit(pair[1])
         return out
     
@@ -576,6 +674,20 @@ class mzML(object):
         res = [y for y in res if y is not None] # removes None values (below S/N)
         return sum(res)/len(res) # return average
         
+    def ce_index(self,fn=None):
+        """
+        returns a dictionary of the scan indicies acquired at each collision energy
+        fn: the function to index (defaults to every function)
+        (the collision energies are recorded from the spectrum headers by mzml_contents)
+        """
+        out = {}
+        for index,(func,time,tic,ce) in enumerate(self.scantable):
+            if ce is not None and (fn is None or func == fn):
+                if out.has_key(ce) is False:
+                    out[ce] = []
+                out[ce].append(index)
+        return out
+    
     def check_for_file(self,fn):
         """checks for file and converts if necessary"""
         def version_input(string):
@@ -609,6 +721,111 @@ class mzML(object):
                 return self.pw_convert(fn,self.ks['precision'],self.ks['compression'],self.ks['gzip'])
             return fn
     
+    def chromatogram(self,key):
+        """
+        returns a chromatogram by its id without decoding the others
+        
+        key: the id of the chromatogram (see chromindex, e.g. 'TIC')
+        
+        returns a dictionary with the same keys as those of pull_chromatograms(), with the x and y values as arrays
+        decoded chromatograms are kept, so repeated requests do not touch the file (the arrays should not be modified)
+        """
+        import numpy as np
+        if key not in self.chromindex:
+            raise KeyError('The chromatogram "%s" is not contained in %s. Available chromatograms: %s' %(key,self.filename,', '.join(sorted(self.chromindex))))
+        if key not in self.chromcache:
+            for key,x,y,xunit,yunit in self.iterchromatograms([key]):
+                self.chromcache[key] = {'x':np.asarray(x,dtype=np.float64), 'y':np.asarray(y,dtype=np.float64), 'xunit':xunit, 'yunit':yunit}
+        return dict(self.chromcache[key])
+    
+    def chromatogram_tic(self,fn,validate=False,tolerance=0.00001):
+        """
+        matches the scans of a function to the points of the total ion current chromatogram of the file
+        missing total ion currents of the function are filled from the chromatogram
+        
+        fn: the function
+        validate: raise ValueError if the chromatogram does not agree with the spectrum headers
+        tolerance: the largest difference between the start time of a scan and its chromatogram point
+        
+        returns True if the chromatogram was consistent with the function
+        """
+        import numpy as np
+        if self.ticchrom is None:
+            if validate is True:
+                raise ValueError('There is no total ion current chromatogram in %s to validate against' %self.filename)
+            return False
+        chrom = self.chromatogram(self.ticchrom)
+        x = chrom['x']
+        times = np.asarray(self.functions[fn]['timepoints'],dtype=np.float64)
+        right = np.clip(np.searchsorted(x,times),0,max(len(x)-1,0))
+        left = np.clip(right-1,0,max(len(x)-1,0))
+        if len(x) > 0:
+            pos = np.where(np.abs(x[left]-times) < np.abs(x[right]-times),left,right) # nearest point of the chromatogram
+        if len(x) == 0 or np.any(np.abs(x[pos]-times) > tolerance):
+            if validate is True:
+                raise ValueError('The time points of the total ion current chromatogram of %s do not match the scans of function %d' %(self.filename,fn))
+            return False
+        values = chrom['y'][pos].tolist()
+        tic = self.functions[fn]['tic']
+        for ind,val in enumerate(tic):
+            if val is None:
+                tic[ind] = values[ind]
+            elif validate is True and abs(val-values[ind]) > 0.00001*max(abs(val),1.):
+                raise ValueError('The total ion current of scan %d of function %d (%s) does not match that of the chromatogram (%s)' %(ind,fn,str(val),str(values[ind])))
+        return True
+    
+    def decodebinary(self,string,p,speclen):
+        """
+        decodes a base64 binary string (or buffer) into a list of values
+        the format and compression are determined from the cvparameters of the binary data array
+        """
+        formats = {
+        'MS:1000519':['<','i'], # signed 32-bit little-endian integer
+        #'MS:1000520':['',''], # [OBSOLETE] Signed 16-bit float
+        'MS:1000521':['<','f'], # 32-bit precision little-endian floating point conforming to IEEE-754
+        'MS:1000522':['<','l'], # Signed 64-bit little-endian integer
+        'MS:1000523':['<','d'], # 64-bit precision little-endian floating point conforming to IEEE-754.
+        }
+        for key in formats:
+            if p.has_key(key): # find accession number match
+                unpack_format = formats[key][0]+str(speclen)+formats[key][1]
+        decoded = self.b64.decodestring(string) # decode the string
+        if p.has_key('MS:1000574') is True: # if the string is zlib compressed, decompress
+            decoded = self.zlib.decompress(decoded)
+        return list(self.st.unpack(unpack_format,decoded)) # unpack the string
+    
+    def extract_mapped(self,start,end,units=False,source=None):
+        """
+        pulls and converts the binary data of the spectrum or chromatogram between the supplied byte offsets
+        of the memory-mapped file (the output is the same as that of extract_spectrum)
+        the base64 strings are decoded directly from the mapped file
+        source: the raw XML to decode from instead of the mapped file (e.g. an element from streamelements())
+        """
+        import re
+        mm = self.mm if source is None else source
+        speclen = int(re.search(r'defaultArrayLength="(\d+)"',mm[start:mm.find('>',start)]).group(1)) # spectrum length (defined in the spectrum attributes)
+        out = []
+        if units is True:
+            units = []
+        arraytag = re.compile(r'<binaryDataArray\s')
+        binarytag = re.compile(r'<binary(/?)>')
+        match = arraytag.search(mm,start,end)
+        while match is not None:
+            binary = binarytag.search(mm,match.end(),end)
+            p = self.cvparam(mm[match.start():binary.start()]) # grab cvparameters
+            if binary.group(1) == '/': # empty array
+                out.append([])
+                pos = binary.end()
+            else:
+                pos = mm.find('</binary>',binary.end(),end)
+                out.append(self.decodebinary(buffer(mm,binary.end(),pos-binary.end()),p,speclen))
+            if units is not False:
+                units.append(p.unitname())
+            match = arraytag.search(mm,pos,end)
+        if units is not False: # extends the units onto out
+            out.extend(units)
+        return out
+    
     def extract_spectrum(self,spectrum,units=False):
         """pulls and converts binary data to list"""
         def gettext(nodelist):
@@ -619,35 +836,14 @@ class mzML(object):
                     rc.append(node.data)
             return ''.join(rc)
         
-        def decodeformat(p,speclen):
-            """determines the decode format from the accession parameter"""
-            formats = {
-            'MS:1000519':['<','i'], # signed 32-bit little-endian integer
-            #'MS:1000520':['',''], # [OBSOLETE] Signed 16-bit float
-            'MS:1000521':['<','f'], # 32-bit precision little-endian floating point conforming to IEEE-754
-            'MS:1000522':['<','l'], # Signed 64-bit little-endian integer
-            'MS:1000523':['<','d'], # 64-bit precision little-endian floating point conforming to IEEE-754.
-            }
-            for key in formats:
-                if p.has_key(key): # find accession number match
-                    return formats[key][0]+str(speclen)+formats[key][1]
-            
         speclen = int(spectrum.getAttribute('defaultArrayLength')) # spectrum length (defined in the spectrum attricubes)
         out = []
         if units is True:
             units = []
         for binary in spectrum.getElementsByTagName('binaryDataArray'):
             p = self.cvparam(binary) # grab cvparameters
-            if p.has_key('MS:1000574') is True: # determine whether the binary string is zlib compressed
-                compressed = True
-            else:
-                compressed = False
-            unpack_format = decodeformat(p,speclen) # determine unpack format
             string = gettext(binary.getElementsByTagName('binary')[0].childNodes) # pull the binary string
-            decoded = self.b64.decodestring(string) # decode the string
-            if compressed is True: # if the string is compressed, decompress
-                decoded = self.zlib.decompress(decoded)
-            out.append(list(self.st.unpack(unpack_format,decoded))) # unpack the string
+            out.append(self.decodebinary(string,p,speclen))
             if units is not False:
                 units.append(p.unitname())
         if units is not False: # extends the units onto out
@@ -661,6 +857,26 @@ class mzML(object):
             tf = self.os.path.isdir(filepath)
         return tf
         
+    def find_transition(self,q1,q3,fn=None,tol=0.5):
+        """
+        finds the selected reaction monitoring chromatogram of a transition
+        q1: precursor m/z
+        q3: product m/z
+        fn: the function of the transition (optional, adds specificity)
+        tol: tolerance of the m/z values
+        returns the id of the chromatogram
+        """
+        matches = []
+        for key in self.transitions:
+            if abs(self.transitions[key]['q1']-q1) <= tol and abs(self.transitions[key]['q3']-q3) <= tol:
+                if fn is None or self.transitions[key]['function'] == fn:
+                    matches.append(key)
+        if len(matches) == 0:
+            raise KeyError('There is no selected reaction monitoring chromatogram of the transition %s > %s in %s' %(str(q1),str(q3),self.filename))
+        if len(matches) > 1:
+            raise ValueError("The transition %s > %s matches more than one chromatogram in the mzML file (%s).\nTo process this species, assign it to a specific function number by adding a 'function' key to its dictionary." %(str(q1),str(q3),', '.join(sorted(matches))))
+        return matches[0]
+    
     def fix_extension(self,fn):
         """tries to fix invalid file extensions"""
         oopsx = {'.mzm':'l','.mz':'ml','.m':'zml','.':'mzml'} # incomplete mzml extensions
@@ -689,34 +905,40 @@ class mzML(object):
     
     def fps(self,branch):
         """
-        extracts function #, process #, and scan # from the idstring of a spectrum branch
+        extracts function #, process #, and scan # from the idstring of a spectrum branch (or the id string itself)
         returns function, process, scan as integers
         """
-        idstring = branch.getAttribute('id').split() # pull id string from scan attribute
+        if isinstance(branch,basestring):
+            idstring = branch.split()
+        else:
+            idstring = branch.getAttribute('id').split() # pull id string from scan attribute
         return [int(x.split('=')[1]) for x in idstring] # return each value after converting to integer
     
-    def function_timetic(self):
+    def function_timetic(self,validate=False):
         """
         extracts timepoints and tic lists for each function
-        this function is separate from mzml contents because it would increase load times significantly (~6x)
+        (the values are recorded from the spectrum headers by mzml_contents, this only distributes them to each function)
+        
+        total ion currents which are missing from the spectrum headers are read from the total ion current chromatogram
+        of the file, provided that the chromatogram has a point at the start time of every scan of the function
+        validate: checks that the total ion currents of the headers agree with those of the chromatogram
+            (raises ValueError if they do not)
         """
         for func in self.functions: # add timepoint and tic lists
             self.functions[func]['timepoints'] = [] # list for timepoints
             self.functions[func]['tic'] = [] # list for total ion current values
             if self.functions[func].has_key('level') and self.functions[func]['level'] > 1:
                 self.functions[func]['ce'] = [] # list for collision energies
-        for spectrum in self.tree.getElementsByTagName('spectrum'):
-            attr = self.attributes(spectrum)
-            func,proc,scan = self.fps(spectrum) # determine function, process, and scan numbers
-            if self.ks['verbose'] is True:
-                self.sys.stdout.write('\rExtracting timepoints and total ion current values from mzML %.1f%%' %(float(attr['index']+1)/float(self.nscans)*100.))
-            p = self.cvparam(spectrum) # pull spectrum's cvparameters
-            self.functions[func]['timepoints'].append(p['MS:1000016']) # start scan time
-            self.functions[func]['tic'].append(p['MS:1000285']) # total ion current
-            if p.has_key('MS:1000045'):
-                self.functions[func]['ce'].append(p['MS:1000045']) # collision energy
-        if self.ks['verbose'] is True:
-            self.sys.stdout.write(' DONE\n')
+        if self.scantable is None: # the headers have not been read yet
+            self.mzml_contents()
+        for func,time,tic,ce in self.scantable: # recorded from the headers of each spectrum
+            self.functions[func]['timepoints'].append(time) # start scan time
+            self.functions[func]['tic'].append(tic) # total ion current
+            if ce is not None:
+                self.functions[func]['ce'].append(ce) # collision energy
+        for func in self.functions:
+            if validate is True or None in self.functions[func]['tic']:
+                self.chromatogram_tic(func,validate)
         self.ks['ftt'] = True
             
     def integrate(self,name,start,end,x,y):
@@ -742,6 +964,162 @@ class mzML(object):
             self.BE.warn(name,start,end,min(x),max(x))
         return sum(y[self.locate_in_list(x,start,'greater'):self.locate_in_list(x,end,'lesser')]) # integrate using the nearest values inside the bounds        
     
+    def integrate_scan(self,sp,keys,func,x,y):
+        """integrates a decoded scan for each of the supplied species which are related to its function (see pull_species_data())"""
+        for key in keys:
+            if sp[key]['function'] == func: # if species is related to this function
+                if self.functions[func]['type'] == 'MS':
+                    sp[key]['raw'].append(self.integrate(key,sp[key]['bounds'][0],sp[key]['bounds'][1],x,y)) # integrate
+                    if type(sp[key].get('fitrows')) is list:
+                        sp[key]['fitrows'].append(self.resample(x,y,sp[key]['fitgrid'][0])) # sample on the fit grid
+                if self.functions[func]['type'] == 'UV':
+                    sp[key]['raw'].append(self.integrate(key,sp[key]['bounds'][0],sp[key]['bounds'][1],x,y)/1000000.) # integrates and divides by 1 million bring it into au
+    
+    def iterchromatograms(self,keys=None):
+        """
+        iterates through the chromatograms with the supplied ids (defaults to every chromatogram) in the order of the file
+        yields the id, the x list, the y list, and the units of the x and y values of each chromatogram
+        
+        the chromatograms are located with the byte offsets of the memory-mapped file, in the XML tree (if it has
+        already been parsed), or by streaming the file and keeping only the binary data of the chromatograms
+        """
+        if keys is None:
+            keys = self.chromindex.keys()
+        keys = sorted(keys,key=lambda key: self.chromindex[key])
+        if self.store is not None: # stored when the store was written
+            for key in keys:
+                chrom = self.store['header']['chromatograms'][key]
+                yield key,list(chrom['x']),list(chrom['y']),chrom['xunit'],chrom['yunit']
+            return
+        if self.mm is not None:
+            if self.index is None:
+                self.mapindex()
+            for key in keys:
+                first,last = self.index['chromatogram'][self.chromindex[key]]
+                x,y,xunit,yunit = self.extract_mapped(first,last,True)
+                yield key,x,y,xunit,yunit
+            return
+        if self.dom is not None:
+            chroms = self.dom.getElementsByTagName('chromatogram')
+            for key in keys:
+                x,y,xunit,yunit = self.extract_spectrum(chroms[self.chromindex[key]],True)
+                yield key,x,y,xunit,yunit
+            return
+        if self.filename.lower().endswith('.mzml.gz'): # if mzml is gzipped
+            import gzip
+            handle = gzip.open(self.filename) # unzip the file
+        else:
+            handle = open(self.filename,'rb')
+        try:
+            wanted = set([self.chromindex[key] for key in keys])
+            current = -1
+            for tag,text in self.streamelements(handle,binary=['chromatogram']):
+                if tag != 'chromatogram':
+                    continue
+                current += 1
+                if current in wanted:
+                    key = self.attributes(text)['id']
+                    x,y,xunit,yunit = self.extract_mapped(0,len(text),True,text)
+                    yield key,x,y,xunit,yunit
+                    wanted.remove(current)
+                    if len(wanted) == 0: # the remainder of the file is not needed
+                        break
+        finally:
+            handle.close()
+    
+    def iterheaders(self,tags=['spectrum'],raw=False):
+        """
+        iterates through the spectrum and/or chromatogram elements of the file without decoding their binary data
+        tags: the elements to return ('spectrum' and/or 'chromatogram')
+        raw: yield the XML of each element instead of interpreting it
+        yields the tag, the attributes, and the cvparameters of each element (excluding those of the binary data arrays)
+        (or the tag and the XML if raw is True)
+        
+        the binary data array lists are skipped rather than decoded or kept in memory (see streamelements())
+        """
+        if self.mm is not None: # the elements can be found directly in the mapped file
+            if self.index is None:
+                self.mapindex()
+            for tag in ['spectrum','chromatogram']:
+                if tag not in tags:
+                    continue
+                for first,last in self.index[tag]:
+                    text = self.maptext(first,last)
+                    if raw is True:
+                        yield tag,text
+                    else:
+                        yield tag,self.attributes(text),self.cvparam(text)
+            return
+        if self.filename.lower().endswith('.mzml.gz'): # if mzml is gzipped
+            import gzip
+            handle = gzip.open(self.filename) # unzip the file
+        else:
+            handle = open(self.filename,'rb')
+        try:
+            for tag,text in self.streamelements(handle):
+                if tag in tags and raw is True:
+                    yield tag,text
+                elif tag in tags:
+                    yield tag,self.attributes(text),self.cvparam(text)
+        finally:
+            handle.close()
+    
+    def iterscans(self,start=None,end=None):
+        """
+        iterates through the decoded scans with indicies between start and end (inclusive)
+        yields the scan index, the function number, and the x and y values of each scan
+        (lists, which are read from the memory-mapped arrays if the columnar store is being used)
+        the lists may be shared with the scan cache, so they should not be modified
+        """
+        if start is None:
+            start = 0
+        if end is None:
+            end = self.nscans-1
+        if self.scancache.budget > 0:
+            self.scancache.check(self.signature())
+        def cached(index,decode):
+            """returns the function, x, and y values of a scan from the cache (decoding and caching it if necessary)"""
+            if self.scancache.budget == 0:
+                return decode()
+            out = self.scancache.get(index)
+            if out is None:
+                out = decode()
+                self.scancache.put(index,*out)
+            return out
+        if self.store is not None:
+            offsets = self.store['offsets']
+            def decode():
+                return int(self.store['function'][index]),self.store['mz'][offsets[index]:offsets[index+1]].tolist(),self.store['intensity'][offsets[index]:offsets[index+1]].tolist()
+            for index in xrange(start,end+1):
+                func,x,y = cached(index,decode)
+                yield index,func,x,y
+            return
+        if self.mm is not None:
+            import re
+            if self.index is None:
+                self.mapindex()
+            def decode():
+                first,last = self.index['spectrum'][index]
+                tag = self.mm[first:self.mm.find('>',first)] # spectrum start tag
+                func,proc,scan = self.fps(re.search(r'\sid="([^"]*)"',tag).group(1)) # determine function, process, and scan numbers
+                x,y = self.extract_mapped(first,last)
+                return func,x,y
+            for index in xrange(start,end+1):
+                func,x,y = cached(index,decode)
+                yield index,func,x,y
+            return
+        def decode():
+            func,proc,scan = self.fps(spectrum) # determine function, process, and scan numbers
+            x,y = self.extract_spectrum(spectrum)
+            return func,x,y
+        for spectrum in self.tree.getElementsByTagName('spectrum'):
+            index = int(spectrum.getAttribute('index'))
+            if index > end:
+                break
+            if index >= start:
+                func,x,y = cached(index,decode)
+                yield index,func,x,y
+    
     def locate_in_list(self,lst,value,bias='closest'):
         """
         Finds index in a sorted list of the value closest to a given value
@@ -780,25 +1158,139 @@ class mzML(object):
             else:
                 return pos
     
+    def mapindex(self,start=0):
+        """
+        finds the byte offsets of every spectrum and chromatogram element in the memory-mapped file
+        self.index['spectrum'] and self.index['chromatogram'] are lists of (start,end) offsets in the order of the file
+        start: the offset to search from (the elements found are added to the existing index, see update())
+        """
+        import re
+        if start == 0 or self.index is None:
+            self.index = {'spectrum':[],'chromatogram':[]}
+        self.mapped = start
+        for match in re.compile(r'<(spectrum|chromatogram)\s').finditer(self.mm,start):
+            key = match.group(1)
+            end = self.mm.find('</%s>' %key,match.start())
+            if end == -1: # incomplete element (the file is still being written)
+                break
+            self.index[key].append((match.start(),end+len(key)+3))
+            self.mapped = end+len(key)+3
+    
+    def maptext(self,first,last):
+        """returns the XML of the element between the supplied byte offsets of the memory-mapped file less its binary data array list"""
+        skip = self.mm.find('<binaryDataArrayList',first,last)
+        if skip == -1:
+            return self.mm[first:last]
+        return self.mm[first:skip] + self.mm[self.mm.find('</binaryDataArrayList>',skip,last):last]
+    
     def mzml_contents(self):
         """finds the total number of scans, the number of chromatograms, and the scan range for each function in the mzml file"""
-        self.nscans = int(self.tree.getElementsByTagName('spectrumList')[0].getAttribute('count')) # number of spectra
-        self.nchroms = int(self.tree.getElementsByTagName('chromatogramList')[0].getAttribute('count')) # number of chromatograms
+        if self.store is not None: # stored when the store was written
+            header = self.store['header']
+            self.nscans = header['nscans']
+            self.nchroms = header['nchroms']
+            self.duration = header['duration']
+            self.functions = {}
+            for func in header['functions']:
+                self.functions[func] = dict(header['functions'][func])
+                self.functions[func]['sr'] = list(self.functions[func]['sr'])
+            self.precursors = [tuple(row) for row in header['precursors']]
+            self.pindex = None
+            self.chromindex = dict(header['chromindex'])
+            self.ticchrom = header['ticchrom']
+            self.transitions = dict(header['transitions'])
+            self.scantable = []
+            for row in zip(self.store['function'].tolist(),self.store['time'].tolist(),self.store['tic'].tolist(),self.store['ce'].tolist()):
+                self.scantable.append(tuple([None if val != val else val for val in row])) # missing values are stored as nan
+            return
+        if self.ks['verbose'] is True:
+            self.sys.stdout.write('Reading the spectrum headers of %s' %self.filename)
+            self.sys.stdout.flush()
+        self.nscans = 0 # number of spectra
+        self.nchroms = 0 # number of chromatograms
         self.functions = {}
-        for spectrum in self.tree.getElementsByTagName('spectrum'):
-            func,proc,scan = self.fps(spectrum) # extract each value and convert to integer
-            if func not in self.functions: # if function is not defined yet
-                p = self.cvparam(spectrum) # pull spectrum's cvparameters
-                self.functions[func] = {
-                'sr':[int(spectrum.getAttribute('index')),None], # the scan index range that the function spans
-                'nscans':1, # number of scans
-                }
-                self.functions[func].update(self.scan_properties(p)) # update with scan properties
+        self.scantable = []
+        self.precursors = []
+        self.pindex = None
+        self.chromindex = {}
+        self.ticchrom = None
+        self.transitions = {}
+        for tag,text in self.iterheaders(['spectrum','chromatogram'],True): # only the headers are read (binary data is skipped)
+            self.recordheader(tag,text)
+        self.duration = self.scantable[-1][1] if len(self.scantable) > 0 else 0. # final start scan time
+        if self.ks['verbose'] is True:
+            self.sys.stdout.write(' DONE\n')
+    
+    def openstore(self,path=None):
+        """
+        opens the columnar store of the file (see tostore())
+        returns a dictionary of the store header, the scan columns, and memory-maps of the m/z and intensity arrays
+        returns None if there is no store or if it was written from a different version of the file
+        """
+        import numpy as np
+        marshal = __import__('marshal')
+        if path is None:
+            path = self.storepath()
+        try:
+            handle = open(self.os.path.join(path,'header'),'rb')
+            try:
+                header = marshal.load(handle)
+            finally:
+                handle.close()
+        except (IOError,OSError,EOFError,ValueError,TypeError): # missing or unreadable
+            return None
+        if header.get('version') != self.storeversion or (header.get('size'),header.get('mtime')) != self.signature():
+            return None
+        out = {'header': header}
+        for key in ['offsets','function','time','tic','ce']:
+            out[key] = np.load(self.os.path.join(path,key+'.npy'))
+        for key in ['mz','intensity']:
+            if out['offsets'][-1] == 0: # memory-mapping an empty file fails
+                out[key] = np.zeros(0)
             else:
-                self.functions[func]['sr'][1] = int(spectrum.getAttribute('index')) # otherwise set the scan index range to the current index
-                self.functions[func]['nscans'] += 1
-        p = self.cvparam(spectrum) # pull properties of final spectrum
-        self.duration = p['MS:1000016'] # final start scan time
+                out[key] = np.memmap(self.os.path.join(path,key+'.bin'),dtype=np.float64,mode='r',shape=(int(out['offsets'][-1]),))
+        if self.ks['verbose'] is True:
+            self.sys.stdout.write('Reading %s from the columnar store %s\n' %(self.filename,path))
+        return out
+    
+    def precursor_scans(self,low,high=None,start=None,end=None,mode=None):
+        """
+        finds the MS/MS scans whose precursor isolation window overlaps an m/z range
+        
+        low: (float) the lower m/z of the range
+        high: (float) the upper m/z of the range (defaults to low, i.e. the windows containing that m/z)
+        start: (float) the earliest time of the scans (optional)
+        end: (float) the latest time of the scans (optional)
+        mode: '+' or '-' to limit the scans to one polarity (optional)
+        
+        returns a sorted list of scan indicies (the details of each precursor are in self.precursors)
+        
+        the windows are sorted by their lower bound, so only those with a lower bound between low minus the
+        widest window and high have to be checked (found by binary search)
+        """
+        import numpy as np
+        if high is None:
+            high = low
+        if self.pindex is None: # sort the isolation windows
+            rows = sorted([(target-lower,target+upper,time,str(polarity),index) for index,target,lower,upper,ce,time,polarity in self.precursors])
+            self.pindex = {
+            'lower': np.array([row[0] for row in rows],dtype=float),
+            'upper': np.array([row[1] for row in rows],dtype=float),
+            'time': np.array([row[2] for row in rows],dtype=float),
+            'mode': np.array([row[3] for row in rows]),
+            'scan': np.array([row[4] for row in rows],dtype=int),
+            }
+            self.pindex['width'] = (self.pindex['upper']-self.pindex['lower']).max() if len(rows) > 0 else 0.
+        left = np.searchsorted(self.pindex['lower'],low-self.pindex['width'],'left')
+        right = np.searchsorted(self.pindex['lower'],high,'right')
+        keep = self.pindex['upper'][left:right] >= low
+        if start is not None:
+            keep &= self.pindex['time'][left:right] >= start
+        if end is not None:
+            keep &= self.pindex['time'][left:right] <= end
+        if mode is not None:
+            keep &= self.pindex['mode'][left:right] == mode
+        return sorted(self.pindex['scan'][left:right][keep].tolist())
     
     def pull_chromatograms(self):
         """
@@ -813,14 +1305,19 @@ class mzML(object):
         'yunit': unit of the y values
         }
         """
+        if self.store is not None: # stored when the store was written
+            chroms = {}
+            for key in self.store['header']['chromatograms']:
+                chroms[key] = dict(self.store['header']['chromatograms'][key])
+                chroms[key]['x'] = list(chroms[key]['x'])
+                chroms[key]['y'] = list(chroms[key]['y'])
+            return chroms
         chroms = {} #dictionary of chromatograms
-        for chromatogram in self.tree.getElementsByTagName('chromatogram'):
-            attr = self.attributes(chromatogram) # pull attributes
+        for key,x,y,xunit,yunit in self.iterchromatograms(): # extract x list, y list, and units
             if self.ks['verbose'] is True:
-                self.sys.stdout.write('\rExtracting chromatogram #%s/%i  %.1f%%' %(attr['index']+1,self.nchroms,float(attr['index']+1)/float(self.nchroms)*100.))
+                self.sys.stdout.write('\rExtracting chromatogram #%s/%i  %.1f%%' %(self.chromindex[key]+1,self.nchroms,float(self.chromindex[key]+1)/float(self.nchroms)*100.))
                 self.sys.stdout.flush()
-            x,y,xunit,yunit = self.extract_spectrum(chromatogram,True) # extract x list, y list, and units
-            chroms[attr['id']] = {'x':x, 'y':y, 'xunit':xunit, 'yunit':yunit}
+            chroms[key] = {'x':x, 'y':y, 'xunit':xunit, 'yunit':yunit}
         if self.ks['verbose'] is True:
             self.sys.stdout.write(' DONE\n')
         return chroms
@@ -859,7 +1356,7 @@ class mzML(object):
         """
         self.sys.exit('The pullscansfromfn function is obsolete. Identify the appropriate function to sum from mzML.functions and use retrieve_scans instead.')
     
-    def pull_species_data(self,sp,sumspec=False):
+    def pull_species_data(self,sp,sumspec=False,fits=False):
         """
         Extracts integrated data at every timepoint for all species specified in the sp dictionary
         
@@ -870,16 +1367,24 @@ class mzML(object):
         'affin':['+' or '-' or 'UV'}, //which spectrum to look for this species in
         'level':integer, //if applicable, the MSn level (optional, but add specificity)
         'function':integer, //the specific function in which to find this species (optional; overrides affin and level)
+        'transition':[precursor m/z, product m/z], //(selected reaction monitoring) the trace is read from the chromatogram of the transition (replaces bounds)
         }
         
         sumspec: bool
             toggles summing of all spectra together (creates an additional output item)
             also sums the spectra of mass spectrum species to generate an isotope pattern used by the bounds
         
+        fits: bool
+            toggles sampling of every scan on the fit grid of species with a 'mol' key (Molecule object)
+            the samples can be scored against the predicted isotope pattern with the fitscores() method of the Molecule
+        
         output:
             filled dictionary, each subkey will have:
             'raw': list of raw integrated values dictacted by the bounds
             'function': the function that the species was associated with
+            'time' (transitions only): the time points of the chromatogram
+            'fitgrid' and 'fitrows' (if fits is true): the fit grid of the Molecule, and an array of the
+                intensities of every scan on that grid
             
             if sumspec is true, will also output a dictionary of Spectrum objects
             the keys of this dictionary are the function numbers
@@ -892,29 +1397,38 @@ class mzML(object):
             for fn in self.functions: # create spectrum objects for all MS species
                 if self.functions[fn]['type'] == 'MS':
                     spec[fn] = Spectrum(3)
+        scanned = [] # species which are integrated from the spectra
         for species in sp: # look for and assign function affinity
+            if sp[species].has_key('transition') is True: # served directly from the chromatogram of the transition
+                key = self.find_transition(sp[species]['transition'][0],sp[species]['transition'][1],sp[species].get('function'))
+                chrom = self.chromatogram(key)
+                sp[species]['function'] = self.transitions[key]['function']
+                sp[species]['raw'] = chrom['y'].tolist()
+                sp[species]['time'] = chrom['x'].tolist()
+                continue
+            scanned.append(species)
             sp[species]['function'] = self.associate_to_function(dct=sp[species]) # associate each species in the spectrum with a function
             if sp[species].has_key('raw') is False: # look for empty raw list
                 sp[species]['raw'] = []
+            if fits is True and sp[species].get('mol') is not None and self.functions[sp[species]['function']]['type'] == 'MS':
+                sp[species]['fitgrid'] = sp[species]['mol'].fitgrid()
+                sp[species]['fitrows'] = []
         if self.ks['ftt'] is False: # if timepoints and tic values have not been extracted yet, extract those
             self.function_timetic()
         self.BE = self.BoundsError() # load warning instance for integration
-        for spectrum in self.tree.getElementsByTagName('spectrum'):
-            func,proc,scan = self.fps(spectrum) # pull function, process, and scan numbers
-            attr = self.attributes(spectrum) # get attributes
+        for index,func,x,y in self.iterscans() if len(scanned) > 0 or sumspec is True else []: # decoded scans (not needed if every species is a transition)
             if self.ks['verbose'] is True:
-                self.sys.stdout.write('\rExtracting species data from spectrum #%d/%d  %.1f%%' %(attr['index']+1,self.nscans,float(attr['index']+1)/float(self.nscans)*100.))
-            x,y = self.extract_spectrum(spectrum) # generate spectrum
+                self.sys.stdout.write('\rExtracting species data from spectrum #%d/%d  %.1f%%' %(index+1,self.nscans,float(index+1)/float(self.nscans)*100.))
             if sumspec is True and func == 1:
                 spec[func].addspectrum(x,y)
-            for key in sp: # integrate each peak
-                if sp[key]['function'] == func: # if species is related to this function
-                    if self.functions[func]['type'] == 'MS':
-                        sp[key]['raw'].append(self.integrate(key,sp[key]['bounds'][0],sp[key]['bounds'][1],x,y)) # integrate
-                    if self.functions[func]['type'] == 'UV':
-                        sp[key]['raw'].append(self.integrate(key,sp[key]['bounds'][0],sp[key]['bounds'][1],x,y)/1000000.) # integrates and divides by 1 million bring it into au
-        if self.ks['verbose'] is True:
+            self.integrate_scan(sp,scanned,func,x,y) # integrate each peak
+        if self.ks['verbose'] is True and (len(scanned) > 0 or sumspec is True):
             self.sys.stdout.write(' DONE\n')
+        if fits is True:
+            import numpy as np
+            for key in sp:
+                if sp[key].has_key('fitrows') is True:
+                    sp[key]['fitrows'] = np.array(sp[key]['fitrows'])
         self.BE.printwarns() # print bounds warnings (if any)
         if sumspec is True:
             return sp,spec  
@@ -942,6 +1456,69 @@ class mzML(object):
         """
         self.sys.exit('The pullspectra function is obsolete. Identify the appropriate function to sum from mzML.functions and use retrieve_scans instead.')
         
+    def pull_traces(self,xics=None,fn=None,mute=False):
+        """
+        calculates the total ion current, base peak, and extracted ion chromatograms of each function in a single pass
+        
+        xics: dictionary of extracted ion chromatograms to calculate
+            xics = {name: [start m/z, end m/z], ...} //the intensities of every point within the bounds are summed
+        fn: the function to calculate the traces of (defaults to every function)
+        mute: override for the verbose toggle of the mzml instance
+        
+        returns a dictionary keyed by function, each with the arrays
+        'time': start time of each scan
+        'tic': total ion current (the sum of the intensities of the decoded scan, rather than the value of the spectrum header)
+        'bpc': base peak intensity
+        'bpmz': m/z of the base peak (nan for an empty scan)
+        'xic': dictionary of the extracted ion chromatograms keyed by name
+        
+        if the columnar store is being used, the traces are calculated from the whole store at once and kept in it
+        (so that they only have to be calculated once)
+        """
+        import numpy as np
+        if xics is None:
+            xics = {}
+        names = sorted(xics)
+        bounds = np.array([[float(xics[name][0]),float(xics[name][1])] for name in names]).reshape(-1,2)
+        if self.scantable is None:
+            self.mzml_contents()
+        scans = [index for index,row in enumerate(self.scantable) if fn is None or row[0] == fn]
+        if self.store is not None: # every scan is calculated from the memory-mapped arrays
+            columns = self.storetraces(bounds)
+            for key in columns:
+                columns[key] = columns[key][scans]
+        else:
+            columns = {'tic':np.zeros(len(scans)),'bpc':np.zeros(len(scans)),'bpmz':np.zeros(len(scans))*np.nan,'xic':np.zeros((len(scans),len(names)))}
+            row = dict([(index,ind) for ind,index in enumerate(scans)])
+            for index,func,x,y in self.iterscans(min(scans),max(scans)) if len(scans) > 0 else []:
+                if self.ks['verbose'] is True and mute is False:
+                    self.sys.stdout.write('\rCalculating traces of spectrum #%d/%d  %.1f%%' %(index+1,self.nscans,float(index+1)/float(self.nscans)*100.))
+                if index not in row or len(y) == 0:
+                    continue
+                x = np.asarray(x,dtype=np.float64)
+                y = np.asarray(y,dtype=np.float64)
+                total = np.concatenate(([0.],np.cumsum(y))) # cumulative intensity (each window is the difference of two values)
+                ind = int(np.argmax(y))
+                columns['tic'][row[index]] = total[-1]
+                columns['bpc'][row[index]] = y[ind]
+                columns['bpmz'][row[index]] = x[ind]
+                columns['xic'][row[index]] = total[np.searchsorted(x,bounds[:,1],'right')]-total[np.searchsorted(x,bounds[:,0],'left')]
+            if self.ks['verbose'] is True and mute is False and len(scans) > 0:
+                self.sys.stdout.write(' DONE\n')
+        columns['function'] = np.array([self.scantable[index][0] for index in scans],dtype=int)
+        columns['time'] = np.array([self.scantable[index][1] for index in scans],dtype=np.float64)
+        out = {}
+        for func in sorted(set(columns['function'].tolist())):
+            mask = columns['function'] == func
+            out[func] = {
+            'time': columns['time'][mask],
+            'tic': columns['tic'][mask],
+            'bpc': columns['bpc'][mask],
+            'bpmz': columns['bpmz'][mask],
+            'xic': dict([(name,columns['xic'][mask,ind]) for ind,name in enumerate(names)]),
+            }
+        return out
+    
     def pulluvspectra(self,sr=None,tr=None):
         """
         OBSOLETE (use retrieve_scans or sum_scans)
@@ -1026,6 +1603,76 @@ class mzML(object):
             subprocess.call(callstring)
         return outname
     
+    def recordheader(self,tag,text):
+        """
+        records the contents of a spectrum or chromatogram element from its XML (less its binary data)
+        (the function, scan table, precursor, and chromatogram details; see mzml_contents())
+        """
+        attr = self.attributes(text)
+        p = self.cvparam(text)
+        if tag == 'chromatogram':
+            self.chromindex[attr['id']] = self.nchroms
+            self.nchroms += 1
+            if p.has_key('MS:1000235') and self.ticchrom is None: # total ion current chromatogram
+                self.ticchrom = attr['id']
+            if p.has_key('MS:1001473') and text.find('<product') != -1: # selected reaction monitoring chromatogram
+                precursor = self.cvparam(text[text.find('<precursor'):text.find('</precursor>')])
+                product = self.cvparam(text[text.find('<product'):text.find('</product>')])
+                values = dict([item.split('=',1) for item in unicode(attr['id']).split() if '=' in item]) # e.g. 'SRM SIC Q1=200 Q3=100 function=2 offset=0'
+                self.transitions[attr['id']] = {
+                'function': int(values['function']) if values.has_key('function') else None,
+                'q1': precursor['MS:1000827'], # isolation window target m/z
+                'q3': product['MS:1000827'],
+                'ce': precursor['MS:1000045'] if precursor.has_key('MS:1000045') else None, # collision energy
+                }
+            return
+        self.nscans += 1
+        func,proc,scan = self.fps(attr['id']) # extract each value and convert to integer
+        if func not in self.functions: # if function is not defined yet
+            self.functions[func] = {
+            'sr':[attr['index'],None], # the scan index range that the function spans
+            'nscans':1, # number of scans
+            }
+            self.functions[func].update(self.scan_properties(p)) # update with scan properties
+        else:
+            self.functions[func]['sr'][1] = attr['index'] # otherwise set the scan index range to the current index
+            self.functions[func]['nscans'] += 1
+        self.scantable.append((
+        func,
+        p['MS:1000016'], # start scan time
+        p['MS:1000285'] if p.has_key('MS:1000285') else None, # total ion current
+        p['MS:1000045'] if p.has_key('MS:1000045') else None, # collision energy
+        ))
+        if p.has_key('MS:1000827') or p.has_key('MS:1000744'): # isolation window target m/z (or selected ion m/z)
+            if p.has_key('MS:1000129'):
+                mode = '-'
+            elif p.has_key('MS:1000130'):
+                mode = '+'
+            else:
+                mode = None
+            self.precursors.append((
+            attr['index'],
+            p['MS:1000827'] if p.has_key('MS:1000827') else p['MS:1000744'],
+            p['MS:1000828'] if p.has_key('MS:1000828') else 0., # isolation window lower offset
+            p['MS:1000829'] if p.has_key('MS:1000829') else 0., # isolation window upper offset
+            self.scantable[-1][3],
+            self.scantable[-1][1],
+            mode,
+            ))
+    
+    def resample(self,x,y,grid):
+        """
+        linearly interpolates a spectrum onto a sorted grid of x values (zero outside of the spectrum)
+        only the region of the spectrum around the grid is used
+        """
+        import numpy as np
+        from bisect import bisect_left,bisect_right
+        left = max(bisect_left(x,grid[0])-1,0)
+        right = bisect_right(x,grid[-1])+1
+        if right-left < 2:
+            return np.zeros(len(grid))
+        return np.interp(grid,x[left:right],y[left:right],left=0.,right=0.)
+    
     def retrieve_scans(self,start=None,end=None,fn=1,mute=False):
         """
         retrieves the specified scans or time range from the specified function
@@ -1053,22 +1700,21 @@ class mzML(object):
         if self.ks['ftt'] is False: # extract the timepoints and etc from the mzml
             self.function_timetic()
         out = []
-        for spectrum in self.tree.getElementsByTagName('spectrum'): # go through each spectrum
-            attr = self.attributes(spectrum)
-            # func,proc,scan = self.fps(spectrum) # determine function, process, and scan numbers
-            # p = self.cvparam(spectrum)
-            if attr['index'] > end:
-                break
+        for index,func,x,y in self.iterscans(start,end): # go through each spectrum within the index bounds
             if self.ks['verbose'] is True and mute is False:
-                self.sys.stdout.write('\rExtracting scan data from spectrum #%d/%d  %.1f%%' %(attr['index']+1,self.nscans,float(attr['index']+1)/float(self.nscans)*100.))
-            if attr['index'] >= start and attr['index'] <= end: # within the index bounds
-                out.append(self.extract_spectrum(spectrum))
+                self.sys.stdout.write('\rExtracting scan data from spectrum #%d/%d  %.1f%%' %(index+1,self.nscans,float(index+1)/float(self.nscans)*100.))
+            out.append([list(x),list(y)])
         if self.ks['verbose'] is True and mute is False:
             self.sys.stdout.write(' DONE\n')
         if len(out) == 0: # if only one scan, return that scan
             return out[0]
         return out
     
+    def scan(self,ind):
+        """returns the x and y values of the scan with the supplied index"""
+        for index,func,x,y in self.iterscans(ind,ind):
+            return [list(x),list(y)]
+    
     def scan_index(self,scan=None,fn=1,bias='lesser'):
         """
         determines the index for a scan or timepoint in a given function
@@ -1164,6 +1810,116 @@ class mzML(object):
                     raise KeyError('The script has not been coded to handle spectra types other than MS and UV-Vis. Please contact the authors to get this functionality included.')
         return out     
     
+    def signature(self):
+        """returns the size and modification time of the file (used to determine whether it has changed)"""
+        stat = self.os.stat(self.filename)
+        return stat.st_size,stat.st_mtime
+    
+    def storepath(self):
+        """returns the path of the columnar store of the file (a directory next to the file)"""
+        base = self.filename
+        if base.lower().endswith('.gz'):
+            base = base[:-3]
+        return self.os.path.splitext(base)[0]+'.store'
+    
+    def storetraces(self,bounds):
+        """
+        calculates the total ion current, base peak intensity and m/z, and extracted ion chromatograms (bounds, an array of
+        [start,end] pairs) of every scan in the columnar store with whole-array operations (see pull_traces())
+        the results are kept in the store directory (traces.npy and an xic_*.npy file for each pair of bounds) and are
+        read from there on subsequent calls
+        """
+        import numpy as np
+        path = self.storepath()
+        offsets = self.store['offsets']
+        x = self.store['mz']
+        y = self.store['intensity']
+        starts = offsets[:-1][offsets[1:] > offsets[:-1]] # the first point of every scan which is not empty
+        filled = offsets[1:] > offsets[:-1]
+        def segmentsum(values):
+            """sums the values of each scan (empty scans are zero)"""
+            out = np.zeros(len(filled))
+            if len(starts) > 0:
+                out[filled] = np.add.reduceat(values,starts)
+            return out
+        try:
+            traces = np.load(self.os.path.join(path,'traces.npy'))
+        except (IOError,OSError,ValueError):
+            traces = np.zeros((len(filled),3))
+            traces[:,2] = np.nan
+            traces[:,0] = segmentsum(y)
+            if len(starts) > 0:
+                traces[filled,1] = np.maximum.reduceat(y,starts)
+                scan = np.repeat(np.arange(len(filled)),np.diff(offsets)) # the scan of each point
+                first = np.where(y == traces[scan,1],np.arange(len(y)),len(y)) # position of each base peak
+                traces[filled,2] = x[np.minimum.reduceat(first,starts)]
+            try:
+                np.save(self.os.path.join(path,'traces.npy'),traces)
+            except (IOError,OSError): # the store is read-only, the traces are calculated each time
+                pass
+        out = {'tic':traces[:,0],'bpc':traces[:,1],'bpmz':traces[:,2],'xic':np.zeros((len(filled),len(bounds)))}
+        for ind,(start,end) in enumerate(bounds):
+            name = self.os.path.join(path,'xic_%r_%r.npy' %(start,end))
+            try:
+                out['xic'][:,ind] = np.load(name)
+            except (IOError,OSError,ValueError):
+                out['xic'][:,ind] = segmentsum(np.where((x >= start) & (x <= end),y,0.))
+                try:
+                    np.save(name,out['xic'][:,ind])
+                except (IOError,OSError):
+                    pass
+        return out
+    
+    def streamelements(self,handle,chunksize=1048576,binary=[]):
+        """
+        reads a file handle in chunks and yields the tag and text of every spectrum and chromatogram element
+        with their binary data array lists removed
+        only the current element (less its binary data) and one chunk of the file are held in memory
+        binary: the elements whose binary data array lists are kept ('spectrum' and/or 'chromatogram')
+        """
+        import re
+        opening = re.compile(r'<(spectrum|chromatogram)\s')
+        buf = ''
+        tag = None # the element currently being read
+        skipping = False # whether a binary data array list is being skipped
+        pieces = [] # text of the current element
+        while True:
+            if tag is None: # look for the start of the next element
+                match = opening.search(buf)
+                if match is not None:
+                    tag = match.group(1)
+                    buf = buf[match.start():]
+                    pieces = []
+                    continue
+                buf = buf[-20:] # keep enough to find a tag split between chunks
+            elif skipping is True: # look for the end of the binary data
+                end = buf.find('</binaryDataArrayList>')
+                if end != -1:
+                    buf = buf[end:]
+                    skipping = False
+                    continue
+                buf = buf[-21:]
+            else: # look for the binary data or the end of the element
+                skip = buf.find('<binaryDataArrayList') if tag not in binary else -1
+                close = buf.find('</%s>' %tag)
+                if close != -1 and (skip == -1 or close < skip):
+                    pieces.append(buf[:close+len(tag)+3])
+                    yield tag,''.join(pieces)
+                    buf = buf[close+len(tag)+3:]
+                    tag = None
+                    continue
+                if skip != -1:
+                    pieces.append(buf[:skip])
+                    buf = buf[skip:]
+                    skipping = True
+                    continue
+                pieces.append(buf[:-21])
+                buf = buf[-21:]
+            chunk = handle.read(chunksize)
+            if len(chunk) == 0: # end of file (an incomplete final element is not returned)
+                return
+            buf += chunk
+    
     def sum_scans(self,start=None,end=None,fn=1,dec=3,mute=False):
         """
         sums the specified scans together
@@ -1195,24 +1951,220 @@ class mzML(object):
         from _Spectrum import Spectrum
         spec = Spectrum(dec,self.functions[fn]['window'][0],self.functions[fn]['window'][1]) # create Spectrum object
         
-        for spectrum in self.tree.getElementsByTagName('spectrum'): # go through each spectrum
-            attr = self.attributes(spectrum) # get attributes
-            if attr['index'] > end:
-                break
+        for index,func,x,y in self.iterscans(start,end): # go through each spectrum within the specified bounds
             if self.ks['verbose'] is True and mute is False:
-                self.sys.stdout.write('\rCombining spectrum #%d (scan range: %d-%d)  %.1f%%' %(attr['index']+1,start,end,(float(attr['index']-start))/(float(end-start))*100.))
-            if attr['index'] >= start and attr['index'] <= end: # if within the specified bounds
-                x,y = self.extract_spectrum(spectrum) # pull spectrum
-                spec.addspectrum(x,y) # add spectrum to Spectrum object
+                self.sys.stdout.write('\rCombining spectrum #%d (scan range: %d-%d)  %.1f%%' %(index+1,start,end,(float(index-start))/(float(end-start))*100.))
+            spec.addspectrum(x,y) # add spectrum to Spectrum object
         out = spec.trim()
         if self.ks['verbose'] is True and mute is False:
             self.sys.stdout.write(' DONE\n')
         return out
 
+    def sum_scans_by_ce(self,fn=None,dec=1,start=None,end=None,threshold=0.,mute=False):
+        """
+        sums the scans of an MS/MS function by collision energy in a single pass
+        
+        fn: the function to sum (defaults to the first MS/MS function)
+        dec: number of decimal places to bin the m/z values to
+        start: the lowest m/z to keep (defaults to the start of the scan window)
+        end: the highest m/z to keep (defaults to the end of the scan window)
+        threshold: summed intensities below this value are set to zero
+        mute: override for the verbose toggle of the mzml instance
+        
+        returns a list of collision energies, an array of m/z values, and a matrix of the summed intensities
+        (one row for each collision energy)
+        only the matrix is held in memory; the scans are decoded and added one at a time
+        """
+        import numpy as np
+        if fn is None:
+            for func in sorted(self.functions):
+                if self.functions[func]['type'] == 'MS' and self.functions[func].get('level',1) > 1:
+                    fn = func
+                    break
+            else:
+                raise ValueError('There is no MS/MS function in this mzML file')
+        if start is None:
+            start = self.functions[fn]['window'][0]
+        if end is None:
+            end = self.functions[fn]['window'][1]
+        step = 10.**-dec
+        mz = np.round(np.arange(int(round((end-start)/step))+1)*step+start,dec)
+        index = self.ce_index(fn)
+        ces = sorted(index)
+        row = {} # row of the matrix for each scan
+        for ind,ce in enumerate(ces):
+            for scan in index[ce]:
+                row[scan] = ind
+        matrix = np.zeros((len(ces),len(mz)))
+        if len(row) > 0:
+            for scan,func,x,y in self.iterscans(min(row),max(row)):
+                if self.ks['verbose'] is True and mute is False:
+                    self.sys.stdout.write('\rSumming spectrum #%d by collision energy %.1f%%' %(scan+1,float(scan-min(row)+1)/float(max(row)-min(row)+1)*100.))
+                if scan not in row:
+                    continue
+                bins = np.round((np.asarray(x,dtype=float)-start)/step).astype(int)
+                keep = (bins >= 0) & (bins < len(mz))
+                matrix[row[scan]] += np.bincount(bins[keep],weights=np.asarray(y,dtype=float)[keep],minlength=len(mz))
+            if self.ks['verbose'] is True and mute is False:
+                self.sys.stdout.write(' DONE\n')
+        if threshold > 0:
+            matrix[matrix < threshold] = 0.
+        return ces,mz,matrix
+    
+    def tostore(self,path=None):
+        """
+        decodes every scan in the file and writes them into a columnar store for repeated analysis
+        
+        path: the directory to write the store into (defaults to the file name with a .store extension)
+        
+        the store holds the m/z and intensity values of every scan concatenated into two flat binary files
+        (mz.bin and intensity.bin, 64-bit floats), the offset of each scan into those arrays and the time,
+        function, total ion current, and collision energy of each scan (as .npy files), and a header with the
+        contents of the file and its chromatograms
+        the store is memory-mapped when the mzML is opened with store=True, so extraction is limited by
+        disk bandwidth rather than by parsing and decoding
+        
+        returns the path to the store
+        """
+        import numpy as np
+        marshal = __import__('marshal')
+        if path is None:
+            path = self.storepath()
+        if self.os.path.isdir(path) is False:
+            self.os.makedirs(path)
+        headerpath = self.os.path.join(path,'header')
+        if self.os.path.isfile(headerpath) is True: # the header is written last, so an interrupted write leaves an invalid store
+            self.os.remove(headerpath)
+        for name in self.os.listdir(path): # traces calculated from a previous version of the store (see pull_traces())
+            if name == 'traces.npy' or name.startswith('xic_'):
+                self.os.remove(self.os.path.join(path,name))
+        columns = {'offsets':[0],'function':[],'time':[],'tic':[],'ce':[]}
+        handles = {'mz':open(self.os.path.join(path,'mz.bin'),'wb'),'intensity':open(self.os.path.join(path,'intensity.bin'),'wb')}
+        try:
+            for index,func,x,y in self.iterscans():
+                if self.ks['verbose'] is True:
+                    self.sys.stdout.write('\rWriting spectrum #%d/%d to the columnar store %.1f%%' %(index+1,self.nscans,float(index+1)/float(self.nscans)*100.))
+                np.asarray(x,dtype=np.float64).tofile(handles['mz'])
+                np.asarray(y,dtype=np.float64).tofile(handles['intensity'])
+                columns['offsets'].append(columns['offsets'][-1]+len(x))
+                columns['function'].append(func)
+                for key,value in zip(['time','tic','ce'],self.scantable[index][1:]): # recorded from the spectrum headers
+                    if value is None:
+                        value = float('nan')
+                    columns[key].append(value)
+        finally:
+            for key in handles:
+                handles[key].close()
+        if self.ks['verbose'] is True:
+            self.sys.stdout.write(' DONE\n')
+        for key,dtype in [('offsets',np.int64),('function',np.int32),('time',np.float64),('tic',np.float64),('ce',np.float64)]:
+            np.save(self.os.path.join(path,key+'.npy'),np.array(columns[key],dtype=dtype))
+        size,mtime = self.signature()
+        header = {
+        'version': self.storeversion,
+        'source': self.os.path.basename(self.filename),
+        'size': size,
+        'mtime': mtime,
+        'nscans': self.nscans,
+        'nchroms': self.nchroms,
+        'duration': self.duration,
+        'functions': self.functions,
+        'precursors': self.precursors,
+        'chromindex': self.chromindex,
+        'ticchrom': self.ticchrom,
+        'transitions': self.transitions,
+        'chromatograms': self.pull_chromatograms(),
+        }
+        handle = open(headerpath,'wb')
+        try:
+            marshal.dump(header,handle)
+        finally:
+            handle.close()
+        return path
+    
+    @property
+    def tree(self):
+        """the XML tree of the mzML file (parsed on first access)"""
+        if self.dom is None:
+            if self.ks['verbose'] is True:
+                self.sys.stdout.write('Loading %s into memory' %self.filename)
+                self.sys.stdout.flush()
+            if self.filename.lower().endswith('.mzml.gz'): # if mzml is gzipped
+                import gzip
+                handle = gzip.open(self.filename) # unzip the file
+            else:
+                handle = self.filename
+            import xml.dom.minidom
+            try:
+                self.dom = xml.dom.minidom.parse(handle) # full mzML file
+            except:
+                raise IOError('The mzML file "%s" could not be loaded. The file is either unsupported, corrupt, or incomplete.' %self.filename)
+            if self.ks['verbose'] is True:
+                self.sys.stdout.write(' DONE\n')
+        return self.dom
+    
     def trimspectrum(self,x,y,left,right):
         """trims a spectrum to the left and right bounds"""
         l,r = self.locate_in_list(x,left,'greater'),self.locate_in_list(x,right,'lesser') # find indicies
         return x[l:r],y[l:r] # trim spectrum
+    
+    def update(self,sp=None,sumspec=None):
+        """
+        reads the spectra which have been appended to the file since it was opened (or last updated)
+        requires the mzML to have been opened with follow=True
+        
+        sp: a species dictionary returned by pull_species_data (the raw traces are extended with the new scans)
+        sumspec: a dictionary of Spectrum objects returned by pull_species_data (the new scans are added to them)
+        
+        the file is searched from the end of the last complete element, so the time taken is proportional to the new data
+        the scan table, functions, precursors, chromatogram index, and the timepoints and tic lists of each function
+        (if they have been extracted) are extended
+        (fit rows of the species are not extended)
+        
+        returns a list of the indicies of the new scans
+        """
+        import mmap
+        if self.ks['follow'] is False:
+            raise ValueError('The mzML file "%s" was not opened with follow=True' %self.filename)
+        if self.index is None:
+            self.mapindex()
+        new = {'spectrum': len(self.index['spectrum']), 'chromatogram': len(self.index['chromatogram'])}
+        handle = open(self.filename,'rb')
+        try:
+            self.mm = mmap.mmap(handle.fileno(),0,access=mmap.ACCESS_READ) # map the current length of the file
+        finally:
+            handle.close()
+        self.mapindex(self.mapped)
+        first = len(self.scantable)
+        for tag in ['spectrum','chromatogram']:
+            for start,end in self.index[tag][new[tag]:]:
+                self.recordheader(tag,self.maptext(start,end))
+        self.pindex = None
+        if len(self.scantable) > 0:
+            self.duration = self.scantable[-1][1]
+        if self.ks['ftt'] is True: # extend the timepoints and tic lists
+            for func,time,tic,ce in self.scantable[first:]:
+                if self.functions[func].has_key('timepoints') is False: # the function first appeared in this update
+                    self.functions[func]['timepoints'] = []
+                    self.functions[func]['tic'] = []
+                    if self.functions[func].has_key('level') and self.functions[func]['level'] > 1:
+                        self.functions[func]['ce'] = []
+                self.functions[func]['timepoints'].append(time)
+                self.functions[func]['tic'].append(tic)
+                if ce is not None:
+                    self.functions[func]['ce'].append(ce)
+        self.scancache.signature = self.signature() # the scans which were already cached are unchanged
+        if len(self.scantable) > first and (sp is not None or sumspec is not None):
+            self.BE = self.BoundsError() # load warning instance for integration
+            keys = [key for key in sp if sp[key].has_key('transition') is False] if sp is not None else []
+            for index,func,x,y in self.iterscans(first,len(self.scantable)-1):
+                if sumspec is not None and func == 1: # as in pull_species_data
+                    sumspec[func].addspectrum(x,y)
+                self.integrate_scan(sp,keys,func,x,y)
+            self.BE.printwarns() # print bounds warnings (if any)
+        if self.ks['verbose'] is True:
+            self.sys.stdout.write('%d new spectra were read from %s\n' %(len(self.scantable)-first,self.filename))
+        return range(first,len(self.scantable))
                     
 if __name__ == '__main__':
     filename = 'MultiTest'
@@ -80,9 +80,9 @@ def mia(filename,dec=0):
             else:
                 out[newkey] = losses[key]
         if custom_losses is not None: # if supplied with a custom list of losses
-            from _classes._Molecule import Molecule
+            from _classes._FrozenMolecule import FrozenMolecule
             for item in custom_losses:
-                mol = Molecule(item)
+                mol = FrozenMolecule(item)
                 key = round(mol.em,dec)
                 if dec == 0:
                     key = int(key)
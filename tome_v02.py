@@ -3,6 +3,7 @@ Tome v02 A compilation of all Lars' python scripts as callable functions
 
 functions:
     autoresolution (estimates the resolution of a spectrum)
+    binarray (bins one or more traces for several bin sizes at once, optionally with a sliding window)
     bindata (bins a list of values)
     binnspectra (bins n mass spectra together into a single mass spectrum)
     bincidspectra (bins mass spectra together based on their collision voltage)
@@ -35,6 +36,8 @@ changelog:
     rewrote resolution again to check multiple portions of the spectrum
     significant change to plotms
     moved alpha to XLSX class
+    added binarray (numpy binning of many traces and bin sizes at once) and rewrote bindata to use it
+    bindata has optional sliding window and trailing remainder (drop, partial, scale) behaviour
     ---v02---
 """
 # ----------------------------------------------------------
@@ -114,26 +117,80 @@ def autoresolution(x,y,v=True):
         sys.stdout.write(': %.1f\n' %res)
     return res # return average
 
-def bindata(n,v,lst):
+def binarray(ns,values,average=False,sliding=False,remainder='drop'):
+    """
+    Function for summing every n consecutive values of one or more traces for several values of n at once
+    
+    ns is the number of values to sum (integer or list of integers)
+    values is a list of values, or a 2D array (or list of equal length lists) with one trace per row
+    average divides each sum by the number of values in it (e.g. for time values)
+    sliding sums a window of n values starting at every value rather than consecutive bins (the trace is not decimated)
+    remainder sets what is done with the trailing values which do not fill a bin (or window)
+        'drop': they are dropped
+        'partial': they are summed as a bin of fewer values
+        'scale': they are summed and scaled up to n values
+    
+    output: dictionary of numpy arrays keyed by n (each with a row for each trace)
+    """
+    import numpy as np
+    if remainder not in ['drop','partial','scale']:
+        raise ValueError('The remainder "%s" is not valid (drop, partial, or scale).' %str(remainder))
+    if type(ns) != list and type(ns) != tuple:
+        ns = [ns]
+    values = np.asarray(values)
+    length = values.shape[-1]
+    cumulative = None
+    out = {}
+    for n in ns:
+        if n < 1:
+            raise ValueError('The number of values to sum (%s) is less than 1.' %str(n))
+        if sliding is False: # sum consecutive bins
+            full = length//n
+            bins = values[...,:full*n].reshape(values.shape[:-1]+(full,n))
+            sums = bins[...,0].copy()
+            for ind in range(1,n): # accumulated in order (the sums are identical to summing each list in turn)
+                sums += bins[...,ind]
+            counts = np.repeat(n,full)
+            if remainder != 'drop' and full*n < length: # trailing partial bin
+                partial = values[...,full*n].copy()
+                for ind in range(full*n+1,length):
+                    partial += values[...,ind]
+                sums = np.concatenate((sums,partial[...,np.newaxis]),axis=-1)
+                counts = np.append(counts,length-full*n)
+        else: # differences of the cumulative sum (calculated once for every n)
+            if cumulative is None:
+                cumulative = np.cumsum(values,axis=-1)
+                cumulative = np.concatenate((np.zeros(values.shape[:-1]+(1,),dtype=cumulative.dtype),cumulative),axis=-1)
+            starts = np.arange(length if remainder != 'drop' else max(length-n+1,0))
+            ends = np.minimum(starts+n,length)
+            sums = cumulative[...,ends]-cumulative[...,starts]
+            counts = ends-starts
+        if average is True:
+            sums = sums/counts.astype(float)
+        elif remainder == 'scale' and (counts < n).any() == True:
+            sums = sums*(float(n)/counts)
+        out[n] = sums
+    return out
+
+def bindata(n,v,lst,sliding=False,remainder='drop'):
     """
     Function for summing a supplied list of data (binning)
     
-    input (n,v,lst,name)
+    input (n,v,lst)
     n is number of values to sum
     v is equal to n if an average value is required (e.g. for time values, usually it is equal to 1)
     lst is the list of values for combination
+    sliding sums a window of n values starting at every value (see binarray)
+    remainder sets what is done with trailing values which do not fill a bin (drop, partial, or scale; see binarray)
     """
-    out = []
-    delta = 0
-    ttemp = 0
-    for ind,val in enumerate(lst):
-        delta += 1
-        ttemp += val # add current value to growing sum
-        if delta == n: # critical number is reached
-            out.append(ttemp/v) # append sum to list
-            delta = 0 # reset critical count and sum
-            ttemp = 0
-    return out
+    if len(lst) == 0:
+        return []
+    if v == n and n != 1: # average over the values in each bin
+        return binarray(n,lst,True,sliding,remainder)[n].tolist()
+    out = binarray(n,lst,False,sliding,remainder)[n]
+    if v != 1:
+        out = out/v
+    return out.tolist()
 
 def binnspectra(lst,n,dec=3,startmz=50.,endmz=2000.):
     """
@@ -402,7 +459,7 @@ def plotms(realspec,simdict={},**kwargs):
             
     import sys
     from _classes._Colour import Colour
-    from _classes._Molecule import Molecule
+    from _classes._FrozenMolecule import FrozenMolecule
     from tome_v02 import autoresolution,normalize
     import pylab as pl
     from bisect import bisect_left as bl
@@ -457,12 +514,11 @@ def plotms(realspec,simdict={},**kwargs):
     simdict = checksimdict(simdict) # checks the simulation dictionary
     for species in simdict: # generate Molecule object and set x and y lists
         simdict[species]['colour'] = Colour(simdict[species]['colour'])
-        simdict[species]['mol'] = Molecule(species, res=res) 
+        simdict[species]['mol'] = FrozenMolecule(species, res=res) # shared with any other calls for this species
         if settings['simtype'] == 'bar':
-            simdict[species]['x'],simdict[species]['y'] = simdict[species]['mol'].barip
+            simdict[species]['x'],simdict[species]['y'] = [list(lst) for lst in simdict[species]['mol'].barip] # copies (normalize modifies in place)
         if settings['simtype'] == 'gaussian':
-            simdict[species]['mol'].gaussianisotopepattern()
-            simdict[species]['x'],simdict[species]['y'] = simdict[species]['mol'].gausip
+            simdict[species]['x'],simdict[species]['y'] = [list(lst) for lst in simdict[species]['mol'].gaussianisotopepattern()]
         
     if settings['mz'] == 'auto': # automatically determine m/z range
         if settings['verbose'] is True: